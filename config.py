@@ -10,16 +10,35 @@ ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin123")
 
 # Database Configuration
 DATABASE_URL = os.getenv("DATABASE_URL")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "40"))
+DB_POOL_RECYCLE_SEC = int(os.getenv("DB_POOL_RECYCLE_SEC", "1800"))
+# Compiled SQL statements kept per engine; the bot issues more distinct queries than the default 500
+DB_QUERY_CACHE_SIZE = int(os.getenv("DB_QUERY_CACHE_SIZE", "1200"))
+# Updates that may hold their own database session at once; keep it at or below DB_POOL_SIZE
+DB_UPDATE_SESSION_LIMIT = int(os.getenv("DB_UPDATE_SESSION_LIMIT", "20"))
 
 # Application Settings
 RESERVATION_TIMEOUT_MIN = int(os.getenv("RESERVATION_TIMEOUT_MIN", "20"))
 POLL_INTERVAL_SEC = int(os.getenv("POLL_INTERVAL_SEC", "5"))
 DEFAULT_REWARD_AMOUNT = float(os.getenv("DEFAULT_REWARD_AMOUNT", "5.0"))
 PAGE_SIZE = int(os.getenv("PAGE_SIZE", "10"))
+# Services per admin inventory page, each listing up to 5 countries
+INVENTORY_SERVICES_PAGE_SIZE = int(os.getenv("INVENTORY_SERVICES_PAGE_SIZE", "5"))
 
 # Provider API Settings
 PROVIDER_API_TIMEOUT = int(os.getenv("PROVIDER_API_TIMEOUT", "30"))
 
+# Telegram API Connection Settings
+TELEGRAM_CONNECTION_LIMIT = int(os.getenv("TELEGRAM_CONNECTION_LIMIT", "100"))
+TELEGRAM_CONNECTION_LIMIT_PER_HOST = int(os.getenv("TELEGRAM_CONNECTION_LIMIT_PER_HOST", "50"))
+TELEGRAM_KEEPALIVE_TIMEOUT_SEC = int(os.getenv("TELEGRAM_KEEPALIVE_TIMEOUT_SEC", "75"))
+TELEGRAM_REQUEST_TIMEOUT_SEC = float(os.getenv("TELEGRAM_REQUEST_TIMEOUT_SEC", "60"))
+
 # Group Message Processing Settings
 HMAC_SECRET = os.getenv("HMAC_SECRET", "default_hmac_secret_key")
 MESSAGE_TIMESTAMP_WINDOW_MIN = int(os.getenv("MESSAGE_TIMESTAMP_WINDOW_MIN", "5"))
+
+# Development Settings
+QUERY_LOG_ENABLED = os.getenv("QUERY_LOG_ENABLED", "false").lower() == "true"
+QUERY_LOG_THRESHOLD = int(os.getenv("QUERY_LOG_THRESHOLD", "5"))
@@ -5,24 +5,38 @@ import json
 import csv
 import io
 import hmac
+import html
 import hashlib
+import sys
+import threading
 import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from decimal import Decimal
+from types import MappingProxyType
 
 import aiohttp
-from aiogram import Bot, Dispatcher, types, F
+from aiogram import Bot, Dispatcher, BaseMiddleware, types, F
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from sqlalchemy import create_engine, and_, or_
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy import create_engine, and_, or_, func, literal_column, select, update, event as sa_event, text as sql_text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import sessionmaker, scoped_session, joinedload, contains_eager, aliased, load_only
 from sqlalchemy.exc import SQLAlchemyError
 
+try:
+    import orjson  # Faster JSON encoding for stored payloads
+except ImportError:
+    orjson = None
+
 from models import (
     Base, User, Service, ServiceCountry, Number, Provider, ServiceProviderMap,
     Reservation, Transaction, Channel, UserChannelReward, Group, UserGroupReward,
@@ -34,12 +48,15 @@ from models import (
 # Use ServiceCountry as Country for admin purposes
 Country = ServiceCountry
 from config import (
-    BOT_TOKEN, ADMIN_ID, ADMIN_PASSWORD, DATABASE_URL, RESERVATION_TIMEOUT_MIN,
-    POLL_INTERVAL_SEC, DEFAULT_REWARD_AMOUNT, PAGE_SIZE, PROVIDER_API_TIMEOUT,
-    HMAC_SECRET, MESSAGE_TIMESTAMP_WINDOW_MIN
+    BOT_TOKEN, ADMIN_ID, ADMIN_PASSWORD, DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW,
+    DB_POOL_RECYCLE_SEC, DB_QUERY_CACHE_SIZE, DB_UPDATE_SESSION_LIMIT, RESERVATION_TIMEOUT_MIN,
+    POLL_INTERVAL_SEC, DEFAULT_REWARD_AMOUNT, PAGE_SIZE, INVENTORY_SERVICES_PAGE_SIZE,
+    PROVIDER_API_TIMEOUT, HMAC_SECRET, MESSAGE_TIMESTAMP_WINDOW_MIN, TELEGRAM_CONNECTION_LIMIT,
+    TELEGRAM_CONNECTION_LIMIT_PER_HOST, TELEGRAM_KEEPALIVE_TIMEOUT_SEC, TELEGRAM_REQUEST_TIMEOUT_SEC,
+    QUERY_LOG_ENABLED, QUERY_LOG_THRESHOLD
 )
 from translations import translator, t, SUPPORTED_LANGUAGES
-from commands import set_bot_commands, get_text
+from commands import set_bot_commands, get_text, get_texts
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -48,18 +65,243 @@ logger = logging.getLogger(__name__)
 # Database setup
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is required")
-engine = create_engine(DATABASE_URL, echo=False)
-SessionLocal = scoped_session(sessionmaker(bind=engine))
+# Pooled connections, checked before use and recycled before server-side idle timeouts
+engine = create_engine(
+    DATABASE_URL,
+    echo=False,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    pool_recycle=DB_POOL_RECYCLE_SEC,
+    query_cache_size=DB_QUERY_CACHE_SIZE
+)
+
+# Session registry key: each update gets its own session on the event loop thread, so concurrent handlers
+# no longer share (and close or roll back) one session; worker threads and background loops stay per-thread
+session_scope: ContextVar[Optional[object]] = ContextVar("session_scope", default=None)
+
+def current_session_scope():
+    """Key the scoped session by update on the event loop thread and by thread everywhere else"""
+    scope = session_scope.get()
+    if scope is None or threading.current_thread() is not threading.main_thread():
+        return threading.get_ident()
+    return scope
+
+SessionLocal = scoped_session(sessionmaker(bind=engine), scopefunc=current_session_scope)
+
+# Updates holding a session at once. Waiting for a slot is async, whereas an exhausted pool would block the
+# loop in checkout: these slots, the loop's background session and the to_thread workers (at most 32)
+# must fit in pool_size + max_overflow
+update_session_slots = asyncio.Semaphore(DB_UPDATE_SESSION_LIMIT)
+
+class TelegramHttpSession(AiohttpSession):
+    """aiogram session whose aiohttp connector keeps per-host limits, keep-alive and a DNS cache"""
+    
+    def __init__(self, connection_limit: int, **kwargs):
+        super().__init__(limit=connection_limit, **kwargs)
+        # aiogram builds its connector from these options, so its headers, proxy and json handling stay intact
+        self._connector_init.update(
+            limit_per_host=TELEGRAM_CONNECTION_LIMIT_PER_HOST,
+            keepalive_timeout=TELEGRAM_KEEPALIVE_TIMEOUT_SEC,
+            ttl_dns_cache=300
+        )
 
-# Bot setup
-bot = Bot(token=BOT_TOKEN)
+# Bot setup - one pooled keep-alive HTTP session shared by all Telegram API calls
+bot_session = TelegramHttpSession(TELEGRAM_CONNECTION_LIMIT, timeout=TELEGRAM_REQUEST_TIMEOUT_SEC)
+bot = Bot(token=BOT_TOKEN, session=bot_session)
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
 
+class DatabaseSessionMiddleware(BaseMiddleware):
+    """Give each update its own session: the handler and the helpers it calls on the loop share it,
+    and it is removed (connection returned to the pool) when the update is done"""
+    
+    async def __call__(self, handler, event, data):
+        async with update_session_slots:
+            token = session_scope.set(object())
+            try:
+                return await handler(event, data)
+            finally:
+                SessionLocal.remove()
+                session_scope.reset(token)
+
+dp.update.outer_middleware(DatabaseSessionMiddleware())
+
+# Development query profiling - logs updates that issue too many queries
+query_counter: ContextVar[Optional[List[int]]] = ContextVar("query_counter", default=None)
+
+class QueryCountMiddleware(BaseMiddleware):
+    """Count SQL queries per update and warn when a handler exceeds the threshold"""
+    
+    async def __call__(self, handler, event, data):
+        counter = [0]
+        token = query_counter.set(counter)
+        try:
+            if nplusone_profiler:
+                # Raises on lazy loads that would cause N+1 queries
+                with nplusone_profiler.Profiler():
+                    return await handler(event, data)
+            return await handler(event, data)
+        finally:
+            query_counter.reset(token)
+            if counter[0] > QUERY_LOG_THRESHOLD:
+                logger.warning(f"Update {getattr(event, 'update_id', '?')} issued {counter[0]} queries")
+
+nplusone_profiler = None
+if QUERY_LOG_ENABLED:
+    @sa_event.listens_for(engine, "before_cursor_execute")
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        counter = query_counter.get()
+        if counter is not None:
+            counter[0] += 1
+    
+    try:
+        import nplusone.ext.sqlalchemy  # noqa: F401 - registers lazy load signals
+        from nplusone.core import profiler as nplusone_profiler
+    except ImportError:
+        logger.info("nplusone not installed, N+1 detection disabled")
+    
+    dp.update.outer_middleware(QueryCountMiddleware())
+
 # Global variables for session management
-admin_sessions = {}  # {user_id: datetime}
+admin_sessions = {}  # {user_id: expires_at (monotonic)}
+ADMIN_SESSION_TTL_SEC = 3600  # Session valid for 1 hour
 maintenance_mode = False
 
+# Auto search wake-up events for reservations waiting on a code
+code_events: Dict[int, asyncio.Event] = {}  # {reservation_id: Event}
+active_reservations = {}  # {(service_id, phone_number): reservation_id}
+auto_search_keys = {}  # {reservation_id: (service_id, phone_number)}, the reservation's current key above
+pending_codes = {}  # {reservation_id: (phone_number, code)}
+AUTO_SEARCH_TIMEOUT_SEC = 300
+auto_search_tasks = set()  # running auto search tasks, referenced so they aren't collected mid-wait
+MAX_CONCURRENT_CODE_SEARCHES = 20
+code_search_semaphore = asyncio.Semaphore(MAX_CONCURRENT_CODE_SEARCHES)
+callback_ack_tasks = set()  # pending callback answers, referenced so they aren't collected mid-request
+
+# Shared HTTP session for provider APIs, created on first use
+http_session: Optional[aiohttp.ClientSession] = None
+
+# Active services and countries for keyboard renders, invalidated on admin edits
+CATALOG_CACHE_TTL_SEC = 30
+services_cache = (0.0, [])  # (loaded_at, services)
+service_countries_cache = {}  # {service_id: (loaded_at, countries)}
+main_keyboard_cache = {}  # {(lang_code, is_admin): (services, markup)}
+AVAILABLE_COUNTS_TTL_SEC = 5  # page flips within this window reuse the per-country counts
+available_counts_cache = {}  # {service_id: (loaded_at, {country_code: available_count})}
+
+# Active reward channels and groups for free credits and verify handlers, invalidated on admin edits
+channels_cache = (0.0, [])  # (loaded_at, channels)
+groups_cache = (0.0, [])  # (loaded_at, groups)
+
+# Per-service active group ids and compiled code regex, invalidated on admin edits
+service_cache = {}  # {service_id: (group_chat_ids, code_pattern)}
+service_group_cache = {}  # {group_chat_id: (service_group, code_pattern)}, groups detached with service loaded
+registered_group_ids = None  # frozenset of active group_chat_ids, reloaded after admin changes
+DEFAULT_CODE_PATTERN = r'\b\d{5,6}\b'  # Default regex for common OTP patterns
+
+# Provider and blocked messages queued for batched audit writes: flushed every 200 ms or 100 messages
+provider_message_queue: asyncio.Queue = asyncio.Queue()
+PROVIDER_MESSAGE_BATCH_SIZE = 100
+PROVIDER_MESSAGE_FLUSH_SEC = 0.2
+
+# Preferred language per user, kept in sync by update_user_language
+user_languages = {}  # {telegram_id: lang_code}
+
+# Group admin status cache, refreshed by ChatMemberUpdated events or after the TTL
+ADMIN_STATUS_CACHE_TTL_SEC = 300
+ADMIN_STATUS_CACHE_MAX_ENTRIES = 50_000
+admin_status_cache = {}  # {(chat_id, user_id): (expires_at, is_admin)}
+
+# Rendered admin statistics per panel, so repeated clicks on the dashboards skip the aggregates
+ADMIN_STATS_CACHE_TTL_SEC = 30
+admin_stats_cache = {}  # {panel: (expires_at, text)}
+
+# Reward channel/group memberships confirmed for a user, so repeated verify clicks skip Telegram
+MEMBERSHIP_CACHE_TTL_SEC = 20
+MEMBERSHIP_CACHE_MAX_ENTRIES = 50_000
+membership_status_cache = {}  # {(chat_identifier, user_id): (expires_at, status)}
+
+# Bot admin status per group, refreshed by my_chat_member updates or after the TTL
+BOT_GROUP_STATUS_TTL_SEC = 60
+bot_group_status_cache = {}  # {group_chat_id: (expires_at, is_admin)}
+
+# Low stock notifications already sent, to avoid re-notifying within an hour
+low_stock_notified = {}  # {(service_id, country_code): datetime}
+LOW_STOCK_NOTIFY_INTERVAL = timedelta(hours=1)
+
+# Telegram limits: message length and roughly 30 messages per second overall
+TELEGRAM_MESSAGE_LIMIT = 4096
+TELEGRAM_SENDS_PER_SEC = 25  # stay under the global limit
+telegram_next_send_at = 0.0  # monotonic time of the next free send slot
+
+# HTML templates for code delivery messages (dynamic values are escaped before formatting)
+CODE_RECEIVED_TEMPLATE = (
+    "✅ تم استلام كود التحقق!\n\n"
+    "📱 الرقم: <code>{phone_number}</code>\n"
+    "🏷 الخدمة: {service_emoji} {service_name}\n"
+    "🔢 الكود: <code>{code}</code>\n"
+    "💰 تم الخصم: {price} وحدة\n\n"
+    "✅ تمت العملية بنجاح"
+)
+NUMBER_RESERVED_TEMPLATE = (
+    "✅ تم حجز رقمك بنجاح!\n\n"
+    "📱 الرقم: <code>{phone_number}</code>\n"
+    "الكود: سيظهر هنا تلقائياً\n"
+    "🏷 الخدمة: {service_emoji} {service_name}\n"
+    "🌍 الدولة: {country_code}\n"
+    "💰 السعر: {price} وحدة\n"
+    "📊 الأرقام المتبقية: {remaining_count}\n\n"
+    "⏱ سيتم البحث عن الكود تلقائياً خلال 15 ثانية\n"
+    f"⏰ مهلة الانتظار: {RESERVATION_TIMEOUT_MIN} دقيقة\n"
+    "💳 سيتم الخصم فقط عند وصول الكود"
+)
+NUMBER_CHANGED_TEMPLATE = (
+    "✅ تم تغيير رقمك:\n\n"
+    "📱 الرقم الجديد: <code>{phone_number}</code>\n"
+    "🏷 الخدمة: {service_emoji} {service_name}\n"
+    "🌍 الدولة: {country_code}\n\n"
+    "⏱ سيتم إرسال كود التحقق هنا فور وصوله\n"
+    f"⏰ مهلة الانتظار: {RESERVATION_TIMEOUT_MIN} دقيقة"
+)
+CODE_DELIVERED_TEMPLATE = (
+    "🎉 وصل الكود!\n\n"
+    "<pre>{sms_formatted}</pre>\n\n"
+    "تم خصم {price} من رصيدك\n"
+    "رصيدك الحالي: {balance}"
+)
+
+# Display labels and icons shared by the handlers
+SECURITY_MODE_TEXT = MappingProxyType({
+    SecurityMode.TOKEN_ONLY: "🔑 Token Only",
+    SecurityMode.ADMIN_ONLY: "👑 Admin Only",
+    SecurityMode.HMAC: "🔐 HMAC"
+})
+SECURITY_MODE_BY_CALLBACK = MappingProxyType({
+    "token_only": SecurityMode.TOKEN_ONLY,
+    "admin_only": SecurityMode.ADMIN_ONLY,
+    "hmac": SecurityMode.HMAC
+})
+SECURITY_MODE_ICON = MappingProxyType({
+    SecurityMode.TOKEN_ONLY: "🔑",
+    SecurityMode.ADMIN_ONLY: "👑",
+    SecurityMode.HMAC: "🔐"
+})
+CHAT_MEMBER_STATUS_TEXT = MappingProxyType({
+    'creator': '👑 المؤسس',
+    'administrator': '👮‍♂️ مشرف',
+    'member': '👤 عضو',
+    'restricted': '🚫 مقيد',
+    'left': '❌ غير موجود',
+    'kicked': '🚫 محظور'
+})
+RESERVATION_STATUS_EMOJI = MappingProxyType({
+    ReservationStatus.WAITING_CODE: "⏳",
+    ReservationStatus.COMPLETED: "✅",
+    ReservationStatus.EXPIRED: "⏰",
+    ReservationStatus.CANCELED: "❌"
+})
+
 # FSM States
 class UserStates(StatesGroup):
     waiting_for_service = State()
@@ -102,17 +344,31 @@ def get_db():
     """Get database session"""
     return SessionLocal()
 
+@contextmanager
+def db_session():
+    """Scope a database session to a block, closing it on exit"""
+    db = get_db()
+    try:
+        yield db
+    finally:
+        db.close()
+
 # Helper function to get user language
 def get_user_language(user_id: str) -> str:
-    """Get user's preferred language"""
+    """Get user's preferred language, cached until it is changed with update_user_language"""
+    lang_code = user_languages.get(user_id)
+    if lang_code:
+        return lang_code
+    
     db = get_db()
     try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if user and user.language_code:
-            return str(user.language_code)
-        return 'ar'
+        language_code = db.query(User.language_code).filter(User.telegram_id == user_id).scalar()
+        lang_code = str(language_code) if language_code else 'ar'
     finally:
         db.close()
+    
+    user_languages[user_id] = lang_code
+    return lang_code
 
 # Helper function to update user language
 def update_user_language(user_id: str, lang_code: str) -> bool:
@@ -123,6 +379,7 @@ def update_user_language(user_id: str, lang_code: str) -> bool:
         if user:
             user.language_code = lang_code
             db.commit()
+            user_languages[user_id] = lang_code
             return True
         return False
     except Exception as e:
@@ -132,29 +389,57 @@ def update_user_language(user_id: str, lang_code: str) -> bool:
     finally:
         db.close()
 
-async def get_or_create_user(telegram_id: str, username: Optional[str] = None, first_name: Optional[str] = None, last_name: Optional[str] = None) -> tuple[User, bool]:
-    """Get existing user or create new one. Returns (user, is_new_user)"""
+class UserLanguageMiddleware(BaseMiddleware):
+    """Resolve the sender's language once per update for handlers that take a lang_code argument"""
+    
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        user = data.get("event_from_user")
+        # Skip the lookup for handlers that don't need it, e.g. the busy group message handler
+        if user and handler_object and "lang_code" in handler_object.params:
+            data["lang_code"] = get_user_language(str(user.id))
+        return await handler(event, data)
+
+dp.message.middleware(UserLanguageMiddleware())
+dp.callback_query.middleware(UserLanguageMiddleware())
+
+def get_or_create_user_sync(telegram_id: str, username: Optional[str], first_name: Optional[str], last_name: Optional[str]) -> tuple[User, bool]:
+    """Upsert the user in a worker thread's own session (blocking, run it off the event loop)"""
     db = get_db()
     try:
-        user = db.query(User).filter(User.telegram_id == telegram_id).first()
-        is_new_user = False
-        if not user:
-            user = User(
-                telegram_id=telegram_id,
-                username=username,
-                first_name=first_name,
-                last_name=last_name,
-                is_admin=(int(telegram_id) == ADMIN_ID),
-                language_code=None  # No language set for new users
-            )
-            db.add(user)
-            db.commit()
-            db.refresh(user)
-            is_new_user = True
-        return user, is_new_user
+        # Single round-trip upsert; refreshes profile fields that were provided for existing users
+        stmt = pg_insert(User).values(
+            telegram_id=telegram_id,
+            username=username,
+            first_name=first_name,
+            last_name=last_name,
+            is_admin=(int(telegram_id) == ADMIN_ID),
+            language_code=None  # No language set for new users
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[User.telegram_id],
+            set_={
+                'username': func.coalesce(stmt.excluded.username, User.username),
+                'first_name': func.coalesce(stmt.excluded.first_name, User.first_name),
+                'last_name': func.coalesce(stmt.excluded.last_name, User.last_name),
+            }
+        ).returning(User, literal_column("(xmax = 0)").label("inserted"))
+        
+        user, is_new_user = db.execute(stmt, execution_options={"populate_existing": True}).one()
+        # Detach before committing so the returned user stays loaded after the session closes
+        db.expunge(user)
+        db.commit()
+        return user, bool(is_new_user)
+    except Exception:
+        db.rollback()
+        raise
     finally:
         db.close()
 
+async def get_or_create_user(telegram_id: str, username: Optional[str] = None, first_name: Optional[str] = None, last_name: Optional[str] = None) -> tuple[User, bool]:
+    """Get existing user or create new one. Returns (user, is_new_user)"""
+    return await asyncio.to_thread(get_or_create_user_sync, telegram_id, username, first_name, last_name)
+
 def is_admin(user_id: int) -> bool:
     """Check if user is admin"""
     return user_id == ADMIN_ID or user_id in admin_sessions
@@ -163,518 +448,808 @@ def is_admin_session_valid(user_id: int) -> bool:
     """Check if admin session is still valid"""
     if user_id == ADMIN_ID:
         return True
-    if user_id in admin_sessions:
-        # Session valid for 1 hour
-        return (datetime.now() - admin_sessions[user_id]).seconds < 3600
+    expires_at = admin_sessions.get(user_id)
+    if expires_at is None:
+        return False
+    if expires_at > time.monotonic():
+        return True
+    # Drop the expired session so is_admin stops reporting it too
+    admin_sessions.pop(user_id, None)
     return False
 
+# Characters stripped from phone numbers during normalization
+_PHONE_CLEAN_PATTERN = re.compile(r'[\s\-\(\)]')
+
 def normalize_phone_number(phone: str) -> str:
     """Normalize phone number to international format"""
-    # Remove spaces, dashes, parentheses
-    phone = re.sub(r'[\s\-\(\)]', '', phone)
+    # Remove spaces, dashes, parentheses (skipped when the number is already just digits)
+    if not phone.lstrip('+').isdigit():
+        phone = _PHONE_CLEAN_PATTERN.sub('', phone)
     # Ensure starts with +
     if not phone.startswith('+'):
         phone = '+' + phone
     return phone
 
-async def search_code_in_groups(phone_number: str, service_id: int) -> Optional[str]:
-    """Search for code in recent group messages for the given phone number"""
-    db = get_db()
+def search_code_in_groups_sync(db_session, phone_number: str, service_id: int) -> Optional[str]:
+    """Search for code in recent group messages for the given phone number (blocking, run it off the event loop)"""
     try:
-        # Find service groups for this service
-        service_groups = db.query(ServiceGroup).filter(
-            ServiceGroup.service_id == service_id,
-            ServiceGroup.active == True
-        ).all()
+        # Make sure this service has an active group
+        group_chat_ids, _ = get_service_config(service_id, db_session)
         
-        if not service_groups:
+        if not group_chat_ids:
             logger.warning(f"No active groups found for service_id {service_id}")
             return None
         
-        # Get regex pattern for this service
-        service_provider_map = db.query(ServiceProviderMap).filter(
-            ServiceProviderMap.service_id == service_id
-        ).first()
-        regex_pattern = service_provider_map.regex_pattern if service_provider_map else r'\b\d{5,6}\b'
+        logger.info(f"Searching for code in group messages for number {phone_number}")
         
-        # Search in recent messages for this phone number
-        for group in service_groups:
-            logger.info(f"Searching for code in group {group.group_chat_id} for number {phone_number}")
-            
-            # Look for recent messages containing this phone number
-            recent_messages = db.query(ProviderMessage).filter(
-                ProviderMessage.service_id == service_id,
-                ProviderMessage.message_text.contains(phone_number),
-                ProviderMessage.created_at >= datetime.now() - timedelta(hours=1)  # Last hour only
-            ).order_by(ProviderMessage.created_at.desc()).limit(10).all()
-            
-            for msg in recent_messages:
-                # Try to extract code from message
-                number, code = extract_number_and_code(msg.message_text, regex_pattern)
-                if number == phone_number and code:
-                    logger.info(f"Found code {code} for number {phone_number} in message: {msg.message_text}")
-                    return code
+        # Look for the latest recent message addressed to this phone number
+        recent_message = db_session.query(ProviderMessage).filter(
+            ProviderMessage.service_id == service_id,
+            ProviderMessage.target_phone == phone_number,
+            ProviderMessage.code_value.isnot(None),
+            ProviderMessage.status != MessageStatus.REJECTED,
+            ProviderMessage.received_at >= datetime.now() - timedelta(hours=1)  # Last hour only
+        ).order_by(ProviderMessage.received_at.desc()).first()
+        
+        if recent_message:
+            logger.info(f"Found code {recent_message.code_value} for number {phone_number} in message: {recent_message.message_text}")
+            return recent_message.code_value
         
         logger.info(f"No code found for number {phone_number} in any group messages")
         return None
         
     except Exception as e:
         logger.error(f"Error searching for code in groups: {e}")
+        db_session.rollback()
         return None
-    finally:
-        db.close()
 
-async def auto_search_for_code(reservation_id: int):
-    """Auto search for code - starts after 15 seconds then every 5 seconds"""
-    # Wait 15 seconds before first search
-    await asyncio.sleep(15)
-    
-    max_attempts = 50  # Max 5 minutes (50 * 5 seconds + 15 initial)
-    attempts = 0
-    
-    while attempts < max_attempts:
+def get_active_services() -> List[Service]:
+    """Get active services, cached for a short TTL between admin edits"""
+    global services_cache
+    loaded_at, services = services_cache
+    if time.monotonic() - loaded_at > CATALOG_CACHE_TTL_SEC:
         db = get_db()
         try:
-            # Check if reservation is still valid
-            reservation = db.query(Reservation).filter(
-                Reservation.id == reservation_id,
-                Reservation.status == ReservationStatus.WAITING_CODE
-            ).first()
-            
-            if not reservation:
-                logger.info(f"Reservation {reservation_id} no longer valid, stopping auto search")
-                return
+            services = db.query(Service).filter(Service.active == True).order_by(Service.id).all()
+        finally:
+            db.close()
+        services_cache = (time.monotonic(), services)
+    return services
+
+def get_active_service_countries(service_id: int) -> List[ServiceCountry]:
+    """Get active countries of a service sorted by name, cached for a short TTL between admin edits"""
+    loaded_at, countries = service_countries_cache.get(service_id, (0.0, []))
+    if time.monotonic() - loaded_at > CATALOG_CACHE_TTL_SEC:
+        db = get_db()
+        try:
+            countries = db.query(ServiceCountry).filter(
+                ServiceCountry.service_id == service_id,
+                ServiceCountry.active == True
+            ).order_by(ServiceCountry.country_name).all()
+        finally:
+            db.close()
+        service_countries_cache[service_id] = (time.monotonic(), countries)
+    return countries
+
+def get_available_counts(service_id: int) -> Dict[str, int]:
+    """Count available numbers per country for a service, cached for a few seconds across page flips"""
+    loaded_at, counts = available_counts_cache.get(service_id, (0.0, {}))
+    if time.monotonic() - loaded_at > AVAILABLE_COUNTS_TTL_SEC:
+        db = get_db()
+        try:
+            # Only the service_id prefix of ix_numbers_service_country_status bounds this scan;
+            # status sits after country_code, so it is checked per index entry rather than seeked
+            counts = dict(db.query(Number.country_code, func.count(Number.id)).filter(
+                Number.service_id == service_id,
+                Number.status == NumberStatus.AVAILABLE
+            ).group_by(Number.country_code).all())
+        finally:
+            db.close()
+        available_counts_cache[service_id] = (time.monotonic(), counts)
+    return counts
+
+def get_active_channels() -> List[Channel]:
+    """Get active reward channels, cached for a short TTL between admin edits"""
+    global channels_cache
+    loaded_at, channels = channels_cache
+    if time.monotonic() - loaded_at > CATALOG_CACHE_TTL_SEC:
+        db = get_db()
+        try:
+            channels = db.query(Channel).filter(Channel.active == True).all()
+        finally:
+            db.close()
+        channels_cache = (time.monotonic(), channels)
+    return channels
+
+def get_active_groups() -> List[Group]:
+    """Get active reward groups, cached for a short TTL between admin edits"""
+    global groups_cache
+    loaded_at, groups = groups_cache
+    if time.monotonic() - loaded_at > CATALOG_CACHE_TTL_SEC:
+        db = get_db()
+        try:
+            groups = db.query(Group).filter(Group.active == True).all()
+        finally:
+            db.close()
+        groups_cache = (time.monotonic(), groups)
+    return groups
+
+def invalidate_rewards_cache():
+    """Drop cached reward channels and groups after admin changes"""
+    global channels_cache, groups_cache
+    channels_cache = (0.0, [])
+    groups_cache = (0.0, [])
+
+def invalidate_catalog_cache():
+    """Drop cached services and countries after admin changes"""
+    global services_cache
+    services_cache = (0.0, [])
+    service_countries_cache.clear()
+    main_keyboard_cache.clear()
+    available_counts_cache.clear()
+    admin_stats_cache.clear()
+
+def get_service_config(service_id: int, db_session) -> tuple[List[str], re.Pattern]:
+    """Get active group chat ids and compiled code regex for a service, cached until admin edits"""
+    config = service_cache.get(service_id)
+    if config is None:
+        group_rows = db_session.query(ServiceGroup.group_chat_id).filter(
+            ServiceGroup.service_id == service_id,
+            ServiceGroup.active == True
+        ).all()
+        mapping = db_session.query(ServiceProviderMap.regex_pattern).filter(
+            ServiceProviderMap.service_id == service_id
+        ).first()
+        pattern = mapping.regex_pattern if mapping and mapping.regex_pattern else DEFAULT_CODE_PATTERN
+        config = ([str(row.group_chat_id) for row in group_rows], get_compiled_pattern(pattern))
+        service_cache[service_id] = config
+    return config
+
+def invalidate_service_cache(service_id: Optional[int] = None):
+    """Drop cached service groups and regex after admin changes"""
+    global registered_group_ids
+    if service_id is None:
+        service_cache.clear()
+    else:
+        service_cache.pop(service_id, None)
+    service_group_cache.clear()
+    registered_group_ids = None
+
+def get_registered_group_ids() -> frozenset:
+    """Chat ids of all active service groups, loaded once and kept until admin changes"""
+    global registered_group_ids
+    if registered_group_ids is None:
+        db = get_db()
+        try:
+            registered_group_ids = frozenset(
+                str(group_chat_id) for (group_chat_id,) in
+                db.query(ServiceGroup.group_chat_id).filter(ServiceGroup.active == True).all()
+            )
+        finally:
+            db.close()
+    return registered_group_ids
+
+def get_active_service_group(group_chat_id: str, db_session) -> tuple[Optional[ServiceGroup], Optional[re.Pattern]]:
+    """Get the active service group of a chat with its service and compiled regex, cached until admin changes"""
+    cached = service_group_cache.get(group_chat_id)
+    if cached is None:
+        service_group = db_session.query(ServiceGroup).options(
+            joinedload(ServiceGroup.service)
+        ).filter(
+            ServiceGroup.group_chat_id == group_chat_id,
+            ServiceGroup.active == True
+        ).first()
+        if service_group is None:
+            return None, None
+        
+        # Detach so later commits in this session don't expire the cached copy
+        if service_group.service is not None:
+            db_session.expunge(service_group.service)
+        db_session.expunge(service_group)
+        cached = (service_group, get_compiled_pattern(service_group.regex_pattern or DEFAULT_CODE_PATTERN))
+        service_group_cache[group_chat_id] = cached
+    return cached
+
+def notify_code_event(reservation_id: int):
+    """Wake up the auto search task waiting on a reservation"""
+    event = code_events.get(reservation_id)
+    if event:
+        event.set()
+
+async def auto_search_for_code(reservation_id: int, service_id: int, phone_number: str):
+    """Auto search for code - wakes up when a message arrives for the reservation, gives up after 5 minutes"""
+    # Outlives the update that started it, so it must not reuse that update's session scope
+    session_scope.set(None)
+    event = code_events.setdefault(reservation_id, asyncio.Event())
+    reservation_key = (service_id, phone_number)
+    active_reservations[reservation_key] = reservation_id
+    auto_search_keys[reservation_id] = reservation_key
+    
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + AUTO_SEARCH_TIMEOUT_SEC
+    attempts = 0
+    
+    try:
+        while True:
+            # Sleep until a matching message is stored or the deadline passes
+            timed_out = False
+            try:
+                await asyncio.wait_for(event.wait(), timeout=max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                timed_out = True
+            event.clear()
             
-            # Get number for this reservation
-            number = db.query(Number).filter(Number.id == reservation.number_id).first()
-            if not number:
-                logger.warning(f"Number not found for reservation {reservation_id}")
+            # Use the code dispatched by the message consumer, search the groups only as a last resort
+            code_phone, code = pending_codes.pop(reservation_id, (None, None))
+            # Waiting is free, but cap how many searches hit the database at once
+            async with code_search_semaphore:
+                completed = await search_and_complete_reservation(
+                    reservation_id, attempts, code, code_phone, search_groups=timed_out
+                )
+            if completed:
                 return
             
-            logger.info(f"Auto searching for code attempt {attempts + 1} for number {number.phone_number}")
-            
-            # Search for code
-            code = await search_code_in_groups(number.phone_number, number.service_id)
-            
-            if code:
-                logger.info(f"Auto search found code {code} for reservation {reservation_id}")
-                
-                # Complete the reservation
-                success = await complete_reservation_atomic(reservation_id, code)
+            attempts += 1
+            if timed_out:
+                break
+    finally:
+        code_events.pop(reservation_id, None)
+        pending_codes.pop(reservation_id, None)
+        # The number may have been changed since the search started
+        reservation_key = auto_search_keys.pop(reservation_id, reservation_key)
+        if active_reservations.get(reservation_key) == reservation_id:
+            del active_reservations[reservation_key]
+    
+    logger.info(f"Auto search completed for reservation {reservation_id} after {attempts} attempts")
+
+def retarget_auto_search(reservation_id: int, service_id: int, phone_number: str):
+    """Point a running auto search at the reservation's new number, so codes for the released one are ignored"""
+    old_key = auto_search_keys.get(reservation_id)
+    if old_key is None:
+        return
+    
+    if active_reservations.get(old_key) == reservation_id:
+        del active_reservations[old_key]
+    new_key = (service_id, phone_number)
+    active_reservations[new_key] = reservation_id
+    auto_search_keys[reservation_id] = new_key
+    pending_codes.pop(reservation_id, None)
+
+def start_auto_search(reservation_id: int, service_id: int, phone_number: str):
+    """Run auto_search_for_code in the background, keeping a reference and logging failures"""
+    task = asyncio.create_task(auto_search_for_code(reservation_id, service_id, phone_number))
+    auto_search_tasks.add(task)
+    task.add_done_callback(auto_search_done)
+
+def auto_search_done(task: asyncio.Task):
+    """Drop a finished auto search and report it if it crashed"""
+    auto_search_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error(f"Auto search failed: {task.exception()!r}")
+
+async def answer_callback_quietly(callback: CallbackQuery, text: Optional[str] = None):
+    """Answer a callback query, ignoring queries that were already answered or have gone stale"""
+    try:
+        await callback.answer(text)
+    except Exception as e:
+        logger.debug(f"Callback answer skipped: {e}")
+
+def acknowledge_callback(callback: CallbackQuery, text: Optional[str] = None):
+    """Answer a callback query in the background so the client's spinner clears before the handler's queries"""
+    task = asyncio.create_task(answer_callback_quietly(callback, text))
+    callback_ack_tasks.add(task)
+    task.add_done_callback(callback_ack_tasks.discard)
+
+async def provider_message_consumer():
+    """Stream newly stored group messages to the reservations waiting on them"""
+    last_seen_id = None
+    while True:
+        try:
+            db = get_db()
+            try:
+                if last_seen_id is None:
+                    # Start from the newest message, older ones were already handled on arrival
+                    last_seen_id = db.query(func.max(ProviderMessage.id)).scalar() or 0
                 
-                if success:
-                    # Send code to user
-                    service = db.query(Service).filter(Service.id == number.service_id).first()
-                    
-                    await bot.send_message(
-                        reservation.user_id,
-                        f"✅ تم استلام كود التحقق!\n\n"
-                        f"📱 الرقم: `{number.phone_number}`\n"
-                        f"🏷 الخدمة: {service.emoji} {service.name}\n"
-                        f"🔢 الكود: `{code}`\n"
-                        f"💰 تم الخصم: {service.default_price} وحدة\n\n"
-                        f"✅ تمت العملية بنجاح",
-                        parse_mode="Markdown"
-                    )
-                    return
+                new_messages = db.query(
+                    ProviderMessage.id,
+                    ProviderMessage.service_id,
+                    ProviderMessage.target_phone,
+                    ProviderMessage.code_value
+                ).filter(
+                    ProviderMessage.id > last_seen_id,
+                    ProviderMessage.status != MessageStatus.REJECTED
+                ).order_by(ProviderMessage.id).all()
+            finally:
+                db.close()
+            
+            for message_id, service_id, target_phone, code_value in new_messages:
+                last_seen_id = message_id
+                if not target_phone or not code_value:
+                    continue
                 
+                reservation_id = active_reservations.get((service_id, target_phone))
+                if reservation_id:
+                    pending_codes[reservation_id] = (target_phone, code_value)
+                    notify_code_event(reservation_id)
+        
         except Exception as e:
-            logger.error(f"Error in auto search for reservation {reservation_id}: {e}")
-        finally:
-            db.close()
+            logger.error(f"Error in provider message consumer: {e}")
+        
+        await asyncio.sleep(POLL_INTERVAL_SEC)
+
+def load_code_delivery_sync(reservation_id: int, attempts: int, code: Optional[str], code_phone: Optional[str],
+                            search_groups: bool) -> Optional[tuple]:
+    """Check the reservation still waits and settle the code to deliver, in the worker thread's own session
+    (blocking, run it off the event loop). Returns None when the search should stop, else (code, user_id, message)"""
+    with db_session() as db:
+        # Check if reservation is still valid, loading its number and service in the same query
+        reservation = db.query(Reservation).options(
+            joinedload(Reservation.number).joinedload(Number.service)
+        ).filter(
+            Reservation.id == reservation_id,
+            Reservation.status == ReservationStatus.WAITING_CODE
+        ).first()
+        
+        if not reservation:
+            logger.info(f"Reservation {reservation_id} no longer valid, stopping auto search")
+            return None
         
-        attempts += 1
-        await asyncio.sleep(5)  # Wait 5 seconds between attempts
+        # Get number for this reservation
+        number = reservation.number
+        if not number:
+            logger.warning(f"Number not found for reservation {reservation_id}")
+            return None
+        
+        logger.info(f"Auto searching for code attempt {attempts + 1} for number {number.phone_number}")
+        
+        # A code dispatched for a number the reservation no longer holds belongs to someone else
+        if code and code_phone != number.phone_number:
+            logger.warning(f"Ignoring code for {code_phone}, reservation {reservation_id} now holds {number.phone_number}")
+            code = None
+        
+        # Search for code
+        if not code and search_groups:
+            code = search_code_in_groups_sync(db, number.phone_number, number.service_id)
+        
+        if not code:
+            return None, None, None
+        
+        service = number.service
+        code_message = CODE_RECEIVED_TEMPLATE.format(
+            phone_number=html.escape(str(number.phone_number)),
+            service_emoji=html.escape(str(service.emoji)),
+            service_name=html.escape(str(service.name)),
+            code=html.escape(code),
+            price=service.default_price
+        )
+        return code, reservation.user_id, code_message
+
+async def search_and_complete_reservation(reservation_id: int, attempts: int, code: Optional[str] = None,
+                                          code_phone: Optional[str] = None, search_groups: bool = False) -> bool:
+    """Complete a reservation with a received code for code_phone, optionally searching group messages for one.
+    Returns True when the search should stop"""
+    try:
+        # Database work runs in worker threads, so no loop session is held across the sends below
+        delivery = await asyncio.to_thread(
+            load_code_delivery_sync, reservation_id, attempts, code, code_phone, search_groups
+        )
+        if delivery is None:
+            return True
+        
+        code, user_id, code_message = delivery
+        if code:
+            logger.info(f"Auto search found code {code} for reservation {reservation_id}")
+            
+            # Complete the reservation
+            success = await complete_reservation_atomic(reservation_id, code)
+            
+            if success:
+                # Send code to user
+                await send_message_limited(user_id, code_message, parse_mode="HTML")
+                return True
+            
+    except Exception as e:
+        logger.error(f"Error in auto search for reservation {reservation_id}: {e}")
     
-    logger.info(f"Auto search completed for reservation {reservation_id} after {max_attempts} attempts")
+    return False
+
+# Known dialing prefixes used to detect a number's country (interned so detected codes share one object)
+_COUNTRY_CODES = frozenset(sys.intern(code) for code in {
+    '+1',     # USA/Canada
+    '+7',     # Russia/Kazakhstan
+    '+20',    # Egypt
+    '+33',    # France
+    '+34',    # Spain
+    '+39',    # Italy
+    '+44',    # UK
+    '+49',    # Germany
+    '+52',    # Mexico
+    '+55',    # Brazil
+    '+60',    # Malaysia
+    '+61',    # Australia
+    '+62',    # Indonesia
+    '+63',    # Philippines
+    '+64',    # New Zealand
+    '+65',    # Singapore
+    '+66',    # Thailand
+    '+81',    # Japan
+    '+82',    # South Korea
+    '+84',    # Vietnam
+    '+86',    # China
+    '+90',    # Turkey
+    '+91',    # India
+    '+92',    # Pakistan
+    '+93',    # Afghanistan
+    '+94',    # Sri Lanka
+    '+95',    # Myanmar
+    '+98',    # Iran
+    '+212',   # Morocco
+    '+213',   # Algeria
+    '+216',   # Tunisia
+    '+218',   # Libya
+    '+220',   # Gambia
+    '+221',   # Senegal
+    '+222',   # Mauritania
+    '+223',   # Mali
+    '+224',   # Guinea
+    '+225',   # Ivory Coast
+    '+226',   # Burkina Faso
+    '+227',   # Niger
+    '+228',   # Togo
+    '+229',   # Benin
+    '+230',   # Mauritius
+    '+231',   # Liberia
+    '+232',   # Sierra Leone
+    '+233',   # Ghana
+    '+234',   # Nigeria
+    '+235',   # Chad
+    '+236',   # Central African Republic
+    '+237',   # Cameroon
+    '+238',   # Cape Verde
+    '+239',   # Sao Tome and Principe
+    '+240',   # Equatorial Guinea
+    '+241',   # Gabon
+    '+242',   # Republic of the Congo
+    '+243',   # Democratic Republic of the Congo
+    '+244',   # Angola
+    '+245',   # Guinea-Bissau
+    '+246',   # British Indian Ocean Territory
+    '+248',   # Seychelles
+    '+249',   # Sudan
+    '+250',   # Rwanda
+    '+251',   # Ethiopia
+    '+252',   # Somalia
+    '+253',   # Djibouti
+    '+254',   # Kenya
+    '+255',   # Tanzania
+    '+256',   # Uganda
+    '+257',   # Burundi
+    '+258',   # Mozambique
+    '+260',   # Zambia
+    '+261',   # Madagascar
+    '+262',   # Reunion
+    '+263',   # Zimbabwe
+    '+264',   # Namibia
+    '+265',   # Malawi
+    '+266',   # Lesotho
+    '+267',   # Botswana
+    '+268',   # Swaziland
+    '+269',   # Comoros
+    '+290',   # Saint Helena
+    '+291',   # Eritrea
+    '+297',   # Aruba
+    '+298',   # Faroe Islands
+    '+299',   # Greenland
+    '+350',   # Gibraltar
+    '+351',   # Portugal
+    '+352',   # Luxembourg
+    '+353',   # Ireland
+    '+354',   # Iceland
+    '+355',   # Albania
+    '+356',   # Malta
+    '+357',   # Cyprus
+    '+358',   # Finland
+    '+359',   # Bulgaria
+    '+370',   # Lithuania
+    '+371',   # Latvia
+    '+372',   # Estonia
+    '+373',   # Moldova
+    '+374',   # Armenia
+    '+375',   # Belarus
+    '+376',   # Andorra
+    '+377',   # Monaco
+    '+378',   # San Marino
+    '+380',   # Ukraine
+    '+381',   # Serbia
+    '+382',   # Montenegro
+    '+383',   # Kosovo
+    '+385',   # Croatia
+    '+386',   # Slovenia
+    '+387',   # Bosnia and Herzegovina
+    '+389',   # North Macedonia
+    '+420',   # Czech Republic
+    '+421',   # Slovakia
+    '+423',   # Liechtenstein
+    '+500',   # Falkland Islands
+    '+501',   # Belize
+    '+502',   # Guatemala
+    '+503',   # El Salvador
+    '+504',   # Honduras
+    '+505',   # Nicaragua
+    '+506',   # Costa Rica
+    '+507',   # Panama
+    '+508',   # Saint Pierre and Miquelon
+    '+509',   # Haiti
+    '+590',   # Guadeloupe
+    '+591',   # Bolivia
+    '+592',   # Guyana
+    '+593',   # Ecuador
+    '+594',   # French Guiana
+    '+595',   # Paraguay
+    '+596',   # Martinique
+    '+597',   # Suriname
+    '+598',   # Uruguay
+    '+599',   # Netherlands Antilles
+    '+670',   # East Timor
+    '+672',   # Antarctica
+    '+673',   # Brunei
+    '+674',   # Nauru
+    '+675',   # Papua New Guinea
+    '+676',   # Tonga
+    '+677',   # Solomon Islands
+    '+678',   # Vanuatu
+    '+679',   # Fiji
+    '+680',   # Palau
+    '+681',   # Wallis and Futuna
+    '+682',   # Cook Islands
+    '+683',   # Niue
+    '+684',   # American Samoa
+    '+685',   # Samoa
+    '+686',   # Kiribati
+    '+687',   # New Caledonia
+    '+688',   # Tuvalu
+    '+689',   # French Polynesia
+    '+690',   # Tokelau
+    '+691',   # Micronesia
+    '+692',   # Marshall Islands
+    '+850',   # North Korea
+    '+852',   # Hong Kong
+    '+853',   # Macau
+    '+855',   # Cambodia
+    '+856',   # Laos
+    '+880',   # Bangladesh
+    '+886',   # Taiwan
+    '+960',   # Maldives
+    '+961',   # Lebanon
+    '+962',   # Jordan
+    '+963',   # Syria
+    '+964',   # Iraq
+    '+965',   # Kuwait
+    '+966',   # Saudi Arabia
+    '+967',   # Yemen
+    '+968',   # Oman
+    '+970',   # Palestine
+    '+971',   # United Arab Emirates
+    '+972',   # Israel
+    '+973',   # Bahrain
+    '+974',   # Qatar
+    '+975',   # Bhutan
+    '+976',   # Mongolia
+    '+977',   # Nepal
+    '+992',   # Tajikistan
+    '+993',   # Turkmenistan
+    '+994',   # Azerbaijan
+    '+995',   # Georgia
+    '+996',   # Kyrgyzstan
+    '+998',   # Uzbekistan
+})
+
+# Prefixes grouped by digit count, longest first, so detection is one set lookup per length
+_COUNTRY_CODES_BY_LENGTH = tuple(
+    (length, frozenset(code for code in _COUNTRY_CODES if len(code) == length + 1))
+    for length in sorted({len(code) - 1 for code in _COUNTRY_CODES}, reverse=True)
+)
+
+# Country name and flag for each supported country code, exposed as a read-only view
+_COUNTRY_INFO = {
+    '+1': ('الولايات المتحدة', '🇺🇸'),
+    '+7': ('روسيا', '🇷🇺'),
+    '+20': ('مصر', '🇪🇬'),
+    '+33': ('فرنسا', '🇫🇷'),
+    '+34': ('إسبانيا', '🇪🇸'),
+    '+39': ('إيطاليا', '🇮🇹'),
+    '+44': ('المملكة المتحدة', '🇬🇧'),
+    '+49': ('ألمانيا', '🇩🇪'),
+    '+52': ('المكسيك', '🇲🇽'),
+    '+55': ('البرازيل', '🇧🇷'),
+    '+60': ('ماليزيا', '🇲🇾'),
+    '+61': ('أستراليا', '🇦🇺'),
+    '+62': ('إندونيسيا', '🇮🇩'),
+    '+63': ('الفلبين', '🇵🇭'),
+    '+64': ('نيوزيلندا', '🇳🇿'),
+    '+65': ('سنغافورة', '🇸🇬'),
+    '+66': ('تايلاند', '🇹🇭'),
+    '+81': ('اليابان', '🇯🇵'),
+    '+82': ('كوريا الجنوبية', '🇰🇷'),
+    '+84': ('فيتنام', '🇻🇳'),
+    '+86': ('الصين', '🇨🇳'),
+    '+90': ('تركيا', '🇹🇷'),
+    '+91': ('الهند', '🇮🇳'),
+    '+92': ('باكستان', '🇵🇰'),
+    '+93': ('أفغانستان', '🇦🇫'),
+    '+94': ('سريلانكا', '🇱🇰'),
+    '+95': ('ميانمار', '🇲🇲'),
+    '+98': ('إيران', '🇮🇷'),
+    '+212': ('المغرب', '🇲🇦'),
+    '+213': ('الجزائر', '🇩🇿'),
+    '+216': ('تونس', '🇹🇳'),
+    '+218': ('ليبيا', '🇱🇾'),
+    '+220': ('غامبيا', '🇬🇲'),
+    '+221': ('السنغال', '🇸🇳'),
+    '+222': ('موريتانيا', '🇲🇷'),
+    '+223': ('مالي', '🇲🇱'),
+    '+224': ('غينيا', '🇬🇳'),
+    '+225': ('ساحل العاج', '🇨🇮'),
+    '+226': ('بوركينا فاسو', '🇧🇫'),
+    '+227': ('النيجر', '🇳🇪'),
+    '+228': ('توغو', '🇹🇬'),
+    '+229': ('بنين', '🇧🇯'),
+    '+230': ('موريشيوس', '🇲🇺'),
+    '+231': ('ليبيريا', '🇱🇷'),
+    '+232': ('سيراليون', '🇸🇱'),
+    '+233': ('غانا', '🇬🇭'),
+    '+234': ('نيجيريا', '🇳🇬'),
+    '+235': ('تشاد', '🇹🇩'),
+    '+236': ('جمهورية أفريقيا الوسطى', '🇨🇫'),
+    '+237': ('الكاميرون', '🇨🇲'),
+    '+238': ('الرأس الأخضر', '🇨🇻'),
+    '+239': ('ساو تومي وبرينسيبي', '🇸🇹'),
+    '+240': ('غينيا الاستوائية', '🇬🇶'),
+    '+241': ('الغابون', '🇬🇦'),
+    '+242': ('جمهورية الكونغو', '🇨🇬'),
+    '+243': ('جمهورية الكونغو الديمقراطية', '🇨🇩'),
+    '+244': ('أنغولا', '🇦🇴'),
+    '+245': ('غينيا بيساو', '🇬🇼'),
+    '+248': ('سيشل', '🇸🇨'),
+    '+249': ('السودان', '🇸🇩'),
+    '+250': ('رواندا', '🇷🇼'),
+    '+251': ('إثيوبيا', '🇪🇹'),
+    '+252': ('الصومال', '🇸🇴'),
+    '+253': ('جيبوتي', '🇩🇯'),
+    '+254': ('كينيا', '🇰🇪'),
+    '+255': ('تنزانيا', '🇹🇿'),
+    '+256': ('أوغندا', '🇺🇬'),
+    '+257': ('بوروندي', '🇧🇮'),
+    '+258': ('موزمبيق', '🇲🇿'),
+    '+260': ('زامبيا', '🇿🇲'),
+    '+261': ('مدغشقر', '🇲🇬'),
+    '+263': ('زيمبابوي', '🇿🇼'),
+    '+264': ('ناميبيا', '🇳🇦'),
+    '+265': ('ملاوي', '🇲🇼'),
+    '+266': ('ليسوتو', '🇱🇸'),
+    '+267': ('بوتسوانا', '🇧🇼'),
+    '+268': ('إسواتيني', '🇸🇿'),
+    '+269': ('جزر القمر', '🇰🇲'),
+    '+351': ('البرتغال', '🇵🇹'),
+    '+352': ('لوكسمبورغ', '🇱🇺'),
+    '+353': ('أيرلندا', '🇮🇪'),
+    '+354': ('أيسلندا', '🇮🇸'),
+    '+355': ('ألبانيا', '🇦🇱'),
+    '+356': ('مالطا', '🇲🇹'),
+    '+357': ('قبرص', '🇨🇾'),
+    '+358': ('فنلندا', '🇫🇮'),
+    '+359': ('بلغاريا', '🇧🇬'),
+    '+370': ('ليتوانيا', '🇱🇹'),
+    '+371': ('لاتفيا', '🇱🇻'),
+    '+372': ('إستونيا', '🇪🇪'),
+    '+373': ('مولدوفا', '🇲🇩'),
+    '+374': ('أرمينيا', '🇦🇲'),
+    '+375': ('بيلاروس', '🇧🇾'),
+    '+376': ('أندورا', '🇦🇩'),
+    '+377': ('موناكو', '🇲🇨'),
+    '+378': ('سان مارينو', '🇸🇲'),
+    '+380': ('أوكرانيا', '🇺🇦'),
+    '+381': ('صربيا', '🇷🇸'),
+    '+382': ('الجبل الأسود', '🇲🇪'),
+    '+383': ('كوسوفو', '🇽🇰'),
+    '+385': ('كرواتيا', '🇭🇷'),
+    '+386': ('سلوفينيا', '🇸🇮'),
+    '+387': ('البوسنة والهرسك', '🇧🇦'),
+    '+389': ('مقدونيا الشمالية', '🇲🇰'),
+    '+420': ('التشيك', '🇨🇿'),
+    '+421': ('سلوفاكيا', '🇸🇰'),
+    '+423': ('ليختنشتاين', '🇱🇮'),
+    '+500': ('جزر فوكلاند', '🇫🇰'),
+    '+501': ('بليز', '🇧🇿'),
+    '+502': ('غواتيمالا', '🇬🇹'),
+    '+503': ('السلفادور', '🇸🇻'),
+    '+504': ('هندوراس', '🇭🇳'),
+    '+505': ('نيكاراغوا', '🇳🇮'),
+    '+506': ('كوستاريكا', '🇨🇷'),
+    '+507': ('بنما', '🇵🇦'),
+    '+509': ('هايتي', '🇭🇹'),
+    '+590': ('غوادلوب', '🇬🇵'),
+    '+591': ('بوليفيا', '🇧🇴'),
+    '+592': ('غيانا', '🇬🇾'),
+    '+593': ('الإكوادور', '🇪🇨'),
+    '+594': ('غيانا الفرنسية', '🇬🇫'),
+    '+595': ('باراغواي', '🇵🇾'),
+    '+596': ('مارتينيك', '🇲🇶'),
+    '+597': ('سورينام', '🇸🇷'),
+    '+598': ('أوروغواي', '🇺🇾'),
+    '+670': ('تيمور الشرقية', '🇹🇱'),
+    '+673': ('بروناي', '🇧🇳'),
+    '+674': ('ناورو', '🇳🇷'),
+    '+675': ('بابوا غينيا الجديدة', '🇵🇬'),
+    '+676': ('تونغا', '🇹🇴'),
+    '+677': ('جزر سليمان', '🇸🇧'),
+    '+678': ('فانواتو', '🇻🇺'),
+    '+679': ('فيجي', '🇫🇯'),
+    '+680': ('بالاو', '🇵🇼'),
+    '+681': ('واليس وفوتونا', '🇼🇫'),
+    '+682': ('جزر كوك', '🇨🇰'),
+    '+683': ('نيوي', '🇳🇺'),
+    '+684': ('ساموا الأمريكية', '🇦🇸'),
+    '+685': ('ساموا', '🇼🇸'),
+    '+686': ('كيريباتي', '🇰🇮'),
+    '+687': ('كاليدونيا الجديدة', '🇳🇨'),
+    '+688': ('توفالو', '🇹🇻'),
+    '+689': ('بولينيزيا الفرنسية', '🇵🇫'),
+    '+690': ('توكيلاو', '🇹🇰'),
+    '+691': ('ميكرونيزيا', '🇫🇲'),
+    '+692': ('جزر مارشال', '🇲🇭'),
+    '+850': ('كوريا الشمالية', '🇰🇵'),
+    '+852': ('هونغ كونغ', '🇭🇰'),
+    '+853': ('ماكاو', '🇲🇴'),
+    '+855': ('كمبوديا', '🇰🇭'),
+    '+856': ('لاوس', '🇱🇦'),
+    '+880': ('بنغلاديش', '🇧🇩'),
+    '+886': ('تايوان', '🇹🇼'),
+    '+960': ('المالديف', '🇲🇻'),
+    '+961': ('لبنان', '🇱🇧'),
+    '+962': ('الأردن', '🇯🇴'),
+    '+963': ('سوريا', '🇸🇾'),
+    '+964': ('العراق', '🇮🇶'),
+    '+965': ('الكويت', '🇰🇼'),
+    '+966': ('السعودية', '🇸🇦'),
+    '+967': ('اليمن', '🇾🇪'),
+    '+968': ('عمان', '🇴🇲'),
+    '+970': ('فلسطين', '🇵🇸'),
+    '+971': ('الإمارات', '🇦🇪'),
+    '+972': ('إسرائيل', '🇮🇱'),
+    '+973': ('البحرين', '🇧🇭'),
+    '+974': ('قطر', '🇶🇦'),
+    '+975': ('بوتان', '🇧🇹'),
+    '+976': ('منغوليا', '🇲🇳'),
+    '+977': ('نيبال', '🇳🇵'),
+    '+992': ('طاجيكستان', '🇹🇯'),
+    '+993': ('تركمانستان', '🇹🇲'),
+    '+994': ('أذربيجان', '🇦🇿'),
+    '+995': ('جورجيا', '🇬🇪'),
+    '+996': ('قيرغيزستان', '🇰🇬'),
+    '+998': ('أوزبكستان', '🇺🇿'),
+}
+_COUNTRY_INFO = MappingProxyType({sys.intern(code): info for code, info in _COUNTRY_INFO.items()})
+_UNKNOWN_COUNTRY = ('دولة غير معروفة', '🌍')
 
 def detect_country_code(phone: str) -> str:
     """Detect country code from phone number"""
     phone = normalize_phone_number(phone)
     
-    # Common country codes mapping
-    country_codes = {
-        '+1': '+1',      # USA/Canada
-        '+7': '+7',      # Russia/Kazakhstan  
-        '+20': '+20',    # Egypt
-        '+33': '+33',    # France
-        '+34': '+34',    # Spain
-        '+39': '+39',    # Italy
-        '+44': '+44',    # UK
-        '+49': '+49',    # Germany
-        '+52': '+52',    # Mexico
-        '+55': '+55',    # Brazil
-        '+60': '+60',    # Malaysia
-        '+61': '+61',    # Australia
-        '+62': '+62',    # Indonesia
-        '+63': '+63',    # Philippines
-        '+64': '+64',    # New Zealand
-        '+65': '+65',    # Singapore
-        '+66': '+66',    # Thailand
-        '+81': '+81',    # Japan
-        '+82': '+82',    # South Korea
-        '+84': '+84',    # Vietnam
-        '+86': '+86',    # China
-        '+90': '+90',    # Turkey
-        '+91': '+91',    # India
-        '+92': '+92',    # Pakistan
-        '+93': '+93',    # Afghanistan
-        '+94': '+94',    # Sri Lanka
-        '+95': '+95',    # Myanmar
-        '+98': '+98',    # Iran
-        '+212': '+212',  # Morocco
-        '+213': '+213',  # Algeria
-        '+216': '+216',  # Tunisia
-        '+218': '+218',  # Libya
-        '+220': '+220',  # Gambia
-        '+221': '+221',  # Senegal
-        '+222': '+222',  # Mauritania
-        '+223': '+223',  # Mali
-        '+224': '+224',  # Guinea
-        '+225': '+225',  # Ivory Coast
-        '+226': '+226',  # Burkina Faso
-        '+227': '+227',  # Niger
-        '+228': '+228',  # Togo
-        '+229': '+229',  # Benin
-        '+230': '+230',  # Mauritius
-        '+231': '+231',  # Liberia
-        '+232': '+232',  # Sierra Leone
-        '+233': '+233',  # Ghana
-        '+234': '+234',  # Nigeria
-        '+235': '+235',  # Chad
-        '+236': '+236',  # Central African Republic
-        '+237': '+237',  # Cameroon
-        '+238': '+238',  # Cape Verde
-        '+239': '+239',  # Sao Tome and Principe
-        '+240': '+240',  # Equatorial Guinea
-        '+241': '+241',  # Gabon
-        '+242': '+242',  # Republic of the Congo
-        '+243': '+243',  # Democratic Republic of the Congo
-        '+244': '+244',  # Angola
-        '+245': '+245',  # Guinea-Bissau
-        '+246': '+246',  # British Indian Ocean Territory
-        '+248': '+248',  # Seychelles
-        '+249': '+249',  # Sudan
-        '+250': '+250',  # Rwanda
-        '+251': '+251',  # Ethiopia
-        '+252': '+252',  # Somalia
-        '+253': '+253',  # Djibouti
-        '+254': '+254',  # Kenya
-        '+255': '+255',  # Tanzania
-        '+256': '+256',  # Uganda
-        '+257': '+257',  # Burundi
-        '+258': '+258',  # Mozambique
-        '+260': '+260',  # Zambia
-        '+261': '+261',  # Madagascar
-        '+262': '+262',  # Reunion
-        '+263': '+263',  # Zimbabwe
-        '+264': '+264',  # Namibia
-        '+265': '+265',  # Malawi
-        '+266': '+266',  # Lesotho
-        '+267': '+267',  # Botswana
-        '+268': '+268',  # Swaziland
-        '+269': '+269',  # Comoros
-        '+290': '+290',  # Saint Helena
-        '+291': '+291',  # Eritrea
-        '+297': '+297',  # Aruba
-        '+298': '+298',  # Faroe Islands
-        '+299': '+299',  # Greenland
-        '+350': '+350',  # Gibraltar
-        '+351': '+351',  # Portugal
-        '+352': '+352',  # Luxembourg
-        '+353': '+353',  # Ireland
-        '+354': '+354',  # Iceland
-        '+355': '+355',  # Albania
-        '+356': '+356',  # Malta
-        '+357': '+357',  # Cyprus
-        '+358': '+358',  # Finland
-        '+359': '+359',  # Bulgaria
-        '+370': '+370',  # Lithuania
-        '+371': '+371',  # Latvia
-        '+372': '+372',  # Estonia
-        '+373': '+373',  # Moldova
-        '+374': '+374',  # Armenia
-        '+375': '+375',  # Belarus
-        '+376': '+376',  # Andorra
-        '+377': '+377',  # Monaco
-        '+378': '+378',  # San Marino
-        '+380': '+380',  # Ukraine
-        '+381': '+381',  # Serbia
-        '+382': '+382',  # Montenegro
-        '+383': '+383',  # Kosovo
-        '+385': '+385',  # Croatia
-        '+386': '+386',  # Slovenia
-        '+387': '+387',  # Bosnia and Herzegovina
-        '+389': '+389',  # North Macedonia
-        '+420': '+420',  # Czech Republic
-        '+421': '+421',  # Slovakia
-        '+423': '+423',  # Liechtenstein
-        '+500': '+500',  # Falkland Islands
-        '+501': '+501',  # Belize
-        '+502': '+502',  # Guatemala
-        '+503': '+503',  # El Salvador
-        '+504': '+504',  # Honduras
-        '+505': '+505',  # Nicaragua
-        '+506': '+506',  # Costa Rica
-        '+507': '+507',  # Panama
-        '+508': '+508',  # Saint Pierre and Miquelon
-        '+509': '+509',  # Haiti
-        '+590': '+590',  # Guadeloupe
-        '+591': '+591',  # Bolivia
-        '+592': '+592',  # Guyana
-        '+593': '+593',  # Ecuador
-        '+594': '+594',  # French Guiana
-        '+595': '+595',  # Paraguay
-        '+596': '+596',  # Martinique
-        '+597': '+597',  # Suriname
-        '+598': '+598',  # Uruguay
-        '+599': '+599',  # Netherlands Antilles
-        '+670': '+670',  # East Timor
-        '+672': '+672',  # Antarctica
-        '+673': '+673',  # Brunei
-        '+674': '+674',  # Nauru
-        '+675': '+675',  # Papua New Guinea
-        '+676': '+676',  # Tonga
-        '+677': '+677',  # Solomon Islands
-        '+678': '+678',  # Vanuatu
-        '+679': '+679',  # Fiji
-        '+680': '+680',  # Palau
-        '+681': '+681',  # Wallis and Futuna
-        '+682': '+682',  # Cook Islands
-        '+683': '+683',  # Niue
-        '+684': '+684',  # American Samoa
-        '+685': '+685',  # Samoa
-        '+686': '+686',  # Kiribati
-        '+687': '+687',  # New Caledonia
-        '+688': '+688',  # Tuvalu
-        '+689': '+689',  # French Polynesia
-        '+690': '+690',  # Tokelau
-        '+691': '+691',  # Micronesia
-        '+692': '+692',  # Marshall Islands
-        '+850': '+850',  # North Korea
-        '+852': '+852',  # Hong Kong
-        '+853': '+853',  # Macau
-        '+855': '+855',  # Cambodia
-        '+856': '+856',  # Laos
-        '+880': '+880',  # Bangladesh
-        '+886': '+886',  # Taiwan
-        '+960': '+960',  # Maldives
-        '+961': '+961',  # Lebanon
-        '+962': '+962',  # Jordan
-        '+963': '+963',  # Syria
-        '+964': '+964',  # Iraq
-        '+965': '+965',  # Kuwait
-        '+966': '+966',  # Saudi Arabia
-        '+967': '+967',  # Yemen
-        '+968': '+968',  # Oman
-        '+970': '+970',  # Palestine
-        '+971': '+971',  # United Arab Emirates
-        '+972': '+972',  # Israel
-        '+973': '+973',  # Bahrain
-        '+974': '+974',  # Qatar
-        '+975': '+975',  # Bhutan
-        '+976': '+976',  # Mongolia
-        '+977': '+977',  # Nepal
-        '+992': '+992',  # Tajikistan
-        '+993': '+993',  # Turkmenistan
-        '+994': '+994',  # Azerbaijan
-        '+995': '+995',  # Georgia
-        '+996': '+996',  # Kyrgyzstan
-        '+998': '+998',  # Uzbekistan
-    }
-    
     # Check for exact matches (longest first)
-    for length in [4, 3, 2]:
+    for length, codes in _COUNTRY_CODES_BY_LENGTH:
         if len(phone) >= length + 1:  # +1 for the '+' sign
             prefix = phone[:length + 1]
-            if prefix in country_codes:
-                return country_codes[prefix]
+            if prefix in codes:
+                return sys.intern(prefix)
     
     # Default fallback
     return '+1'  # Default to US/Canada if no match found
 
 def get_country_name_and_flag(country_code: str) -> tuple[str, str]:
     """Get country name and flag from country code"""
-    country_info = {
-        '+1': ('الولايات المتحدة', '🇺🇸'),
-        '+7': ('روسيا', '🇷🇺'),
-        '+20': ('مصر', '🇪🇬'),
-        '+33': ('فرنسا', '🇫🇷'),
-        '+34': ('إسبانيا', '🇪🇸'),
-        '+39': ('إيطاليا', '🇮🇹'),
-        '+44': ('المملكة المتحدة', '🇬🇧'),
-        '+49': ('ألمانيا', '🇩🇪'),
-        '+52': ('المكسيك', '🇲🇽'),
-        '+55': ('البرازيل', '🇧🇷'),
-        '+60': ('ماليزيا', '🇲🇾'),
-        '+61': ('أستراليا', '🇦🇺'),
-        '+62': ('إندونيسيا', '🇮🇩'),
-        '+63': ('الفلبين', '🇵🇭'),
-        '+64': ('نيوزيلندا', '🇳🇿'),
-        '+65': ('سنغافورة', '🇸🇬'),
-        '+66': ('تايلاند', '🇹🇭'),
-        '+81': ('اليابان', '🇯🇵'),
-        '+82': ('كوريا الجنوبية', '🇰🇷'),
-        '+84': ('فيتنام', '🇻🇳'),
-        '+86': ('الصين', '🇨🇳'),
-        '+90': ('تركيا', '🇹🇷'),
-        '+91': ('الهند', '🇮🇳'),
-        '+92': ('باكستان', '🇵🇰'),
-        '+93': ('أفغانستان', '🇦🇫'),
-        '+94': ('سريلانكا', '🇱🇰'),
-        '+95': ('ميانمار', '🇲🇲'),
-        '+98': ('إيران', '🇮🇷'),
-        '+212': ('المغرب', '🇲🇦'),
-        '+213': ('الجزائر', '🇩🇿'),
-        '+216': ('تونس', '🇹🇳'),
-        '+218': ('ليبيا', '🇱🇾'),
-        '+220': ('غامبيا', '🇬🇲'),
-        '+221': ('السنغال', '🇸🇳'),
-        '+222': ('موريتانيا', '🇲🇷'),
-        '+223': ('مالي', '🇲🇱'),
-        '+224': ('غينيا', '🇬🇳'),
-        '+225': ('ساحل العاج', '🇨🇮'),
-        '+226': ('بوركينا فاسو', '🇧🇫'),
-        '+227': ('النيجر', '🇳🇪'),
-        '+228': ('توغو', '🇹🇬'),
-        '+229': ('بنين', '🇧🇯'),
-        '+230': ('موريشيوس', '🇲🇺'),
-        '+231': ('ليبيريا', '🇱🇷'),
-        '+232': ('سيراليون', '🇸🇱'),
-        '+233': ('غانا', '🇬🇭'),
-        '+234': ('نيجيريا', '🇳🇬'),
-        '+235': ('تشاد', '🇹🇩'),
-        '+236': ('جمهورية أفريقيا الوسطى', '🇨🇫'),
-        '+237': ('الكاميرون', '🇨🇲'),
-        '+238': ('الرأس الأخضر', '🇨🇻'),
-        '+239': ('ساو تومي وبرينسيبي', '🇸🇹'),
-        '+240': ('غينيا الاستوائية', '🇬🇶'),
-        '+241': ('الغابون', '🇬🇦'),
-        '+242': ('جمهورية الكونغو', '🇨🇬'),
-        '+243': ('جمهورية الكونغو الديمقراطية', '🇨🇩'),
-        '+244': ('أنغولا', '🇦🇴'),
-        '+245': ('غينيا بيساو', '🇬🇼'),
-        '+248': ('سيشل', '🇸🇨'),
-        '+249': ('السودان', '🇸🇩'),
-        '+250': ('رواندا', '🇷🇼'),
-        '+251': ('إثيوبيا', '🇪🇹'),
-        '+252': ('الصومال', '🇸🇴'),
-        '+253': ('جيبوتي', '🇩🇯'),
-        '+254': ('كينيا', '🇰🇪'),
-        '+255': ('تنزانيا', '🇹🇿'),
-        '+256': ('أوغندا', '🇺🇬'),
-        '+257': ('بوروندي', '🇧🇮'),
-        '+258': ('موزمبيق', '🇲🇿'),
-        '+260': ('زامبيا', '🇿🇲'),
-        '+261': ('مدغشقر', '🇲🇬'),
-        '+263': ('زيمبابوي', '🇿🇼'),
-        '+264': ('ناميبيا', '🇳🇦'),
-        '+265': ('ملاوي', '🇲🇼'),
-        '+266': ('ليسوتو', '🇱🇸'),
-        '+267': ('بوتسوانا', '🇧🇼'),
-        '+268': ('إسواتيني', '🇸🇿'),
-        '+269': ('جزر القمر', '🇰🇲'),
-        '+351': ('البرتغال', '🇵🇹'),
-        '+352': ('لوكسمبورغ', '🇱🇺'),
-        '+353': ('أيرلندا', '🇮🇪'),
-        '+354': ('أيسلندا', '🇮🇸'),
-        '+355': ('ألبانيا', '🇦🇱'),
-        '+356': ('مالطا', '🇲🇹'),
-        '+357': ('قبرص', '🇨🇾'),
-        '+358': ('فنلندا', '🇫🇮'),
-        '+359': ('بلغاريا', '🇧🇬'),
-        '+370': ('ليتوانيا', '🇱🇹'),
-        '+371': ('لاتفيا', '🇱🇻'),
-        '+372': ('إستونيا', '🇪🇪'),
-        '+373': ('مولدوفا', '🇲🇩'),
-        '+374': ('أرمينيا', '🇦🇲'),
-        '+375': ('بيلاروس', '🇧🇾'),
-        '+376': ('أندورا', '🇦🇩'),
-        '+377': ('موناكو', '🇲🇨'),
-        '+378': ('سان مارينو', '🇸🇲'),
-        '+380': ('أوكرانيا', '🇺🇦'),
-        '+381': ('صربيا', '🇷🇸'),
-        '+382': ('الجبل الأسود', '🇲🇪'),
-        '+383': ('كوسوفو', '🇽🇰'),
-        '+385': ('كرواتيا', '🇭🇷'),
-        '+386': ('سلوفينيا', '🇸🇮'),
-        '+387': ('البوسنة والهرسك', '🇧🇦'),
-        '+389': ('مقدونيا الشمالية', '🇲🇰'),
-        '+420': ('التشيك', '🇨🇿'),
-        '+421': ('سلوفاكيا', '🇸🇰'),
-        '+423': ('ليختنشتاين', '🇱🇮'),
-        '+500': ('جزر فوكلاند', '🇫🇰'),
-        '+501': ('بليز', '🇧🇿'),
-        '+502': ('غواتيمالا', '🇬🇹'),
-        '+503': ('السلفادور', '🇸🇻'),
-        '+504': ('هندوراس', '🇭🇳'),
-        '+505': ('نيكاراغوا', '🇳🇮'),
-        '+506': ('كوستاريكا', '🇨🇷'),
-        '+507': ('بنما', '🇵🇦'),
-        '+509': ('هايتي', '🇭🇹'),
-        '+590': ('غوادلوب', '🇬🇵'),
-        '+591': ('بوليفيا', '🇧🇴'),
-        '+592': ('غيانا', '🇬🇾'),
-        '+593': ('الإكوادور', '🇪🇨'),
-        '+594': ('غيانا الفرنسية', '🇬🇫'),
-        '+595': ('باراغواي', '🇵🇾'),
-        '+596': ('مارتينيك', '🇲🇶'),
-        '+597': ('سورينام', '🇸🇷'),
-        '+598': ('أوروغواي', '🇺🇾'),
-        '+670': ('تيمور الشرقية', '🇹🇱'),
-        '+673': ('بروناي', '🇧🇳'),
-        '+674': ('ناورو', '🇳🇷'),
-        '+675': ('بابوا غينيا الجديدة', '🇵🇬'),
-        '+676': ('تونغا', '🇹🇴'),
-        '+677': ('جزر سليمان', '🇸🇧'),
-        '+678': ('فانواتو', '🇻🇺'),
-        '+679': ('فيجي', '🇫🇯'),
-        '+680': ('بالاو', '🇵🇼'),
-        '+681': ('واليس وفوتونا', '🇼🇫'),
-        '+682': ('جزر كوك', '🇨🇰'),
-        '+683': ('نيوي', '🇳🇺'),
-        '+684': ('ساموا الأمريكية', '🇦🇸'),
-        '+685': ('ساموا', '🇼🇸'),
-        '+686': ('كيريباتي', '🇰🇮'),
-        '+687': ('كاليدونيا الجديدة', '🇳🇨'),
-        '+688': ('توفالو', '🇹🇻'),
-        '+689': ('بولينيزيا الفرنسية', '🇵🇫'),
-        '+690': ('توكيلاو', '🇹🇰'),
-        '+691': ('ميكرونيزيا', '🇫🇲'),
-        '+692': ('جزر مارشال', '🇲🇭'),
-        '+850': ('كوريا الشمالية', '🇰🇵'),
-        '+852': ('هونغ كونغ', '🇭🇰'),
-        '+853': ('ماكاو', '🇲🇴'),
-        '+855': ('كمبوديا', '🇰🇭'),
-        '+856': ('لاوس', '🇱🇦'),
-        '+880': ('بنغلاديش', '🇧🇩'),
-        '+886': ('تايوان', '🇹🇼'),
-        '+960': ('المالديف', '🇲🇻'),
-        '+961': ('لبنان', '🇱🇧'),
-        '+962': ('الأردن', '🇯🇴'),
-        '+963': ('سوريا', '🇸🇾'),
-        '+964': ('العراق', '🇮🇶'),
-        '+965': ('الكويت', '🇰🇼'),
-        '+966': ('السعودية', '🇸🇦'),
-        '+967': ('اليمن', '🇾🇪'),
-        '+968': ('عمان', '🇴🇲'),
-        '+970': ('فلسطين', '🇵🇸'),
-        '+971': ('الإمارات', '🇦🇪'),
-        '+972': ('إسرائيل', '🇮🇱'),
-        '+973': ('البحرين', '🇧🇭'),
-        '+974': ('قطر', '🇶🇦'),
-        '+975': ('بوتان', '🇧🇹'),
-        '+976': ('منغوليا', '🇲🇳'),
-        '+977': ('نيبال', '🇳🇵'),
-        '+992': ('طاجيكستان', '🇹🇯'),
-        '+993': ('تركمانستان', '🇹🇲'),
-        '+994': ('أذربيجان', '🇦🇿'),
-        '+995': ('جورجيا', '🇬🇪'),
-        '+996': ('قيرغيزستان', '🇰🇬'),
-        '+998': ('أوزبكستان', '🇺🇿'),
-    }
-    
-    return country_info.get(country_code, ('دولة غير معروفة', '🌍'))
+    return _COUNTRY_INFO.get(country_code, _UNKNOWN_COUNTRY)
 
 def ensure_service_country_exists(service_id: int, country_code: str, db_session) -> ServiceCountry:
     """Ensure ServiceCountry entry exists for the given service and country code"""
@@ -703,8 +1278,51 @@ def ensure_service_country_exists(service_id: int, country_code: str, db_session
     
     return service_country
 
+def should_notify_low_stock(service_id: int, country_code: str) -> bool:
+    """Check whether admin should be notified about an empty country"""
+    last_notified = low_stock_notified.get((service_id, country_code))
+    return not (last_notified and datetime.now() - last_notified < LOW_STOCK_NOTIFY_INTERVAL)
+
+def mark_low_stock_notified(service_id: int, country_code: str):
+    """Record a delivered empty country alert, so it isn't repeated within the interval"""
+    low_stock_notified[(service_id, country_code)] = datetime.now()
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Split text into chunks that fit in a single Telegram message, breaking on lines"""
+    chunks = []
+    current = ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+async def send_message_limited(chat_id, text: str, **kwargs):
+    """Send a message while respecting Telegram's global send rate"""
+    global telegram_next_send_at
+    # Hand out send slots spaced 1/TELEGRAM_SENDS_PER_SEC apart and wait for ours
+    now = time.monotonic()
+    send_at = max(now, telegram_next_send_at)
+    telegram_next_send_at = send_at + 1 / TELEGRAM_SENDS_PER_SEC
+    if send_at > now:
+        await asyncio.sleep(send_at - now)
+    return await bot.send_message(chat_id, text, **kwargs)
+
 async def notify_admin_low_stock(service_id: int, country_code: str, country_name: str):
     """Notify admin when a country runs out of numbers"""
+    if not should_notify_low_stock(service_id, country_code):
+        return
     try:
         message = (
             f"⚠️ تنبيه نفاد المخزون!\n\n"
@@ -714,7 +1332,8 @@ async def notify_admin_low_stock(service_id: int, country_code: str, country_nam
             f"يرجى إضافة أرقام جديدة."
         )
         
-        await bot.send_message(ADMIN_ID, message)
+        await send_message_limited(ADMIN_ID, message)
+        mark_low_stock_notified(service_id, country_code)
         logger.info(f"Sent low stock notification for {country_name} ({country_code})")
     except Exception as e:
         logger.error(f"Failed to send low stock notification: {e}")
@@ -723,41 +1342,74 @@ async def check_and_notify_empty_countries():
     """Check for countries with no available numbers and notify admin"""
     db = get_db()
     try:
-        # Get all service-country combinations with their available number counts
-        countries_with_zero = db.query(ServiceCountry).filter(
-            ServiceCountry.active == True
-        ).all()
-        
-        for service_country in countries_with_zero:
-            available_count = db.query(Number).filter(
-                Number.service_id == service_country.service_id,
-                Number.country_code == service_country.country_code,
+        # Get all active service-country combinations with no available numbers in one query
+        countries_with_zero = db.query(ServiceCountry).outerjoin(
+            Number,
+            and_(
+                Number.service_id == ServiceCountry.service_id,
+                Number.country_code == ServiceCountry.country_code,
                 Number.status == NumberStatus.AVAILABLE
-            ).count()
-            
-            if available_count == 0:
-                # Check if we already notified recently (within last hour)
-                # This is a simple check to avoid spam notifications
-                await notify_admin_low_stock(
-                    int(service_country.service_id), 
-                    str(service_country.country_code), 
-                    str(service_country.country_name)
-                )
-                
+            )
+        ).filter(
+            ServiceCountry.active == True
+        ).group_by(ServiceCountry.id).having(func.count(Number.id) == 0).all()
+        
+        # Skip countries we already notified about within the last hour
+        empty_countries = [
+            (int(sc.service_id), str(sc.country_code), str(sc.country_name))
+            for sc in countries_with_zero
+            if should_notify_low_stock(int(sc.service_id), str(sc.country_code))
+        ]
     finally:
         db.close()
+    
+    if not empty_countries:
+        return
+    
+    # Send one digest instead of a message per country
+    report = "⚠️ تنبيه نفاد المخزون!\n\n" + "\n".join(
+        f"🌍 {country_name} ({country_code}) - 📱 الخدمة: {service_id}"
+        for service_id, country_code, country_name in empty_countries
+    ) + "\n\nلا توجد أرقام متاحة لهذه الدول.\nيرجى إضافة أرقام جديدة."
+    
+    # Send the parts one after another so a long digest arrives in order
+    try:
+        for chunk in split_message(report):
+            await send_message_limited(ADMIN_ID, chunk)
+    except Exception as e:
+        # Nothing is recorded, so the next check retries the whole digest
+        logger.error(f"Failed to send low stock notification: {e}")
+        return
+    
+    for service_id, country_code, _ in empty_countries:
+        mark_low_stock_notified(service_id, country_code)
+    logger.info(f"Sent low stock report for {len(empty_countries)} countries")
+
+# Precompiled patterns for HMAC signed messages
+_HMAC_PATTERN = re.compile(r'hmac:([a-fA-F0-9]+)')
+_HMAC_TS_PATTERN = re.compile(r'ts:(\d+)')
+_HMAC_TO_PATTERN = re.compile(r'to:(\+\d+)')
+_HMAC_CODE_PATTERN = re.compile(r'code:(\d+)')
+
+@lru_cache(maxsize=256)
+def get_hmac_template(secret_token: str) -> "hmac.HMAC":
+    """Get a keyed HMAC-SHA256 object for a secret token, copied per message"""
+    return hmac.new(secret_token.encode(), digestmod=hashlib.sha256)
 
 def verify_hmac_signature(message_text: str, secret_token: str) -> bool:
     """Verify HMAC signature in message"""
     try:
         # Expected format: "to:+1234567890 code:123456 ts:1640000000 hmac:abcdef123456"
-        hmac_match = re.search(r'hmac:([a-fA-F0-9]+)', message_text)
-        ts_match = re.search(r'ts:(\d+)', message_text)
+        hmac_match = _HMAC_PATTERN.search(message_text)
+        ts_match = _HMAC_TS_PATTERN.search(message_text)
         
         if not hmac_match or not ts_match:
             return False
         
-        received_hmac = hmac_match.group(1)
+        try:
+            received_hmac = bytes.fromhex(hmac_match.group(1))
+        except ValueError:
+            return False
         timestamp = int(ts_match.group(1))
         
         # Check timestamp window (5 minutes)
@@ -766,8 +1418,8 @@ def verify_hmac_signature(message_text: str, secret_token: str) -> bool:
             return False
         
         # Extract payload for HMAC calculation
-        number_match = re.search(r'to:(\+\d+)', message_text)
-        code_match = re.search(r'code:(\d+)', message_text)
+        number_match = _HMAC_TO_PATTERN.search(message_text)
+        code_match = _HMAC_CODE_PATTERN.search(message_text)
         
         if not number_match or not code_match:
             return False
@@ -777,11 +1429,9 @@ def verify_hmac_signature(message_text: str, secret_token: str) -> bool:
         
         # Calculate expected HMAC
         payload = f"{number}|{code}|{timestamp}"
-        expected_hmac = hmac.new(
-            secret_token.encode(),
-            payload.encode(),
-            hashlib.sha256
-        ).hexdigest()
+        hmac_obj = get_hmac_template(secret_token).copy()
+        hmac_obj.update(payload.encode())
+        expected_hmac = hmac_obj.digest()
         
         return hmac.compare_digest(expected_hmac, received_hmac)
     
@@ -816,37 +1466,79 @@ async def send_formatted_sms_to_group(group_chat_id: str, phone_number: str, cod
         logger.error(f"Error sending formatted SMS to group {group_chat_id}: {e}")
         return False
 
-def test_extract_number_and_code():
-    """Test function for number and code extraction"""
-    test_cases = [
-        "to:+20112763404 code:123456",
-        "to: +20112763404 code: 123456", 
-        "TO:+20112763404 CODE:123456",
-        "message to:+20112763404 code:654321 end",
-        "استلمت رمز to:+971501234567 code:789012 للتحقق"
-    ]
-    
-    print("Testing extract_number_and_code function:")
-    for i, test_msg in enumerate(test_cases, 1):
-        number, code = extract_number_and_code(test_msg, r'\d{6}')
-        print(f"Test {i}: '{test_msg}' -> number={number}, code={code}")
-    
-    return True
+# Precompiled patterns for 'to: ... code: ...' SMS messages
+_SMS_TO_PATTERN = re.compile(r'to:\s*(\+\d+)', re.IGNORECASE)
+_SMS_CODE_PATTERN = re.compile(r'code:\s*(\d+)', re.IGNORECASE)
+
+def scan_marker_value(text: str, lowered: str, marker: str, prefix: str = '') -> Optional[str]:
+    """Return prefix + digits following the first `marker` (plus optional spaces) that has them"""
+    length = len(text)
+    start = lowered.find(marker)
+    while start != -1:
+        i = start + len(marker)
+        while i < length and text[i].isspace():
+            i += 1
+        if text.startswith(prefix, i):
+            end = i + len(prefix)
+            while end < length and text[end].isdecimal():
+                end += 1
+            if end > i + len(prefix):
+                return text[i:end]
+        start = lowered.find(marker, start + 1)
+    return None
+
+def parse_to_code(text: str) -> tuple[Optional[str], Optional[str]]:
+    """Scan 'to:+<digits>' and 'code:<digits>' out of a message without running a regex"""
+    lowered = text.lower()
+    if len(lowered) != len(text):
+        # Lowercasing shifted offsets (rare non-ASCII letters), use the regexes instead
+        number_match = _SMS_TO_PATTERN.search(text)
+        code_match = _SMS_CODE_PATTERN.search(text)
+        return (number_match.group(1) if number_match else None,
+                code_match.group(1) if code_match else None)
+    return scan_marker_value(text, lowered, 'to:', '+'), scan_marker_value(text, lowered, 'code:')
+
+def dump_payload(payload: Dict[str, Any]) -> str:
+    """Serialize a raw payload for storage, using orjson when installed"""
+    if orjson:
+        return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(payload)
+
+@lru_cache(maxsize=256)
+def get_compiled_pattern(pattern: str) -> re.Pattern:
+    """Compile a service regex pattern once and reuse it"""
+    return re.compile(pattern)
+
+@lru_cache(maxsize=8)
+def get_service_detect_pattern(service_names: tuple) -> re.Pattern:
+    """Compile one case-insensitive alternation where group s<i> matches service_names[i]"""
+    return re.compile(
+        '|'.join(f'(?P<s{i}>{re.escape(name)})' for i, name in enumerate(service_names)),
+        re.IGNORECASE
+    )
+
+def infer_service_name(text: str) -> Optional[str]:
+    """Find the first active service name mentioned in a message text"""
+    # Longest names first so "Telegram X" wins over "Telegram" at the same position
+    service_names = tuple(sorted(
+        {str(service.name) for service in get_active_services() if service.name},
+        key=lambda name: (-len(name), name)
+    ))
+    if not service_names:
+        return None
+    match = get_service_detect_pattern(service_names).search(text)
+    return service_names[int(match.lastgroup[1:])] if match else None
 
-def extract_number_and_code(message_text: str, regex_pattern: str) -> tuple[Optional[str], Optional[str]]:
+def extract_number_and_code(message_text: str, code_pattern: re.Pattern) -> tuple[Optional[str], Optional[str]]:
     """Extract phone number and code from message text in format: to:+20112763404 code:123456"""
     try:
-        # Extract number from 'to:' format (with or without spaces)
-        number_match = re.search(r'to:\s*(\+\d+)', message_text, re.IGNORECASE)
-        number = normalize_phone_number(number_match.group(1)) if number_match else None
-        
-        # Extract code from 'code:' format (with or without spaces)
-        code_match = re.search(r'code:\s*(\d+)', message_text, re.IGNORECASE)
-        if code_match:
-            code = code_match.group(1)
-        else:
+        # Extract number and code from 'to:' / 'code:' format (with or without spaces)
+        raw_number, code = parse_to_code(message_text)
+        number = normalize_phone_number(raw_number) if raw_number else None
+        
+        if not code:
             # Fallback to service-specific regex pattern
-            code_match = re.search(regex_pattern, message_text)
+            code_match = code_pattern.search(message_text)
             code = code_match.group() if code_match else None
         
         # Log for debugging
@@ -862,12 +1554,40 @@ def extract_number_and_code(message_text: str, regex_pattern: str) -> tuple[Opti
 
 async def is_user_admin_in_chat(user_id: int, chat_id: str) -> bool:
     """Check if user is admin in the chat"""
+    key = (str(chat_id), int(user_id))
+    cached = admin_status_cache.get(key)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    
     try:
         chat_member = await bot.get_chat_member(chat_id, user_id)
-        return chat_member.status in ['administrator', 'creator']
+        is_admin = chat_member.status in ['administrator', 'creator']
     except Exception as e:
         logger.error(f"Error checking admin status: {e}")
         return False
+    
+    cache_admin_status(key, is_admin)
+    return is_admin
+
+def cache_admin_status(key: tuple, is_admin: bool):
+    """Store a group admin status, evicting expired entries and the oldest ones while the cache is full"""
+    now = time.monotonic()
+    # Entries share one TTL and are kept in insertion order, so expired ones sit at the front
+    admin_status_cache.pop(key, None)
+    while admin_status_cache:
+        oldest_key = next(iter(admin_status_cache))
+        if (admin_status_cache[oldest_key][0] > now
+                and len(admin_status_cache) < ADMIN_STATUS_CACHE_MAX_ENTRIES):
+            break
+        del admin_status_cache[oldest_key]
+    admin_status_cache[key] = (now + ADMIN_STATUS_CACHE_TTL_SEC, is_admin)
+
+@dp.chat_member()
+async def chat_member_updated_handler(event: types.ChatMemberUpdated):
+    """Keep the admin status cache in sync with membership changes"""
+    key = (str(event.chat.id), event.new_chat_member.user.id)
+    is_admin = event.new_chat_member.status in ['administrator', 'creator']
+    cache_admin_status(key, is_admin)
 
 async def extract_code_from_message(text: str, service_name: str) -> Optional[str]:
     """Extract OTP code from message text based on service regex"""
@@ -877,148 +1597,145 @@ async def extract_code_from_message(text: str, service_name: str) -> Optional[st
         if not service:
             return None
         
-        # Get regex pattern for this service
-        mapping = db.query(ServiceProviderMap).filter(ServiceProviderMap.service_id == service.id).first()
-        if not mapping:
-            # Default regex for common OTP patterns
-            pattern = r'\b\d{5,6}\b'
-        else:
-            pattern = str(mapping.regex_pattern)
+        # Get compiled regex pattern for this service
+        _, pattern = get_service_config(int(service.id), db)
         
-        match = re.search(pattern, text)
+        match = pattern.search(text)
         return match.group() if match else None
     finally:
         db.close()
 
+def build_main_keyboard_rows(services: List[Service], lang_code: str, is_admin: bool) -> List[List[InlineKeyboardButton]]:
+    """Build the main menu button rows for one language"""
+    # Add service buttons (2 per row)
+    service_names = get_texts((service.name for service in services), lang_code)
+    rows = []
+    for i in range(0, len(services), 2):
+        rows.append([
+            InlineKeyboardButton(
+                text=f"{service.emoji} {service_names[service.name]}",
+                callback_data=f"svc_{service.id}"
+            )
+            for service in services[i:i + 2]
+        ])
+    
+    # Additional buttons with localization
+    rows.append([
+        InlineKeyboardButton(text=t('free_credits', lang_code), callback_data="free_credits"),
+        InlineKeyboardButton(text=t('my_balance', lang_code), callback_data="my_balance")
+    ])
+    
+    # Show admin button only for admin
+    if is_admin:
+        rows.append([
+            InlineKeyboardButton(text=t('help', lang_code), callback_data="help"),
+            InlineKeyboardButton(text=t('admin_panel', lang_code), callback_data="admin")
+        ])
+    else:
+        rows.append([
+            InlineKeyboardButton(text=t('help', lang_code), callback_data="help"),
+            InlineKeyboardButton(text=t('settings', lang_code), callback_data="settings")
+        ])
+    return rows
+
 async def create_main_keyboard(user_id: str = None) -> InlineKeyboardMarkup:
     """Create main menu keyboard"""
-    keyboard = InlineKeyboardBuilder()
-    
     # Get user language
     lang_code = 'ar'  # Default to Arabic
     if user_id:
         lang_code = get_user_language(user_id)
+    is_admin = bool(user_id) and (int(user_id) == ADMIN_ID or is_admin_session_valid(int(user_id)))
+    
+    # Reuse the prebuilt markup while the cached services list is unchanged;
+    # the list object is replaced on reload, so identity acts as its version
+    services = get_active_services()
+    cached = main_keyboard_cache.get((lang_code, is_admin))
+    if cached and cached[0] is services:
+        return cached[1]
+    
+    markup = InlineKeyboardMarkup(inline_keyboard=build_main_keyboard_rows(services, lang_code, is_admin))
+    main_keyboard_cache[(lang_code, is_admin)] = (services, markup)
+    return markup
+
+@lru_cache(maxsize=64)
+def get_language_markup(back_text: str, back_callback: str) -> InlineKeyboardMarkup:
+    """Language selection keyboard, built once per back button"""
+    keyboard = InlineKeyboardBuilder()
     
-    # Get active services
-    db = get_db()
-    try:
-        services = db.query(Service).filter(Service.active == True).all()
-        
-        # Add service buttons (2 per row)
-        for i in range(0, len(services), 2):
-            row = []
-            for j in range(2):
-                if i + j < len(services):
-                    service = services[i + j]
-                    translated_name = await get_text(service.name, lang_code)
-                    row.append(InlineKeyboardButton(
-                        text=f"{service.emoji} {translated_name}",
-                        callback_data=f"svc_{service.id}"
-                    ))
-            keyboard.row(*row)
-        
-        # Additional buttons with localization
-        free_credits_text = t('free_credits', lang_code)
-        balance_text = t('my_balance', lang_code)
-        
-        keyboard.row(
-            InlineKeyboardButton(text=free_credits_text, callback_data="free_credits"),
-            InlineKeyboardButton(text=balance_text, callback_data="my_balance")
-        )
-        
-        # Show admin button only for admin
-        if user_id and (int(user_id) == ADMIN_ID or is_admin_session_valid(int(user_id))):
-            keyboard.row(
-                InlineKeyboardButton(text=t('help', lang_code), callback_data="help"),
-                InlineKeyboardButton(text=t('admin_panel', lang_code), callback_data="admin")
-            )
-        else:
-            keyboard.row(
-                InlineKeyboardButton(text=t('help', lang_code), callback_data="help"),
-                InlineKeyboardButton(text=t('settings', lang_code), callback_data="settings")
-            )
-        
-        return keyboard.as_markup()
-    finally:
-        db.close()
+    # Add language selection buttons (2 per row)
+    lang_items = list(SUPPORTED_LANGUAGES.items())
+    for i in range(0, len(lang_items), 2):
+        keyboard.row(*[
+            InlineKeyboardButton(text=name, callback_data=f"set_lang_{code}")
+            for code, name in lang_items[i:i + 2]
+        ])
+    
+    keyboard.row(InlineKeyboardButton(text=back_text, callback_data=back_callback))
+    return keyboard.as_markup()
 
 def create_countries_keyboard(service_id: int, page: int = 0) -> InlineKeyboardMarkup:
     """Create countries selection keyboard for a service"""
     keyboard = InlineKeyboardBuilder()
     
+    # Available numbers per country for this service, one GROUP BY shared across page flips
+    available_counts = get_available_counts(service_id)
+    
+    # Keep active countries that have available numbers, already sorted by name for consistent display
+    countries_with_numbers = [
+        (country, available_counts[country.country_code])
+        for country in get_active_service_countries(service_id)
+        if country.country_code in available_counts
+    ]
+    
+    # Apply pagination to filtered results
+    total_countries_with_numbers = len(countries_with_numbers)
+    start_index = page * PAGE_SIZE
+    end_index = start_index + PAGE_SIZE
+    page_countries = countries_with_numbers[start_index:end_index]
+    
+    # Create buttons for countries on current page
+    for country, available_count in page_countries:
+        keyboard.row(InlineKeyboardButton(
+            text=f"{country.flag} {country.country_name} (✅ {available_count})",
+            callback_data=f"cty_{service_id}_{country.country_code}"
+        ))
+    
+    # Navigation buttons based on filtered results
+    nav_buttons = []
+    if page > 0:
+        nav_buttons.append(InlineKeyboardButton(text="⏮️ السابق", callback_data=f"cty_page_{service_id}_{page-1}"))
+    
+    if end_index < total_countries_with_numbers:
+        nav_buttons.append(InlineKeyboardButton(text="⏭️ التالي", callback_data=f"cty_page_{service_id}_{page+1}"))
+    
+    if nav_buttons:
+        keyboard.row(*nav_buttons)
+    
+    # Add information about current page
+    if total_countries_with_numbers > PAGE_SIZE:
+        current_start = start_index + 1
+        current_end = min(end_index, total_countries_with_numbers)
+        keyboard.row(InlineKeyboardButton(
+            text=f"📄 {current_start}-{current_end} من {total_countries_with_numbers}",
+            callback_data="no_action"
+        ))
+    
+    keyboard.row(InlineKeyboardButton(text="🔙 الرئيسية", callback_data="main_menu"))
+    
+    return keyboard.as_markup()
+
+def create_service_groups_keyboard() -> InlineKeyboardMarkup:
+    """Create service groups management keyboard"""
+    keyboard = InlineKeyboardBuilder()
+    
     db = get_db()
     try:
-        # First, get all countries for this service and filter those with available numbers
-        all_countries = db.query(ServiceCountry).filter(
-            ServiceCountry.service_id == service_id,
-            ServiceCountry.active == True
-        ).all()
-        
-        # Filter countries to only include those with available numbers
-        countries_with_numbers = []
-        for country in all_countries:
-            # Count available numbers for this country and service
-            available_count = db.query(Number).filter(
-                Number.service_id == service_id,
-                Number.country_code == country.country_code,
-                Number.status == NumberStatus.AVAILABLE
-            ).count()
-            
-            # Only include countries with available numbers
-            if available_count > 0:
-                countries_with_numbers.append((country, available_count))
-        
-        # Sort countries by name for consistent display
-        countries_with_numbers.sort(key=lambda x: x[0].country_name)
-        
-        # Apply pagination to filtered results
-        total_countries_with_numbers = len(countries_with_numbers)
-        start_index = page * PAGE_SIZE
-        end_index = start_index + PAGE_SIZE
-        page_countries = countries_with_numbers[start_index:end_index]
-        
-        # Create buttons for countries on current page
-        for country, available_count in page_countries:
-            keyboard.row(InlineKeyboardButton(
-                text=f"{country.flag} {country.country_name} (✅ {available_count})",
-                callback_data=f"cty_{service_id}_{country.country_code}"
-            ))
-        
-        # Navigation buttons based on filtered results
-        nav_buttons = []
-        if page > 0:
-            nav_buttons.append(InlineKeyboardButton(text="⏮️ السابق", callback_data=f"cty_page_{service_id}_{page-1}"))
-        
-        if end_index < total_countries_with_numbers:
-            nav_buttons.append(InlineKeyboardButton(text="⏭️ التالي", callback_data=f"cty_page_{service_id}_{page+1}"))
-        
-        if nav_buttons:
-            keyboard.row(*nav_buttons)
-        
-        # Add information about current page
-        if total_countries_with_numbers > PAGE_SIZE:
-            current_start = start_index + 1
-            current_end = min(end_index, total_countries_with_numbers)
-            keyboard.row(InlineKeyboardButton(
-                text=f"📄 {current_start}-{current_end} من {total_countries_with_numbers}",
-                callback_data="no_action"
-            ))
-        
-        keyboard.row(InlineKeyboardButton(text="🔙 الرئيسية", callback_data="main_menu"))
-        
-        return keyboard.as_markup()
-    finally:
-        db.close()
-
-def create_service_groups_keyboard() -> InlineKeyboardMarkup:
-    """Create service groups management keyboard"""
-    keyboard = InlineKeyboardBuilder()
-    
-    db = get_db()
-    try:
-        service_groups = db.query(ServiceGroup).join(Service).filter(
-            ServiceGroup.active == True,
-            Service.active == True
+        # Fill sg.service from the join itself so the loop below never lazy-loads
+        service_groups = db.query(ServiceGroup).join(Service).options(
+            contains_eager(ServiceGroup.service)
+        ).filter(
+            ServiceGroup.active == True,
+            Service.active == True
         ).all()
         
         for sg in service_groups:
@@ -1082,94 +1799,133 @@ def create_admin_keyboard() -> InlineKeyboardMarkup:
     keyboard.row(InlineKeyboardButton(text="🔙 الرئيسية", callback_data="main_menu"))
     return keyboard.as_markup()
 
-async def reserve_number(user_id: int, service_id: int, country_code: str) -> Optional[Reservation]:
-    """Reserve a number for user"""
-    db = get_db()
-    try:
-        # Find available number
-        available_number = db.query(Number).filter(
-            Number.service_id == service_id,
-            Number.country_code == country_code,
-            Number.status == NumberStatus.AVAILABLE
-        ).first()
-        
-        if not available_number:
-            return None
-        
-        # Create reservation
-        expires_at = datetime.now() + timedelta(minutes=RESERVATION_TIMEOUT_MIN)
-        reservation = Reservation(
-            user_id=user_id,
-            service_id=service_id,
-            number_id=available_number.id,
-            status=ReservationStatus.WAITING_CODE,
-            expired_at=expires_at
-        )
-        
-        # Update number status
-        available_number.status = NumberStatus.RESERVED
-        available_number.reserved_by_user_id = user_id
-        available_number.reserved_at = datetime.now()
-        available_number.expires_at = expires_at
-        
-        db.add(reservation)
-        db.commit()
-        db.refresh(reservation)
-        
-        return reservation
-    finally:
-        db.close()
-
-async def complete_reservation_atomic(reservation_id: int, code: str) -> bool:
-    """Complete reservation atomically with proper transaction handling"""
-    db = get_db()
-    try:
-        # Begin transaction
-        db.begin()
-        
-        # Lock the reservation for update
-        reservation = db.query(Reservation).filter(
+def reserve_number_sync(user_id: int, service_id: int, country_code: str) -> Optional[Tuple[Reservation, int]]:
+    """Reserve a number for user, returning the reservation and how many numbers are left
+    (blocking, run it off the event loop)"""
+    with db_session() as db:
+        try:
+            now = datetime.now()
+            expires_at = now + timedelta(minutes=RESERVATION_TIMEOUT_MIN)
+            
+            # Claim an available number in one statement, skipping rows other reservations already hold
+            # (SKIP LOCKED requires PostgreSQL or MySQL 8+)
+            available_number_id = select(Number.id).where(
+                Number.service_id == service_id,
+                Number.country_code == country_code,
+                Number.status == NumberStatus.AVAILABLE
+            ).limit(1).with_for_update(skip_locked=True).scalar_subquery()
+            
+            # RETURNING subqueries see the table as it was before this UPDATE,
+            # so the count still includes the number being claimed
+            available_count = select(func.count(Number.id)).where(
+                Number.service_id == service_id,
+                Number.country_code == country_code,
+                Number.status == NumberStatus.AVAILABLE
+            ).scalar_subquery()
+            
+            claimed = db.execute(
+                update(Number).where(
+                    Number.id == available_number_id
+                ).values(
+                    status=NumberStatus.RESERVED,
+                    reserved_by_user_id=user_id,
+                    reserved_at=now,
+                    expires_at=expires_at
+                ).returning(Number.id, available_count)
+            ).first()
+            
+            if not claimed:
+                db.rollback()
+                return None
+            number_id, available_before = claimed
+            
+            # Create reservation
+            reservation = Reservation(
+                user_id=user_id,
+                service_id=service_id,
+                number_id=number_id,
+                status=ReservationStatus.WAITING_CODE,
+                expired_at=expires_at
+            )
+            
+            db.add(reservation)
+            db.commit()
+            db.refresh(reservation)
+            
+            return reservation, max(available_before - 1, 0)
+        except Exception:
+            db.rollback()
+            raise
+
+async def reserve_number(user_id: int, service_id: int, country_code: str) -> Optional[Tuple[Reservation, int]]:
+    """Reserve a number for user, returning the reservation and remaining available count"""
+    return await asyncio.to_thread(reserve_number_sync, user_id, service_id, country_code)
+
+def complete_reservation_sync(reservation_id: int, code: str) -> Optional[dict]:
+    """Charge and complete a waiting reservation in one transaction, in the worker thread's own session
+    (blocking, run it off the event loop). Returns what the notifications need, with completed=False when
+    the balance didn't cover the price, or None when the reservation is gone or no longer waiting"""
+    with db_session() as db:
+        # Load and lock the reservation with its user and number in one query,
+        # also checking whether the same service/country has any other number left
+        other_number = aliased(Number)
+        has_stock = select(other_number.id).where(
+            other_number.service_id == Number.service_id,
+            other_number.country_code == Number.country_code,
+            other_number.status == NumberStatus.AVAILABLE,
+            other_number.id != Number.id
+        ).exists().label("has_stock")
+        
+        row = db.query(Reservation, User, Service, Number, has_stock).join(
+            User, User.id == Reservation.user_id
+        ).join(
+            Service, Service.id == Reservation.service_id
+        ).join(
+            Number, Number.id == Reservation.number_id
+        ).filter(
             Reservation.id == reservation_id
-        ).with_for_update().first()
+        ).with_for_update(of=[Reservation, User, Number]).first()
         
-        if not reservation or reservation.status != ReservationStatus.WAITING_CODE:
+        if not row:
             db.rollback()
-            return False
-        
-        # Lock related records
-        user = db.query(User).filter(
-            User.id == reservation.user_id
-        ).with_for_update().first()
-        
-        service = db.query(Service).filter(
-            Service.id == reservation.service_id
-        ).first()
-        
-        number = db.query(Number).filter(
-            Number.id == reservation.number_id
-        ).with_for_update().first()
+            return None
         
-        if not user or not service or not number:
+        reservation, user, service, number, stock_left = row
+        if reservation.status != ReservationStatus.WAITING_CODE:
             db.rollback()
-            return False
+            return None
         
         # Calculate price
-        price = float(number.price_override or service.default_price)
+        price = number.price_override or service.default_price
+        result = {
+            'telegram_id': str(user.telegram_id),
+            'price': price,
+            'balance': user.balance,
+            'phone_number': str(number.phone_number),
+            'country_code': str(number.country_code),
+            'service_id': int(reservation.service_id),
+            'stock_left': bool(stock_left),
+        }
         
-        # Check if user has enough balance
-        if float(user.balance or 0) < float(price):
+        # Deduct the price in SQL, only if the balance covers it
+        new_balance = db.execute(
+            update(User).where(
+                User.id == user.id,
+                func.coalesce(User.balance, 0) >= price
+            ).values(
+                balance=func.coalesce(User.balance, 0) - price
+            ).returning(User.balance),
+            execution_options={"synchronize_session": False}
+        ).scalar()
+        
+        if new_balance is None:
             # Mark reservation as failed due to insufficient balance
             reservation.status = ReservationStatus.EXPIRED
             db.commit()
-            
-            await bot.send_message(
-                str(user.telegram_id),
-                f"❌ رصيدك غير كافي!\nالسعر المطلوب: {price}\nرصيدك الحالي: {user.balance}"
-            )
-            return False
+            result['completed'] = False
+            return result
         
         # Complete the transaction atomically
-        user.balance = float(user.balance or 0) - price
         reservation.status = ReservationStatus.COMPLETED
         reservation.code_value = code
         reservation.completed_at = datetime.now()
@@ -1185,44 +1941,68 @@ async def complete_reservation_atomic(reservation_id: int, code: str) -> bool:
         )
         db.add(transaction)
         
-        # Check if this was the last available number for this country/service before committing
-        remaining_numbers = db.query(Number).filter(
-            Number.service_id == reservation.service_id,
-            Number.country_code == number.country_code,
-            Number.status == NumberStatus.AVAILABLE,
-            Number.id != number.id  # Exclude the current number being used
-        ).count()
-        
         # Commit all changes
         db.commit()
-        
-        # Format message with new style
-        sms_formatted = format_sms_message(str(number.phone_number), code)
-        
-        # Notify user
-        await bot.send_message(
-            str(user.telegram_id),
-            f"🎉 وصل الكود!\n\n"
-            f"```\n{sms_formatted}\n```\n\n"
-            f"تم خصم {price} من رصيدك\n"
-            f"رصيدك الحالي: {user.balance}",
-            parse_mode="Markdown"
-        )
-        
-        # Check if we need to notify admin about empty stock
-        if remaining_numbers == 0:
-            # Get country name for notification
-            country_name, _ = get_country_name_and_flag(str(number.country_code))
-            await notify_admin_low_stock(int(reservation.service_id), str(number.country_code), country_name)
-        
-        return True
-        
+        result['completed'] = True
+        result['balance'] = new_balance
+        return result
+
+async def complete_reservation_atomic(reservation_id: int, code: str) -> bool:
+    """Complete reservation atomically with proper transaction handling.
+    The database work runs in its own short session off the loop, so it never touches the caller's session
+    and no connection is held while the notifications go out"""
+    try:
+        result = await asyncio.to_thread(complete_reservation_sync, reservation_id, code)
     except Exception as e:
         logger.error(f"Error completing reservation atomically: {e}")
-        db.rollback()
         return False
-    finally:
-        db.close()
+    
+    if result is None:
+        return False
+    
+    if not result['completed']:
+        await send_message_limited(
+            result['telegram_id'],
+            f"❌ رصيدك غير كافي!\nالسعر المطلوب: {result['price']}\nرصيدك الحالي: {result['balance']}"
+        )
+        return False
+    
+    # Format message with new style
+    sms_formatted = format_sms_message(result['phone_number'], code)
+    
+    # Notify user
+    await send_message_limited(
+        result['telegram_id'],
+        CODE_DELIVERED_TEMPLATE.format(
+            sms_formatted=html.escape(sms_formatted),
+            price=result['price'],
+            balance=result['balance']
+        ),
+        parse_mode="HTML"
+    )
+    
+    # Check if we need to notify admin about empty stock
+    if not result['stock_left']:
+        # Get country name for notification
+        country_name, _ = get_country_name_and_flag(result['country_code'])
+        await notify_admin_low_stock(result['service_id'], result['country_code'], country_name)
+    
+    return True
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Get the shared keep-alive HTTP session for provider APIs"""
+    global http_session
+    if http_session is None or http_session.closed:
+        http_session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=PROVIDER_API_TIMEOUT),
+            connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300, keepalive_timeout=60)
+        )
+    return http_session
+
+async def close_http_session():
+    """Close the shared provider HTTP session on shutdown"""
+    if http_session is not None and not http_session.closed:
+        await http_session.close()
 
 async def poll_provider_messages():
     """Poll provider APIs for new messages"""
@@ -1235,16 +2015,18 @@ async def poll_provider_messages():
                     Provider.active == True,
                     Provider.mode == ProviderMode.POLL
                 ).all()
-                
-                for provider in providers:
-                    try:
-                        await process_provider_messages(provider)
-                    except Exception as e:
-                        logger.error(f"Error processing provider {provider.name}: {e}")
-                
             finally:
                 db.close()
-                
+            
+            # Poll providers concurrently so one slow provider doesn't hold up the others
+            results = await asyncio.gather(
+                *[process_provider_messages(provider) for provider in providers],
+                return_exceptions=True
+            )
+            for provider, result in zip(providers, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Error processing provider {provider.name}: {result}")
+        
         except Exception as e:
             logger.error(f"Error in polling loop: {e}")
         
@@ -1253,16 +2035,15 @@ async def poll_provider_messages():
 async def process_provider_messages(provider: Provider):
     """Process messages from a specific provider"""
     try:
-        timeout = aiohttp.ClientTimeout(total=PROVIDER_API_TIMEOUT)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            headers = {"Authorization": f"Bearer {provider.api_key}"}
-            async with session.get(f"{provider.base_url}/messages", headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    messages = data.get('messages', [])
-                    
-                    for msg in messages:
-                        await process_single_message(provider, msg)
+        session = get_http_session()
+        headers = {"Authorization": f"Bearer {provider.api_key}"}
+        async with session.get(f"{provider.base_url}/messages", headers=headers) as response:
+            if response.status == 200:
+                data = await response.json()
+                messages = data.get('messages', [])
+                
+                for msg in messages:
+                    await process_single_message(provider, msg)
                         
     except Exception as e:
         logger.error(f"Error fetching messages from {provider.name}: {e}")
@@ -1277,96 +2058,165 @@ async def process_single_message(provider: Provider, message: Dict[str, Any]):
         
         # Try to infer service from text if not provided
         if not service_name:
-            # Basic service inference (can be improved)
-            if 'whatsapp' in text.lower():
-                service_name = 'WhatsApp'
-            elif 'telegram' in text.lower():
-                service_name = 'Telegram'
-            # Add more service inference logic here
+            service_name = infer_service_name(text) or ''
         
         # Extract code
         code = await extract_code_from_message(text, service_name)
         if not code:
             return
         
-        # Find matching reservation
-        service = db.query(Service).filter(Service.name == service_name).first()
-        if not service:
-            return
-        
-        number = db.query(Number).filter(
-            Number.phone_number == to_number,
-            Number.service_id == service.id,
-            Number.status == NumberStatus.RESERVED
-        ).first()
+        # Find matching reservation, loading only the ids used below
+        service = db.query(Service).options(load_only(Service.id)).filter(Service.name == service_name).first()
+        service_id = int(service.id) if service else None
         
-        if not number:
-            return
+        reservation = None
+        if service:
+            number = db.query(Number).options(load_only(Number.id)).filter(
+                Number.phone_number == to_number,
+                Number.service_id == service.id,
+                Number.status == NumberStatus.RESERVED
+            ).first()
+            
+            if number:
+                reservation = db.query(Reservation).options(load_only(Reservation.id)).filter(
+                    Reservation.number_id == number.id,
+                    Reservation.status == ReservationStatus.WAITING_CODE
+                ).first()
         
-        reservation = db.query(Reservation).filter(
-            Reservation.number_id == number.id,
-            Reservation.status == ReservationStatus.WAITING_CODE
-        ).first()
+        # Keep plain ids and release the connection; completion uses its own session
+        reservation_id = int(reservation.id) if reservation else None
+        db.close()
         
-        if not reservation:
-            return
+        processed_at = None
+        if reservation_id is None:
+            # No reservation is waiting for this number
+            status = MessageStatus.ORPHAN
+        else:
+            # Complete reservation first so the user gets the code right away
+            success = await complete_reservation_atomic(reservation_id, code)
+            notify_code_event(reservation_id)
+            
+            if success:
+                status = MessageStatus.PROCESSED
+                processed_at = datetime.now()
+            else:
+                status = MessageStatus.REJECTED
         
-        # Store message
-        provider_msg = ProviderMessage(
+        # Store message for audit, written in batches by provider_message_writer
+        provider_message_queue.put_nowait(ProviderMessage(
+            service_id=service_id,
             provider_id=provider.id,
-            raw_payload=json.dumps(message)
-        )
-        db.add(provider_msg)
-        db.commit()
-        
-        # Complete reservation
-        await complete_reservation_atomic(reservation.id, code)
+            sender_id=str(provider.name),
+            message_text=text,
+            raw_payload=dump_payload(message),
+            status=status,
+            processed_at=processed_at
+        ))
         
     finally:
         db.close()
 
+async def provider_message_writer():
+    """Write queued provider and blocked messages in batches, off the code delivery path"""
+    while True:
+        batch = [await provider_message_queue.get()]
+        deadline = time.monotonic() + PROVIDER_MESSAGE_FLUSH_SEC
+        while len(batch) < PROVIDER_MESSAGE_BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(provider_message_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        
+        db = get_db()
+        try:
+            db.bulk_save_objects(batch)
+            db.commit()
+        except Exception as e:
+            logger.error(f"Error writing {len(batch)} queued messages: {e}")
+            db.rollback()
+        finally:
+            db.close()
+
+def expire_reservations_sync() -> Dict[str, int]:
+    """Expire overdue reservations, release their numbers and return how many expired per user telegram id"""
+    with db_session() as db:
+        now = datetime.now()
+        # Expire in bulk; RETURNING tells us which numbers and users were affected
+        expired_rows = db.execute(
+            update(Reservation).where(
+                Reservation.status == ReservationStatus.WAITING_CODE,
+                Reservation.expired_at < now
+            ).values(status=ReservationStatus.EXPIRED).returning(
+                Reservation.id, Reservation.user_id, Reservation.number_id
+            ),
+            execution_options={"synchronize_session": False}
+        ).all()
+        
+        expired_by_telegram_id = {}
+        if expired_rows:
+            # Return numbers to available
+            db.execute(
+                update(Number).where(
+                    Number.id.in_([row.number_id for row in expired_rows])
+                ).values(
+                    status=NumberStatus.AVAILABLE,
+                    reserved_by_user_id=None,
+                    reserved_at=None,
+                    expires_at=None
+                ),
+                execution_options={"synchronize_session": False}
+            )
+            
+            # Group by user so each one gets a single notice however many reservations expired
+            expired_counts = {}  # {user_id: expired reservations}
+            for row in expired_rows:
+                expired_counts[row.user_id] = expired_counts.get(row.user_id, 0) + 1
+            expired_by_telegram_id = {
+                telegram_id: expired_counts[user_id] for user_id, telegram_id in
+                db.query(User.id, User.telegram_id).filter(User.id.in_(expired_counts)).all()
+            }
+        
+        db.commit()
+        return expired_by_telegram_id
+
+def expiry_notice_text(expired_count: int) -> str:
+    """Build the expiry notice for a user, mentioning the count when several reservations expired together"""
+    if expired_count == 1:
+        header = "⏰ انتهت مهلة انتظار الكود\n"
+    else:
+        header = f"⏰ انتهت مهلة انتظار الكود لـ {expired_count} حجوزات\n"
+    return header + "لم يتم خصم أي رسوم من رصيدك\nيمكنك حجز رقم جديد"
+
 async def check_expired_reservations():
     """Check and expire old reservations"""
     while True:
         try:
-            db = get_db()
-            try:
-                now = datetime.now()
-                expired_reservations = db.query(Reservation).filter(
-                    Reservation.status == ReservationStatus.WAITING_CODE,
-                    Reservation.expired_at < now
-                ).all()
+            expired_by_telegram_id = await asyncio.to_thread(expire_reservations_sync)
+            
+            # One combined notice per user, sent concurrently; send_message_limited keeps us under Telegram's rate limit
+            if expired_by_telegram_id:
+                keyboard = InlineKeyboardBuilder()
+                keyboard.row(InlineKeyboardButton(text="🔄 احجز رقم جديد", callback_data="main_menu"))
+                reply_markup = keyboard.as_markup()
                 
-                for reservation in expired_reservations:
-                    # Mark as expired
-                    reservation.status = ReservationStatus.EXPIRED
-                    
-                    # Return number to available
-                    number = db.query(Number).filter(Number.id == reservation.number_id).first()
-                    if number:
-                        number.status = NumberStatus.AVAILABLE
-                        number.reserved_by_user_id = None
-                        number.reserved_at = None
-                        number.expires_at = None
-                    
-                    # Notify user
-                    user = db.query(User).filter(User.id == reservation.user_id).first()
-                    if user:
-                        keyboard = InlineKeyboardBuilder()
-                        keyboard.row(InlineKeyboardButton(text="🔄 احجز رقم جديد", callback_data="main_menu"))
-                        
-                        await bot.send_message(
-                            user.telegram_id,
-                            "⏰ انتهت مهلة انتظار الكود\n"
-                            "لم يتم خصم أي رسوم من رصيدك\n"
-                            "يمكنك حجز رقم جديد",
-                            reply_markup=keyboard.as_markup()
+                telegram_ids = list(expired_by_telegram_id)
+                results = await asyncio.gather(
+                    *[
+                        send_message_limited(
+                            telegram_id,
+                            expiry_notice_text(expired_by_telegram_id[telegram_id]),
+                            reply_markup=reply_markup
                         )
-                
-                db.commit()
-                
-            finally:
-                db.close()
+                        for telegram_id in telegram_ids
+                    ],
+                    return_exceptions=True
+                )
+                for telegram_id, result in zip(telegram_ids, results):
+                    if isinstance(result, Exception):
+                        logger.error(f"Failed to notify {telegram_id} about expired reservation: {result}")
         
         except Exception as e:
             logger.error(f"Error checking expired reservations: {e}")
@@ -1482,7 +2332,7 @@ async def process_service_regex(message: types.Message, state: FSMContext):
     
     # Test regex pattern
     try:
-        re.compile(regex_pattern)
+        get_compiled_pattern(regex_pattern)
     except re.error:
         await message.reply("❌ نمط Regex غير صحيح، يرجى المحاولة مرة أخرى")
         return
@@ -1557,13 +2407,7 @@ async def process_security_mode(callback: CallbackQuery, state: FSMContext):
         return
     
     security_mode = callback.data.replace("security_", "")
-    security_mode_map = {
-        "token_only": SecurityMode.TOKEN_ONLY,
-        "admin_only": SecurityMode.ADMIN_ONLY,
-        "hmac": SecurityMode.HMAC
-    }
-    
-    selected_mode = security_mode_map.get(security_mode, SecurityMode.TOKEN_ONLY)
+    selected_mode = SECURITY_MODE_BY_CALLBACK.get(security_mode, SecurityMode.TOKEN_ONLY)
     
     # Get all data and create service
     data = await state.get_data()
@@ -1592,16 +2436,13 @@ async def process_security_mode(callback: CallbackQuery, state: FSMContext):
         )
         db.add(service_group)
         db.commit()
+        invalidate_catalog_cache()
+        invalidate_service_cache(int(service.id))
+        invalidate_bot_group_status(service_group.group_chat_id)
         
         await state.clear()
         
         # Show summary
-        security_mode_text = {
-            SecurityMode.TOKEN_ONLY: "🔑 Token Only",
-            SecurityMode.ADMIN_ONLY: "👑 Admin Only",
-            SecurityMode.HMAC: "🔐 HMAC"
-        }
-        
         await callback.message.edit_text(
             f"✅ تم إنشاء الخدمة بنجاح!\n\n"
             f"📱 الاسم: {service.name}\n"
@@ -1609,7 +2450,7 @@ async def process_security_mode(callback: CallbackQuery, state: FSMContext):
             f"💰 السعر: {service.default_price} وحدة\n"
             f"📞 Group ID: {service_group.group_chat_id}\n"
             f"🔍 Regex: {service_group.regex_pattern}\n"
-            f"🛡️ وضع الأمان: {security_mode_text[selected_mode]}\n"
+            f"🛡️ وضع الأمان: {SECURITY_MODE_TEXT[selected_mode]}\n"
             f"🔐 التوكن: {'✅ محدد' if service_group.secret_token else '❌ غير محدد'}",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
                 InlineKeyboardButton(text="🔗 اختبار الجروب", callback_data=f"test_group_{service.id}"),
@@ -1654,22 +2495,14 @@ async def test_group_handler(callback: CallbackQuery):
             
             # Try to get bot member status
             bot_member = await bot.get_chat_member(str(service_group.group_chat_id), bot.id)
-            
-            status_text = {
-                'creator': '👑 المؤسس',
-                'administrator': '👮‍♂️ مشرف',
-                'member': '👤 عضو',
-                'restricted': '🚫 مقيد',
-                'left': '❌ غير موجود',
-                'kicked': '🚫 محظور'
-            }
+            cache_bot_group_status(service_group.group_chat_id, bot_member.status)
             
             await callback.message.edit_text(
                 f"🔍 نتائج اختبار الجروب\n\n"
                 f"📞 Group ID: {service_group.group_chat_id}\n"
                 f"📝 اسم الجروب: {chat.title or 'غير محدد'}\n"
                 f"👥 نوع الجروب: {chat.type}\n"
-                f"🤖 حالة البوت: {status_text.get(bot_member.status, bot_member.status)}\n\n"
+                f"🤖 حالة البوت: {CHAT_MEMBER_STATUS_TEXT.get(bot_member.status, bot_member.status)}\n\n"
                 "✅ الاتصال بالجروب ناجح!",
                 reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
                     InlineKeyboardButton(text="🔙 إدارة الخدمات", callback_data="admin_services")
@@ -1730,9 +2563,13 @@ async def admin_service_groups_handler(callback: CallbackQuery):
         await callback.answer("❌ انتهت صلاحية الجلسة")
         return
     
+    acknowledge_callback(callback)
+    
     db = get_db()
     try:
-        service_groups = db.query(ServiceGroup).join(Service).all()
+        service_groups = db.query(ServiceGroup).join(Service).options(
+            contains_eager(ServiceGroup.service)
+        ).all()
         
         text = "🔗 إدارة ربط الخدمات بالجروبات\n\n"
         
@@ -1740,11 +2577,7 @@ async def admin_service_groups_handler(callback: CallbackQuery):
             text += "الروابط الحالية:\n"
             for sg in service_groups:
                 status = "✅" if sg.active else "❌"
-                security_icon = {
-                    SecurityMode.TOKEN_ONLY: "🔑",
-                    SecurityMode.ADMIN_ONLY: "👑",
-                    SecurityMode.HMAC: "🔐"
-                }.get(sg.security_mode, "🔑")
+                security_icon = SECURITY_MODE_ICON.get(sg.security_mode, "🔑")
                 
                 text += f"{status} {sg.service.emoji} {sg.service.name}\n"
                 text += f"   📞 {sg.group_chat_id} {security_icon}\n\n"
@@ -1753,17 +2586,17 @@ async def admin_service_groups_handler(callback: CallbackQuery):
         
         keyboard = InlineKeyboardBuilder()
         
-        for sg in service_groups:
+        # Check if bot is admin in each group, all groups at once
+        bot_statuses = await asyncio.gather(
+            *[verify_bot_in_group(sg.group_chat_id) for sg in service_groups],
+            return_exceptions=True
+        )
+        
+        for sg, bot_status in zip(service_groups, bot_statuses):
             status = "✅" if sg.active else "❌"
-            security_icon = {
-                SecurityMode.TOKEN_ONLY: "🔑",
-                SecurityMode.ADMIN_ONLY: "👑", 
-                SecurityMode.HMAC: "🔐"
-            }.get(sg.security_mode, "🔑")
+            security_icon = SECURITY_MODE_ICON.get(sg.security_mode, "🔑")
             
-            # Check if bot is admin in the group
-            bot_status = await verify_bot_in_group(sg.group_chat_id)
-            bot_icon = "🤖✅" if bot_status else "🤖❌"
+            bot_icon = "🤖✅" if bot_status is True else "🤖❌"
             
             keyboard.row(InlineKeyboardButton(
                 text=f"{status} {sg.service.emoji} {sg.service.name} - {sg.group_chat_id} {security_icon} {bot_icon}",
@@ -1781,30 +2614,34 @@ async def admin_service_groups_handler(callback: CallbackQuery):
     finally:
         db.close()
 
-@dp.callback_query(F.data == "admin_messages_stats")
-async def admin_messages_stats_handler(callback: CallbackQuery):
-    """Handle messages statistics"""
-    if not is_admin_session_valid(callback.from_user.id):
-        await callback.answer("❌ انتهت صلاحية الجلسة")
-        return
+def get_admin_stats_text(panel: str, build_text) -> str:
+    """Return a cached admin statistics text, rebuilding it after the TTL or an invalidation"""
+    cached = admin_stats_cache.get(panel)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
     
-    db = get_db()
-    try:
+    text = build_text()
+    admin_stats_cache[panel] = (time.monotonic() + ADMIN_STATS_CACHE_TTL_SEC, text)
+    return text
+
+def build_messages_stats_text_sync() -> str:
+    """Build the message statistics text (blocking, run it off the event loop)"""
+    with db_session() as db:
         # Get message statistics
-        total_messages = db.query(ProviderMessage).count()
-        processed_messages = db.query(ProviderMessage).filter(
-            ProviderMessage.status == MessageStatus.PROCESSED
-        ).count()
-        rejected_messages = db.query(ProviderMessage).filter(
-            ProviderMessage.status == MessageStatus.REJECTED
-        ).count()
-        orphan_messages = db.query(ProviderMessage).filter(
-            ProviderMessage.status == MessageStatus.ORPHAN
-        ).count()
+        status_counts = dict(
+            db.query(ProviderMessage.status, func.count(ProviderMessage.id)).group_by(ProviderMessage.status).all()
+        )
+        total_messages = sum(status_counts.values())
+        processed_messages = status_counts.get(MessageStatus.PROCESSED, 0)
+        rejected_messages = status_counts.get(MessageStatus.REJECTED, 0)
+        orphan_messages = status_counts.get(MessageStatus.ORPHAN, 0)
         blocked_messages = db.query(BlockedMessage).count()
         
         # Get recent completed reservations
-        recent_completions = db.query(Reservation).filter(
+        recent_completions = db.query(Reservation).options(
+            joinedload(Reservation.service),
+            joinedload(Reservation.number)
+        ).filter(
             Reservation.status == ReservationStatus.COMPLETED
         ).order_by(Reservation.completed_at.desc()).limit(5).all()
         
@@ -1818,22 +2655,57 @@ async def admin_messages_stats_handler(callback: CallbackQuery):
         if recent_completions:
             text += "🎉 آخر الإنجازات:\n"
             for res in recent_completions:
-                service = db.query(Service).filter(Service.id == res.service_id).first()
-                number = db.query(Number).filter(Number.id == res.number_id).first()
+                service = res.service
+                number = res.number
                 if service and number:
                     text += f"• {service.emoji} {service.name} - {number.phone_number}\n"
-        
-        keyboard = InlineKeyboardBuilder()
-        keyboard.row(
-            InlineKeyboardButton(text="🗑️ تنظيف الرسائل القديمة", callback_data="admin_cleanup_messages"),
-            InlineKeyboardButton(text="🔄 تحديث", callback_data="admin_messages_stats")
-        )
-        keyboard.row(InlineKeyboardButton(text="🔙 إدارة الخدمات", callback_data="admin_services"))
-        
-        await callback.message.edit_text(text, reply_markup=keyboard.as_markup())
-        
-    finally:
-        db.close()
+        return text
+
+@dp.callback_query(F.data == "admin_messages_stats")
+async def admin_messages_stats_handler(callback: CallbackQuery):
+    """Handle messages statistics"""
+    if not is_admin_session_valid(callback.from_user.id):
+        await callback.answer("❌ انتهت صلاحية الجلسة")
+        return
+    
+    acknowledge_callback(callback)
+    
+    text = await asyncio.to_thread(build_messages_stats_text_sync)
+    
+    keyboard = InlineKeyboardBuilder()
+    keyboard.row(
+        InlineKeyboardButton(text="🗑️ تنظيف الرسائل القديمة", callback_data="admin_cleanup_messages"),
+        InlineKeyboardButton(text="🔄 تحديث", callback_data="admin_messages_stats")
+    )
+    keyboard.row(InlineKeyboardButton(text="🔙 إدارة الخدمات", callback_data="admin_services"))
+    
+    await callback.message.edit_text(text, reply_markup=keyboard.as_markup())
+
+MESSAGE_CLEANUP_BATCH_SIZE = 10000
+
+def delete_messages_before_sync(cutoff_date: datetime) -> int:
+    """Delete provider and blocked messages older than the cutoff in short batches (blocking)"""
+    deleted = 0
+    with db_session() as db:
+        try:
+            for model, created_column in ((ProviderMessage, ProviderMessage.received_at),
+                                          (BlockedMessage, BlockedMessage.created_at)):
+                # Commit per batch so a large cleanup never holds long row locks
+                while True:
+                    batch_ids = select(model.id).where(
+                        created_column < cutoff_date
+                    ).limit(MESSAGE_CLEANUP_BATCH_SIZE).scalar_subquery()
+                    batch_deleted = db.query(model).filter(
+                        model.id.in_(batch_ids)
+                    ).delete(synchronize_session=False)
+                    db.commit()
+                    deleted += batch_deleted
+                    if batch_deleted < MESSAGE_CLEANUP_BATCH_SIZE:
+                        break
+        except Exception:
+            db.rollback()
+            raise
+    return deleted
 
 @dp.callback_query(F.data == "admin_cleanup_messages")
 async def admin_cleanup_messages_handler(callback: CallbackQuery):
@@ -1842,23 +2714,13 @@ async def admin_cleanup_messages_handler(callback: CallbackQuery):
         await callback.answer("❌ انتهت صلاحية الجلسة")
         return
     
-    db = get_db()
     try:
         # Delete messages older than 7 days
         cutoff_date = datetime.now() - timedelta(days=7)
-        
-        deleted_provider = db.query(ProviderMessage).filter(
-            ProviderMessage.received_at < cutoff_date
-        ).delete()
-        
-        deleted_blocked = db.query(BlockedMessage).filter(
-            BlockedMessage.created_at < cutoff_date
-        ).delete()
-        
-        db.commit()
+        deleted_count = await asyncio.to_thread(delete_messages_before_sync, cutoff_date)
         
         await callback.answer(
-            f"✅ تم حذف {deleted_provider + deleted_blocked} رسالة قديمة",
+            f"✅ تم حذف {deleted_count} رسالة قديمة",
             show_alert=True
         )
         
@@ -1868,9 +2730,6 @@ async def admin_cleanup_messages_handler(callback: CallbackQuery):
     except Exception as e:
         logger.error(f"Error cleaning up messages: {e}")
         await callback.answer(f"❌ خطأ في التنظيف: {str(e)}")
-        db.rollback()
-    finally:
-        db.close()
 
 # Group message processing functions
 async def process_incoming_group_message(message: types.Message):
@@ -1882,13 +2741,18 @@ async def process_incoming_group_message(message: types.Message):
     sender_id = str(message.from_user.id)
     message_text = message.text
     
-    db = get_db()
+    # Most group traffic comes from chats that aren't linked to a service
+    if group_chat_id not in get_registered_group_ids():
+        return
+    
+    provider_msg = None
+    block_reason = None
     try:
-        # Find service group mapping
-        service_group = db.query(ServiceGroup).filter(
-            ServiceGroup.group_chat_id == group_chat_id,
-            ServiceGroup.active == True
-        ).first()
+        # Find service group mapping; cache misses are loaded off the event loop
+        service_group, code_pattern = (
+            service_group_cache.get(group_chat_id)
+            or await asyncio.to_thread(get_active_service_group_sync, group_chat_id)
+        )
         
         if not service_group:
             logger.info(f"Message from unregistered group: {group_chat_id}")
@@ -1896,13 +2760,18 @@ async def process_incoming_group_message(message: types.Message):
             
         logger.info(f"Processing message from group: {group_chat_id}, service_id: {service_group.service_id}, service: {service_group.service.name if service_group.service else 'Unknown'}")
         
-        # Store incoming message for audit
+        # Extract number and code once so the stored message can be looked up by phone
+        number, code = extract_number_and_code(message_text, code_pattern)
+        
+        # Incoming message for audit; queued with its final status once processing ends, even on errors
         provider_msg = ProviderMessage(
             service_id=service_group.service_id,
             group_chat_id=group_chat_id,
             sender_id=sender_id,
             message_text=message_text,
-            raw_payload=json.dumps({
+            target_phone=number,
+            code_value=code,
+            raw_payload=dump_payload({
                 'message_id': message.message_id,
                 'chat_title': message.chat.title,
                 'sender_username': message.from_user.username,
@@ -1910,8 +2779,6 @@ async def process_incoming_group_message(message: types.Message):
             }),
             status=MessageStatus.PENDING
         )
-        db.add(provider_msg)
-        db.commit()
         
         # Security checks
         security_check_result = await verify_message_security(
@@ -1919,102 +2786,89 @@ async def process_incoming_group_message(message: types.Message):
         )
         
         if not security_check_result['valid']:
-            # Store as blocked message
-            blocked_msg = BlockedMessage(
-                service_id=service_group.service_id,
-                group_chat_id=group_chat_id,
-                sender_id=sender_id,
-                message_text=message_text,
-                reason=security_check_result['reason']
+            block_reason = security_check_result['reason']
+        elif not number or not code:
+            # No valid number or code found
+            block_reason = "no_number_or_no_code"
+        else:
+            # Find matching reservation with detailed logging
+            logger.info(f"Searching for reservation: number={number}, service_id={service_group.service_id}")
+            reservation_id = await asyncio.to_thread(
+                find_waiting_reservation_sync, number, service_group.service_id
             )
-            db.add(blocked_msg)
             
-            # Update provider message status
-            provider_msg.status = MessageStatus.REJECTED
-            db.commit()
-            return
+            if reservation_id is None:
+                # Mark as orphan - no matching reservation
+                provider_msg.status = MessageStatus.ORPHAN
+            else:
+                # Complete reservation atomically
+                success = await complete_reservation_atomic(reservation_id, code)
+                notify_code_event(reservation_id)
+                
+                if success:
+                    provider_msg.status = MessageStatus.PROCESSED
+                    provider_msg.processed_at = datetime.now()
+                else:
+                    block_reason = "completion_failed"
         
-        # Extract number and code
-        number, code = extract_number_and_code(message_text, service_group.regex_pattern)
-        
-        if not number or not code:
-            # Store as blocked - no valid number or code found
-            blocked_msg = BlockedMessage(
-                service_id=service_group.service_id,
-                group_chat_id=group_chat_id,
-                sender_id=sender_id,
-                message_text=message_text,
-                reason="no_number_or_no_code"
+    except Exception as e:
+        logger.error(f"Error processing group message: {e}")
+    finally:
+        # Audit rows are written in batches by provider_message_writer
+        if provider_msg is not None:
+            if block_reason:
+                provider_msg.status = MessageStatus.REJECTED
+                provider_message_queue.put_nowait(BlockedMessage(
+                    service_id=provider_msg.service_id,
+                    group_chat_id=group_chat_id,
+                    sender_id=sender_id,
+                    message_text=message_text,
+                    reason=block_reason
+                ))
+            provider_message_queue.put_nowait(provider_msg)
+
+def get_active_service_group_sync(group_chat_id: str) -> tuple[Optional[ServiceGroup], Optional[re.Pattern]]:
+    """Load the active service group of a chat in a short session of its own"""
+    with db_session() as db:
+        return get_active_service_group(group_chat_id, db)
+
+def find_waiting_reservation_sync(number: str, service_id: int) -> Optional[int]:
+    """Return the id of the reservation waiting for a code on this number, if any"""
+    with db_session() as db:
+        # Look up the number together with its waiting reservation, if any
+        row = db.query(Number, Reservation).options(
+            load_only(Number.id, Number.status, Number.reserved_by_user_id),
+            load_only(Reservation.id, Reservation.user_id, Reservation.status)
+        ).outerjoin(
+            Reservation, and_(
+                Reservation.number_id == Number.id,
+                Reservation.status == ReservationStatus.WAITING_CODE
             )
-            db.add(blocked_msg)
-            
-            provider_msg.status = MessageStatus.REJECTED
-            db.commit()
-            return
-        
-        # Find matching reservation with detailed logging
-        logger.info(f"Searching for reservation: number={number}, service_id={service_group.service_id}")
-        
-        # First check if the number exists
-        number_obj = db.query(Number).filter(
+        ).filter(
             Number.phone_number == number,
-            Number.service_id == service_group.service_id
+            Number.service_id == service_id
         ).first()
         
-        if not number_obj:
-            logger.warning(f"Number {number} not found for service_id {service_group.service_id}")
-            provider_msg.status = MessageStatus.ORPHAN
-            db.commit()
-            return
+        if not row:
+            logger.warning(f"Number {number} not found for service_id {service_id}")
+            return None
         
+        number_obj, reservation = row
         logger.info(f"Found number: id={number_obj.id}, status={number_obj.status}, reserved_by={number_obj.reserved_by_user_id}")
         
-        # Check for reservation
-        reservation = db.query(Reservation).filter(
-            Reservation.number_id == number_obj.id,
-            Reservation.status == ReservationStatus.WAITING_CODE
-        ).first()
-        
         if not reservation:
-            # Log more details about why no reservation found
-            all_reservations = db.query(Reservation).filter(
-                Reservation.number_id == number_obj.id
-            ).all()
             logger.warning(f"No WAITING_CODE reservation found for number {number}")
-            for res in all_reservations:
-                logger.info(f"Found reservation: id={res.id}, status={res.status}, user_id={res.user_id}")
-            
-            # Mark as orphan - no matching reservation
-            provider_msg.status = MessageStatus.ORPHAN
-            db.commit()
-            return
-            
-        logger.info(f"Found matching reservation: id={reservation.id}, user_id={reservation.user_id}, status={reservation.status}")
-        
-        # Complete reservation atomically
-        success = await complete_reservation_atomic(reservation.id, code)
-        
-        if success:
-            provider_msg.status = MessageStatus.PROCESSED
-            provider_msg.processed_at = datetime.now()
-        else:
-            provider_msg.status = MessageStatus.REJECTED
-            blocked_msg = BlockedMessage(
-                service_id=service_group.service_id,
-                group_chat_id=group_chat_id,
-                sender_id=sender_id,
-                message_text=message_text,
-                reason="completion_failed"
-            )
-            db.add(blocked_msg)
-        
-        db.commit()
+            if logger.isEnabledFor(logging.DEBUG):
+                # Log more details about why no reservation found
+                all_reservations = db.query(Reservation).filter(
+                    Reservation.number_id == number_obj.id
+                ).all()
+                for res in all_reservations:
+                    logger.debug(f"Found reservation: id={res.id}, status={res.status}, user_id={res.user_id}")
+            return None
         
-    except Exception as e:
-        logger.error(f"Error processing group message: {e}")
-        db.rollback()
-    finally:
-        db.close()
+        logger.info(f"Found matching reservation: id={reservation.id}, user_id={reservation.user_id}, status={reservation.status}")
+        return int(reservation.id)
 
 async def verify_message_security(service_group: ServiceGroup, message_text: str, sender_id: str, group_chat_id: str) -> Dict[str, Any]:
     """Verify message security based on service group settings - Simplified for single user"""
@@ -2108,7 +2962,7 @@ async def start_handler(message: types.Message, state: FSMContext):
 
 # New Command Handlers
 @dp.message(Command("balance"))
-async def balance_handler(message: types.Message):
+async def balance_handler(message: types.Message, lang_code: str = 'ar'):
     """Handle /balance command"""
     if not message.from_user:
         return
@@ -2120,89 +2974,68 @@ async def balance_handler(message: types.Message):
         message.from_user.last_name
     )
     
-    lang_code = get_user_language(str(message.from_user.id))
-    balance_text = await translator.translate_text(f"💰 رصيدك الحالي: {user.balance}", lang_code)
-    await message.reply(balance_text)
+    # Translate only the fixed label so the cached translation is reused whatever the balance
+    balance_label = await translator.translate_text("💰 رصيدك الحالي:", lang_code)
+    await message.reply(f"{balance_label} {user.balance}")
 
 @dp.message(Command("language"))
-async def language_handler(message: types.Message):
+async def language_handler(message: types.Message, lang_code: str = 'ar'):
     """Handle /language command"""
     if not message.from_user:
         return
     
-    keyboard = InlineKeyboardBuilder()
-    
-    # Add language selection buttons (2 per row)
-    lang_items = list(SUPPORTED_LANGUAGES.items())
-    for i in range(0, len(lang_items), 2):
-        row = []
-        for j in range(2):
-            if i + j < len(lang_items):
-                code, name = lang_items[i + j]
-                row.append(InlineKeyboardButton(
-                    text=name,
-                    callback_data=f"set_lang_{code}"
-                ))
-        keyboard.row(*row)
-    
-    # Get current user language for back button
-    lang_code = get_user_language(str(message.from_user.id))
+    # Back button in the user's current language
     back_text = t('main_menu', lang_code)
     
-    keyboard.row(InlineKeyboardButton(text=f"🔙 {back_text}", callback_data="main_menu"))
-    
     # Get multilingual text for language selection
     selection_text = "🌐 اختر لغتك المفضلة:\nChoose your preferred language:\nElige tu idioma preferido:"
     
     await message.reply(
         selection_text,
-        reply_markup=keyboard.as_markup()
+        reply_markup=get_language_markup(f"🔙 {back_text}", "main_menu")
     )
 
 @dp.message(Command("services"))
-async def services_handler(message: types.Message):
+async def services_handler(message: types.Message, lang_code: str = 'ar'):
     """Handle /services command"""
     if not message.from_user:
         return
         
-    lang_code = get_user_language(str(message.from_user.id))
     services_text = await translator.translate_text("📱 الخدمات المتاحة:", lang_code)
     
     await message.reply(services_text, reply_markup=await create_main_keyboard(str(message.from_user.id)))
 
 @dp.message(Command("history"))
-async def history_handler(message: types.Message):
+async def history_handler(message: types.Message, lang_code: str = 'ar'):
     """Handle /history command"""
     if not message.from_user:
         return
     
     db = get_db()
     try:
-        reservations = db.query(Reservation).filter(
+        reservations = db.query(Reservation).options(
+            joinedload(Reservation.service),
+            joinedload(Reservation.number)
+        ).filter(
             Reservation.user_id == str(message.from_user.id)
         ).order_by(Reservation.created_at.desc()).limit(10).all()
         
         if not reservations:
-            lang_code = get_user_language(str(message.from_user.id))
             no_history_text = await translator.translate_text("📋 لا توجد طلبات سابقة", lang_code)
             await message.reply(no_history_text)
             return
         
-        lang_code = get_user_language(str(message.from_user.id))
         history_header = await translator.translate_text("📋 آخر 10 طلبات:", lang_code)
-        history_text = f"{history_header}\n\n"
+        history_parts = [f"{history_header}\n\n"]
+        service_names = get_texts((res.service.name for res in reservations), lang_code)
         
         for res in reservations:
-            status_emoji = {
-                ReservationStatus.WAITING_CODE: "⏳",
-                ReservationStatus.COMPLETED: "✅", 
-                ReservationStatus.EXPIRED: "⏰",
-                ReservationStatus.CANCELED: "❌"
-            }.get(res.status, "❓")
+            status_emoji = RESERVATION_STATUS_EMOJI.get(res.status, "❓")
             
-            service_name = await get_text(res.service.name, lang_code)
-            history_text += f"{status_emoji} {service_name} - {res.number.phone_number}\n"
-            history_text += f"   📅 {res.created_at.strftime('%Y-%m-%d %H:%M')}\n\n"
+            service_name = service_names[res.service.name]
+            history_parts.append(f"{status_emoji} {service_name} - {res.number.phone_number}\n")
+            history_parts.append(f"   📅 {res.created_at.strftime('%Y-%m-%d %H:%M')}\n\n")
+        history_text = "".join(history_parts)
         
         await message.reply(history_text)
         
@@ -2210,12 +3043,11 @@ async def history_handler(message: types.Message):
         db.close()
 
 @dp.message(Command("support"))
-async def support_handler(message: types.Message):
+async def support_handler(message: types.Message, lang_code: str = 'ar'):
     """Handle /support command"""
     if not message.from_user:
         return
     
-    lang_code = get_user_language(str(message.from_user.id))
     support_text = await translator.translate_text(
         "🆘 للدعم الفني تواصل مع:\n"
         f"👨‍💼 المدير: @{ADMIN_ID}\n\n"
@@ -2226,21 +3058,19 @@ async def support_handler(message: types.Message):
     await message.reply(support_text)
 
 @dp.message(Command("cancel"))
-async def cancel_handler(message: types.Message, state: FSMContext):
+async def cancel_handler(message: types.Message, state: FSMContext, lang_code: str = 'ar'):
     """Handle /cancel command"""
     if not message.from_user:
         return
     
     await state.clear()
-    lang_code = get_user_language(str(message.from_user.id))
     cancel_text = await translator.translate_text("❌ تم إلغاء العملية الحالية", lang_code)
     
     await message.reply(cancel_text, reply_markup=await create_main_keyboard(str(message.from_user.id)))
 
 @dp.message(Command("chatinfo"))
-async def chatinfo_handler(message: types.Message):
+async def chatinfo_handler(message: types.Message, lang_code: str = 'ar'):
     """Handle /chatinfo command - useful for getting group ID"""
-    lang_code = get_user_language(str(message.from_user.id))
     header_text = await translator.translate_text("ℹ️ معلومات المحادثة:", lang_code)
     
     chat_info = f"{header_text}\n\n"
@@ -2327,7 +3157,7 @@ async def main_menu_handler(callback: CallbackQuery, state: FSMContext):
         )
 
 @dp.callback_query(F.data.startswith("svc_"))
-async def service_selected_handler(callback: CallbackQuery, state: FSMContext):
+async def service_selected_handler(callback: CallbackQuery, state: FSMContext, lang_code: str = 'ar'):
     """Handle service selection"""
     if not callback.data:
         return
@@ -2340,41 +3170,32 @@ async def service_selected_handler(callback: CallbackQuery, state: FSMContext):
             await callback.answer("❌ خدمة غير موجودة")
             return
         
-        # Check if service has available numbers
-        available_count = db.query(Number).filter(
-            Number.service_id == service_id,
-            Number.status == NumberStatus.AVAILABLE
-        ).count()
+        # Check if service has available numbers; the per-country counts are reused by the keyboard below
+        available_counts = await asyncio.to_thread(get_available_counts, service_id)
+        total_available = sum(available_counts.values())
         
-        if available_count == 0:
+        if not total_available:
             await callback.answer("❌ لا توجد أرقام متاحة لهذه الخدمة حالياً")
             return
         
         await state.update_data(service_id=service_id)
         
         if callback.message:
-            # Get total available numbers for this service
-            total_available = db.query(Number).filter(
-                Number.service_id == service_id,
-                Number.status == NumberStatus.AVAILABLE
-            ).count()
-            
-            # Get user language
-            user_lang = get_user_language(str(callback.from_user.id))
-            translated_service_name = await get_text(service.name, user_lang)
+            # Translate service name
+            translated_service_name = get_text(service.name, lang_code)
             
             await callback.message.edit_text(
                 f"🌍 اختر الدولة للخدمة: {service.emoji} {translated_service_name}\n\n"
                 f"💰 السعر: {service.default_price} وحدة\n"
                 f"📊 إجمالي الأرقام المتاحة: {total_available}",
-                reply_markup=create_countries_keyboard(service_id)
+                reply_markup=await asyncio.to_thread(create_countries_keyboard, service_id)
             )
         
     finally:
         db.close()
 
 @dp.callback_query(F.data.startswith("cty_"))
-async def country_selected_handler(callback: CallbackQuery, state: FSMContext):
+async def country_selected_handler(callback: CallbackQuery, state: FSMContext, lang_code: str = 'ar'):
     """Handle country selection"""
     if not callback.data:
         return
@@ -2385,7 +3206,8 @@ async def country_selected_handler(callback: CallbackQuery, state: FSMContext):
         service_id = int(parts[2])
         page = int(parts[3])
         if callback.message:
-            await callback.message.edit_reply_markup(reply_markup=create_countries_keyboard(service_id, page))
+            keyboard = await asyncio.to_thread(create_countries_keyboard, service_id, page)
+            await callback.message.edit_reply_markup(reply_markup=keyboard)
         return
     
     service_id = int(parts[1])
@@ -2395,46 +3217,41 @@ async def country_selected_handler(callback: CallbackQuery, state: FSMContext):
     user, _ = await get_or_create_user(str(callback.from_user.id))
     
     # Reserve number
-    reservation = await reserve_number(int(user.id), service_id, country_code)
+    reserved = await reserve_number(int(user.id), service_id, country_code)
     
-    if not reservation:
+    if not reserved:
         await callback.answer("❌ لا توجد أرقام متاحة لهذه الدولة حالياً")
         return
+    reservation, remaining_count = reserved
     
     db = get_db()
     try:
-        number = db.query(Number).filter(Number.id == reservation.number_id).first()
-        service = db.query(Service).filter(Service.id == service_id).first()
+        # Reload the reservation with its number and service in one joined query
+        reservation = db.query(Reservation).options(
+            joinedload(Reservation.number),
+            joinedload(Reservation.service)
+        ).filter(Reservation.id == reservation.id).one()
+        number, service = reservation.number, reservation.service
         
         await state.update_data(reservation_id=reservation.id)
         
         # Start auto search for code in background
-        asyncio.create_task(auto_search_for_code(int(reservation.id)))
+        start_auto_search(int(reservation.id), service_id, str(number.phone_number))
         
         if callback.message:
-            # Get remaining numbers count for this service and country
-            remaining_count = db.query(Number).filter(
-                Number.service_id == service_id,
-                Number.country_code == country_code,
-                Number.status == NumberStatus.AVAILABLE
-            ).count()
-            
-            # Get user language and translate service name
-            user_lang = get_user_language(str(callback.from_user.id))
-            translated_service_name = await get_text(service.name, user_lang)
+            # Translate service name
+            translated_service_name = get_text(service.name, lang_code)
             
             await callback.message.edit_text(
-                f"✅ تم حجز رقمك بنجاح!\n\n"
-                f"📱 الرقم: `{number.phone_number}`\n"
-                f"الكود: سيظهر هنا تلقائياً\n"
-                f"🏷 الخدمة: {service.emoji} {translated_service_name}\n"
-                f"🌍 الدولة: {country_code}\n"
-                f"💰 السعر: {service.default_price} وحدة\n"
-                f"📊 الأرقام المتبقية: {remaining_count}\n\n"
-                f"⏱ سيتم البحث عن الكود تلقائياً خلال 15 ثانية\n"
-                f"⏰ مهلة الانتظار: {RESERVATION_TIMEOUT_MIN} دقيقة\n"
-                f"💳 سيتم الخصم فقط عند وصول الكود",
-                parse_mode="Markdown",
+                NUMBER_RESERVED_TEMPLATE.format(
+                    phone_number=html.escape(str(number.phone_number)),
+                    service_emoji=html.escape(str(service.emoji)),
+                    service_name=html.escape(translated_service_name),
+                    country_code=html.escape(country_code),
+                    price=service.default_price,
+                    remaining_count=remaining_count
+                ),
+                parse_mode="HTML",
                 reply_markup=create_number_action_keyboard(int(reservation.id))
             )
         
@@ -2448,58 +3265,71 @@ async def change_number_handler(callback: CallbackQuery, state: FSMContext):
     
     db = get_db()
     try:
-        reservation = db.query(Reservation).filter(Reservation.id == reservation_id).first()
-        if not reservation or reservation.status != ReservationStatus.WAITING_CODE:
+        # Reservation, its number and service in one round-trip, locking only the reservation
+        row = db.query(Reservation, Number, Service).join(
+            Number, Number.id == Reservation.number_id
+        ).join(
+            Service, Service.id == Reservation.service_id
+        ).filter(
+            Reservation.id == reservation_id
+        ).with_for_update(of=Reservation).first()
+        if not row or row[0].status != ReservationStatus.WAITING_CODE:
+            db.rollback()
             await callback.answer("❌ حجز غير صالح")
             return
+        reservation, current_number, service = row
+        service_id = reservation.service_id
+        service_emoji, service_name = service.emoji, service.name
         
-        # Release current number
-        current_number = db.query(Number).filter(Number.id == reservation.number_id).first()
-        if current_number:
-            current_number.status = NumberStatus.AVAILABLE
-            current_number.reserved_by_user_id = None
-            current_number.reserved_at = None
-            current_number.expires_at = None
-        
-        # Find new number
-        new_number = db.query(Number).filter(
+        # Claim a new number first, skipping rows other reservations already hold
+        available_number_id = select(Number.id).where(
             Number.service_id == reservation.service_id,
             Number.country_code == current_number.country_code,
             Number.status == NumberStatus.AVAILABLE,
             Number.id != current_number.id
+        ).limit(1).with_for_update(skip_locked=True).scalar_subquery()
+        
+        # One statement claims the replacement and returns what the reply needs;
+        # if nothing is free the current number is never touched
+        claimed = db.execute(
+            update(Number).where(
+                Number.id == available_number_id
+            ).values(
+                status=NumberStatus.RESERVED,
+                reserved_by_user_id=reservation.user_id,
+                reserved_at=datetime.now(),
+                expires_at=reservation.expired_at
+            ).returning(Number.id, Number.phone_number, Number.country_code),
+            execution_options={"synchronize_session": False}
         ).first()
         
-        if not new_number:
-            # Restore original number
-            current_number.status = NumberStatus.RESERVED
-            current_number.reserved_by_user_id = reservation.user_id
-            current_number.reserved_at = datetime.now()
-            current_number.expires_at = reservation.expired_at
-            db.commit()
-            
+        if not claimed:
+            db.rollback()
             await callback.answer("❌ لا توجد أرقام أخرى متاحة")
             return
+        new_number_id, new_phone_number, new_country_code = claimed
         
-        # Update reservation
-        reservation.number_id = new_number.id
-        new_number.status = NumberStatus.RESERVED
-        new_number.reserved_by_user_id = reservation.user_id
-        new_number.reserved_at = datetime.now()
-        new_number.expires_at = reservation.expired_at
+        # Release current number and move the reservation over
+        current_number.status = NumberStatus.AVAILABLE
+        current_number.reserved_by_user_id = None
+        current_number.reserved_at = None
+        current_number.expires_at = None
+        reservation.number_id = new_number_id
         
         db.commit()
         
-        service = db.query(Service).filter(Service.id == reservation.service_id).first()
+        # The running auto search must now wait for codes sent to the new number
+        retarget_auto_search(reservation_id, service_id, str(new_phone_number))
         
         await callback.message.edit_text(
-            f"✅ تم تغيير رقمك:\n\n"
-            f"📱 الرقم الجديد: `{new_number.phone_number}`\n"
-            f"🏷 الخدمة: {service.emoji} {service.name}\n"
-            f"🌍 الدولة: {new_number.country_code}\n\n"
-            f"⏱ سيتم إرسال كود التحقق هنا فور وصوله\n"
-            f"⏰ مهلة الانتظار: {RESERVATION_TIMEOUT_MIN} دقيقة",
-            parse_mode="Markdown",
-            reply_markup=create_number_action_keyboard(reservation.id)
+            NUMBER_CHANGED_TEMPLATE.format(
+                phone_number=html.escape(str(new_phone_number)),
+                service_emoji=html.escape(str(service_emoji)),
+                service_name=html.escape(str(service_name)),
+                country_code=html.escape(str(new_country_code))
+            ),
+            parse_mode="HTML",
+            reply_markup=create_number_action_keyboard(reservation_id)
         )
         
     finally:
@@ -2512,13 +3342,20 @@ async def change_country_handler(callback: CallbackQuery, state: FSMContext):
     
     db = get_db()
     try:
-        reservation = db.query(Reservation).filter(Reservation.id == reservation_id).first()
-        if not reservation:
+        # Reservation, its number and service in one round-trip
+        row = db.query(Reservation, Number, Service).outerjoin(
+            Number, Number.id == Reservation.number_id
+        ).join(
+            Service, Service.id == Reservation.service_id
+        ).filter(Reservation.id == reservation_id).first()
+        if not row:
             await callback.answer("❌ حجز غير صالح")
             return
+        reservation, current_number, service = row
+        service_id = reservation.service_id
+        service_emoji, service_name, service_price = service.emoji, service.name, service.default_price
         
         # Release current number
-        current_number = db.query(Number).filter(Number.id == reservation.number_id).first()
         if current_number:
             current_number.status = NumberStatus.AVAILABLE
             current_number.reserved_by_user_id = None
@@ -2529,14 +3366,12 @@ async def change_country_handler(callback: CallbackQuery, state: FSMContext):
         db.delete(reservation)
         db.commit()
         
-        await state.update_data(service_id=reservation.service_id)
-        
-        service = db.query(Service).filter(Service.id == reservation.service_id).first()
+        await state.update_data(service_id=service_id)
         
         await callback.message.edit_text(
-            f"🌍 اختر الدولة للخدمة: {service.emoji} {service.name}\n\n"
-            f"💰 السعر: {service.default_price} وحدة",
-            reply_markup=create_countries_keyboard(reservation.service_id)
+            f"🌍 اختر الدولة للخدمة: {service_emoji} {service_name}\n\n"
+            f"💰 السعر: {service_price} وحدة",
+            reply_markup=await asyncio.to_thread(create_countries_keyboard, service_id)
         )
         
     finally:
@@ -2571,78 +3406,237 @@ async def my_balance_handler(callback: CallbackQuery):
     finally:
         db.close()
 
+@lru_cache(maxsize=1024)
+def telegram_join_url(username_or_link: str) -> str:
+    """Normalize a stored channel/group @username or link to a t.me URL for join buttons"""
+    if username_or_link.startswith('http'):
+        return username_or_link
+    if username_or_link.startswith('@'):
+        return f"https://t.me/{username_or_link[1:]}"
+    return f"https://t.me/{username_or_link}"
+
+@lru_cache(maxsize=1024)
+def channel_chat_identifier(username_or_link: str) -> str:
+    """Resolve the @username used to check membership in a reward channel"""
+    if username_or_link.startswith('https://t.me/'):
+        return '@' + username_or_link.split('/')[-1]
+    if not username_or_link.startswith('@'):
+        return '@' + username_or_link
+    return username_or_link
+
+@lru_cache(maxsize=1024)
+def group_chat_identifier(group_id: Optional[str], username_or_link: str) -> str:
+    """Resolve the chat id or @username used to check membership in a reward group"""
+    # For groups, use group_id directly if available, otherwise extract from link
+    group_identifier = group_id if group_id else username_or_link
+    
+    if not group_identifier.startswith('@') and not group_identifier.startswith('-'):
+        if username_or_link.startswith('https://t.me/'):
+            group_identifier = '@' + username_or_link.split('/')[-1]
+        elif not username_or_link.startswith('@'):
+            group_identifier = '@' + username_or_link
+    return group_identifier
+
 @dp.callback_query(F.data == "free_credits")
 async def free_credits_handler(callback: CallbackQuery):
     """Handle free credits collection from channels and groups"""
+    channels = get_active_channels()
+    groups = get_active_groups()
+    
+    if not channels and not groups:
+        await callback.answer("❌ لا توجد قنوات أو جروبات متاحة حالياً")
+        return
+    
+    text = "🆓 تجميع رصيد مجاني\n\n" \
+           "اشترك في القنوات والجروبات التالية ثم اضغط '✅ تحقق' للحصول على رصيد مجاني:\n\n"
+    
+    keyboard = InlineKeyboardBuilder()
+    
+    # Add channels
+    if channels:
+        text += "📢 القنوات:\n"
+        for channel in channels:
+            text += f"📢 {channel.title} - {channel.reward_amount} وحدة\n"
+            
+            keyboard.row(
+                InlineKeyboardButton(text="🔗 انضمام", url=telegram_join_url(channel.username_or_link)),
+                InlineKeyboardButton(text="✅ تحقق", callback_data=f"verify_channel_{channel.id}")
+            )
+        text += "\n"
+    
+    # Add groups
+    if groups:
+        text += "👥 الجروبات:\n"
+        for group in groups:
+            text += f"👥 {group.title} - {group.reward_amount} وحدة\n"
+            
+            keyboard.row(
+                InlineKeyboardButton(text="🔗 انضمام", url=telegram_join_url(group.username_or_link)),
+                InlineKeyboardButton(text="✅ تحقق", callback_data=f"verify_group_{group.id}")
+            )
+    
+    # Add verification for all
+    nav_buttons = []
+    if channels:
+        nav_buttons.append(InlineKeyboardButton(text="✅ تحقق من جميع القنوات", callback_data="verify_all_channels"))
+    if groups:
+        nav_buttons.append(InlineKeyboardButton(text="✅ تحقق من جميع الجروبات", callback_data="verify_all_groups"))
+    if nav_buttons:
+        keyboard.row(*nav_buttons)
+    
+    if channels and groups:
+        keyboard.row(InlineKeyboardButton(text="✅ تحقق من الكل", callback_data="verify_all"))
+    
+    keyboard.row(InlineKeyboardButton(text="🔙 الرئيسية", callback_data="main_menu"))
+    
+    await callback.message.edit_text(text, reply_markup=keyboard.as_markup())
+
+def load_pending_channels_sync(user_id: int) -> list:
+    """Active channels the user hasn't been rewarded for, as (id, title, reward_amount, chat_identifier)
+    (blocking, run it off the event loop)"""
+    channels = get_active_channels()
+    
     db = get_db()
     try:
-        channels = db.query(Channel).filter(Channel.active == True).all()
-        groups = db.query(Group).filter(Group.active == True).all()
-        
-        if not channels and not groups:
-            await callback.answer("❌ لا توجد قنوات أو جروبات متاحة حالياً")
-            return
-        
-        text = "🆓 تجميع رصيد مجاني\n\n" \
-               "اشترك في القنوات والجروبات التالية ثم اضغط '✅ تحقق' للحصول على رصيد مجاني:\n\n"
-        
-        keyboard = InlineKeyboardBuilder()
-        
-        # Add channels
-        if channels:
-            text += "📢 القنوات:\n"
-            for channel in channels:
-                text += f"📢 {channel.title} - {channel.reward_amount} وحدة\n"
-                
-                # Validate URL before creating button
-                channel_url = channel.username_or_link
-                if not channel_url.startswith('http'):
-                    if channel_url.startswith('@'):
-                        channel_url = f"https://t.me/{channel_url[1:]}"
-                    else:
-                        channel_url = f"https://t.me/{channel_url}"
-                
-                keyboard.row(
-                    InlineKeyboardButton(text="🔗 انضمام", url=channel_url),
-                    InlineKeyboardButton(text="✅ تحقق", callback_data=f"verify_channel_{channel.id}")
-                )
-            text += "\n"
-        
-        # Add groups
-        if groups:
-            text += "👥 الجروبات:\n"
-            for group in groups:
-                text += f"👥 {group.title} - {group.reward_amount} وحدة\n"
-                
-                # Validate URL before creating button
-                group_url = group.username_or_link
-                if not group_url.startswith('http'):
-                    if group_url.startswith('@'):
-                        group_url = f"https://t.me/{group_url[1:]}"
-                    else:
-                        group_url = f"https://t.me/{group_url}"
-                
-                keyboard.row(
-                    InlineKeyboardButton(text="🔗 انضمام", url=group_url),
-                    InlineKeyboardButton(text="✅ تحقق", callback_data=f"verify_group_{group.id}")
-                )
-        
-        # Add verification for all
-        nav_buttons = []
-        if channels:
-            nav_buttons.append(InlineKeyboardButton(text="✅ تحقق من جميع القنوات", callback_data="verify_all_channels"))
-        if groups:
-            nav_buttons.append(InlineKeyboardButton(text="✅ تحقق من جميع الجروبات", callback_data="verify_all_groups"))
-        if nav_buttons:
-            keyboard.row(*nav_buttons)
-        
-        if channels and groups:
-            keyboard.row(InlineKeyboardButton(text="✅ تحقق من الكل", callback_data="verify_all"))
+        # One IN query for the user's reward rows instead of one per channel
+        rewarded_ids = {
+            channel_id for (channel_id,) in db.query(UserChannelReward.channel_id).filter(
+                UserChannelReward.user_id == user_id,
+                UserChannelReward.channel_id.in_([channel.id for channel in channels]),
+                UserChannelReward.last_award_at.isnot(None)
+            ).all()
+        }
         
-        keyboard.row(InlineKeyboardButton(text="🔙 الرئيسية", callback_data="main_menu"))
+        pending = []
+        for channel in channels:
+            if channel.id in rewarded_ids:
+                continue
+            
+            pending.append((channel.id, channel.title, channel.reward_amount, channel_chat_identifier(channel.username_or_link)))
+        return pending
+    finally:
+        db.close()
+
+def load_pending_groups_sync(user_id: int) -> list:
+    """Active groups the user hasn't been rewarded for, as (id, title, reward_amount, chat_identifier)
+    (blocking, run it off the event loop)"""
+    groups = get_active_groups()
+    
+    db = get_db()
+    try:
+        # One IN query for the user's reward rows instead of one per group
+        rewarded_ids = {
+            group_id for (group_id,) in db.query(UserGroupReward.group_id).filter(
+                UserGroupReward.user_id == user_id,
+                UserGroupReward.group_id.in_([group.id for group in groups]),
+                UserGroupReward.last_award_at.isnot(None)
+            ).all()
+        }
         
-        await callback.message.edit_text(text, reply_markup=keyboard.as_markup())
+        pending = []
+        for group in groups:
+            if group.id in rewarded_ids:
+                continue
+            
+            pending.append((group.id, group.title, group.reward_amount, group_chat_identifier(group.group_id, group.username_or_link)))
+        return pending
+    finally:
+        db.close()
+
+async def get_membership_status(chat_identifier: str, telegram_user_id: int) -> str:
+    """Get a user's member status in a reward channel/group, reusing recent confirmed memberships"""
+    key = (chat_identifier, telegram_user_id)
+    cached = membership_status_cache.get(key)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    
+    member = await bot.get_chat_member(chat_identifier, telegram_user_id)
+    # Only memberships are cached: a user who just joined must not be told to join again
+    if member.status in ['member', 'administrator', 'creator']:
+        now = time.monotonic()
+        # Entries share one TTL and are kept in insertion order, so expired ones sit at the front;
+        # drop them, and the oldest live ones too while the cache is full
+        membership_status_cache.pop(key, None)
+        while membership_status_cache:
+            oldest_key = next(iter(membership_status_cache))
+            if (membership_status_cache[oldest_key][0] > now
+                    and len(membership_status_cache) < MEMBERSHIP_CACHE_MAX_ENTRIES):
+                break
+            del membership_status_cache[oldest_key]
+        membership_status_cache[key] = (now + MEMBERSHIP_CACHE_TTL_SEC, member.status)
+    return member.status
+
+async def check_memberships(items: list, telegram_user_id: int, kind: str) -> list:
+    """Return (id, title, reward_amount) for the pending items the user is a member of.
+    Called with no DB session open so connections aren't held during Telegram round-trips"""
+    statuses = await asyncio.gather(
+        *(get_membership_status(item[3], telegram_user_id) for item in items),
+        return_exceptions=True
+    )
+    
+    verified = []
+    for (item_id, title, reward_amount, _), status in zip(items, statuses):
+        if isinstance(status, Exception):
+            logger.error(f"Error checking {kind} {title}: {status}")
+        elif status in ['member', 'administrator', 'creator']:
+            verified.append((item_id, title, reward_amount))
+    return verified
+
+def award_membership_rewards_sync(user_id: int, channels: list, groups: list):
+    """Credit verified channel and group rewards with their records and transactions in one commit.
+    Items another request already awarded are skipped; returns the total actually credited
+    (blocking, run it off the event loop)"""
+    total_reward = 0
+    
+    db = get_db()
+    try:
+        now = datetime.now()
+        transactions = []
+        
+        for reward_model, fk_column, items, reason in (
+            (UserChannelReward, UserChannelReward.channel_id, channels, "مكافأة الاشتراك في {}"),
+            (UserGroupReward, UserGroupReward.group_id, groups, "مكافأة الانضمام لجروب {}"),
+        ):
+            if not items:
+                continue
+            
+            # Claim every reward row for this table in one statement; rows that were already
+            # awarded (e.g. by a concurrent click) don't match the WHERE and aren't returned
+            stmt = pg_insert(reward_model).values([
+                {'user_id': user_id, fk_column.key: item[0], 'times_awarded': 1, 'last_award_at': now}
+                for item in items
+            ])
+            claimed_ids = set(db.execute(stmt.on_conflict_do_update(
+                index_elements=[reward_model.user_id, fk_column],
+                set_={
+                    'times_awarded': func.coalesce(reward_model.times_awarded, 0) + 1,
+                    'last_award_at': stmt.excluded.last_award_at,
+                },
+                where=reward_model.last_award_at.is_(None)
+            ).returning(fk_column)).scalars())
+            
+            for item_id, title, reward_amount in items:
+                if item_id not in claimed_ids:
+                    continue
+                total_reward += reward_amount
+                transactions.append(Transaction(
+                    user_id=user_id,
+                    type=TransactionType.REWARD,
+                    amount=reward_amount,
+                    reason=reason.format(title)
+                ))
         
+        if total_reward > 0:
+            # Add balance atomically in SQL so concurrent grants can't overwrite each other
+            db.execute(
+                update(User).where(User.id == user_id).values(
+                    balance=func.coalesce(User.balance, 0) + total_reward
+                ),
+                execution_options={"synchronize_session": False}
+            )
+            db.bulk_save_objects(transactions)
+        db.commit()
+        return total_reward
     finally:
         db.close()
 
@@ -2651,6 +3645,7 @@ async def verify_channel_handler(callback: CallbackQuery):
     """Handle single channel verification"""
     channel_id = int(callback.data.split("_")[2])
     user, _ = await get_or_create_user(str(callback.from_user.id))
+    user_id = user.id
     
     db = get_db()
     try:
@@ -2661,7 +3656,7 @@ async def verify_channel_handler(callback: CallbackQuery):
         
         # Check if user already received reward
         reward_record = db.query(UserChannelReward).filter(
-            UserChannelReward.user_id == user.id,
+            UserChannelReward.user_id == user_id,
             UserChannelReward.channel_id == channel_id
         ).first()
         
@@ -2669,61 +3664,33 @@ async def verify_channel_handler(callback: CallbackQuery):
             await callback.answer("✅ تم استلام مكافأة هذه القناة من قبل")
             return
         
-        # Check membership
-        try:
-            # Extract channel username from link
-            channel_username = channel.username_or_link
-            if channel_username.startswith('https://t.me/'):
-                channel_username = '@' + channel_username.split('/')[-1]
-            elif not channel_username.startswith('@'):
-                channel_username = '@' + channel_username
-            
-            member = await bot.get_chat_member(channel_username, callback.from_user.id)
-            if member.status in ['member', 'administrator', 'creator']:
-                # Give reward
-                user_obj = db.query(User).filter(User.id == user.id).first()
-                user_obj.balance += channel.reward_amount
-                
-                # Create reward record
-                if not reward_record:
-                    reward_record = UserChannelReward(
-                        user_id=user.id,
-                        channel_id=channel_id,
-                        times_awarded=1
-                    )
-                    db.add(reward_record)
-                else:
-                    reward_record.times_awarded += 1
-                
-                reward_record.last_award_at = datetime.now()
-                
-                # Create transaction
-                transaction = Transaction(
-                    user_id=user.id,
-                    type=TransactionType.REWARD,
-                    amount=channel.reward_amount,
-                    reason=f"مكافأة الاشتراك في {channel.title}"
-                )
-                db.add(transaction)
-                
-                db.commit()
-                
-                await callback.answer(f"🎉 تم إضافة {channel.reward_amount} وحدة لرصيدك!")
-            else:
-                await callback.answer("❌ يجب الاشتراك في القناة أولاً")
-                
-        except Exception as e:
-            logger.error(f"Error checking channel membership: {e}")
-            await callback.answer("❌ حدث خطأ في التحقق من الاشتراك")
-    
+        title, reward_amount = channel.title, channel.reward_amount
+        channel_username = channel_chat_identifier(channel.username_or_link)
     finally:
         db.close()
+    
+    # Check membership
+    try:
+        status = await get_membership_status(channel_username, callback.from_user.id)
+        if status in ['member', 'administrator', 'creator']:
+            credited = await asyncio.to_thread(award_membership_rewards_sync, user_id, [(channel_id, title, reward_amount)], [])
+            if credited > 0:
+                await callback.answer(f"🎉 تم إضافة {credited} وحدة لرصيدك!")
+            else:
+                await callback.answer("✅ تم استلام مكافأة هذه القناة من قبل")
+        else:
+            await callback.answer("❌ يجب الاشتراك في القناة أولاً")
+            
+    except Exception as e:
+        logger.error(f"Error checking channel membership: {e}")
+        await callback.answer("❌ حدث خطأ في التحقق من الاشتراك")
 
 @dp.callback_query(F.data.startswith("verify_group_"))
 async def verify_group_handler(callback: CallbackQuery):
     """Handle single group verification"""
     group_id = int(callback.data.split("_")[2])
     user, _ = await get_or_create_user(str(callback.from_user.id))
+    user_id = user.id
     
     db = get_db()
     try:
@@ -2734,7 +3701,7 @@ async def verify_group_handler(callback: CallbackQuery):
         
         # Check if user already received reward
         reward_record = db.query(UserGroupReward).filter(
-            UserGroupReward.user_id == user.id,
+            UserGroupReward.user_id == user_id,
             UserGroupReward.group_id == group_id
         ).first()
         
@@ -2742,351 +3709,90 @@ async def verify_group_handler(callback: CallbackQuery):
             await callback.answer("✅ تم استلام مكافأة هذا الجروب من قبل")
             return
         
-        # Check membership
-        try:
-            # For groups, use group_id directly if available, otherwise extract from link
-            group_identifier = group.group_id if group.group_id else group.username_or_link
-            
-            if not group_identifier.startswith('@') and not group_identifier.startswith('-'):
-                if group.username_or_link.startswith('https://t.me/'):
-                    group_identifier = '@' + group.username_or_link.split('/')[-1]
-                elif not group.username_or_link.startswith('@'):
-                    group_identifier = '@' + group.username_or_link
-            
-            member = await bot.get_chat_member(group_identifier, callback.from_user.id)
-            if member.status in ['member', 'administrator', 'creator']:
-                # Give reward
-                user_obj = db.query(User).filter(User.id == user.id).first()
-                user_obj.balance += group.reward_amount
-                
-                # Create reward record
-                if not reward_record:
-                    reward_record = UserGroupReward(
-                        user_id=user.id,
-                        group_id=group_id,
-                        times_awarded=1
-                    )
-                    db.add(reward_record)
-                else:
-                    reward_record.times_awarded += 1
-                
-                reward_record.last_award_at = datetime.now()
-                
-                # Create transaction
-                transaction = Transaction(
-                    user_id=user.id,
-                    type=TransactionType.REWARD,
-                    amount=group.reward_amount,
-                    reason=f"مكافأة الانضمام لجروب {group.title}"
-                )
-                db.add(transaction)
-                
-                db.commit()
-                
-                await callback.answer(f"🎉 تم إضافة {group.reward_amount} وحدة لرصيدك!")
-            else:
-                await callback.answer("❌ يجب الانضمام للجروب أولاً")
-                
-        except Exception as e:
-            logger.error(f"Error checking group membership: {e}")
-            await callback.answer("❌ حدث خطأ في التحقق من الانضمام")
-    
+        title, reward_amount = group.title, group.reward_amount
+        group_identifier = group_chat_identifier(group.group_id, group.username_or_link)
     finally:
         db.close()
+    
+    # Check membership
+    try:
+        status = await get_membership_status(group_identifier, callback.from_user.id)
+        if status in ['member', 'administrator', 'creator']:
+            credited = await asyncio.to_thread(award_membership_rewards_sync, user_id, [], [(group_id, title, reward_amount)])
+            if credited > 0:
+                await callback.answer(f"🎉 تم إضافة {credited} وحدة لرصيدك!")
+            else:
+                await callback.answer("✅ تم استلام مكافأة هذا الجروب من قبل")
+        else:
+            await callback.answer("❌ يجب الانضمام للجروب أولاً")
+            
+    except Exception as e:
+        logger.error(f"Error checking group membership: {e}")
+        await callback.answer("❌ حدث خطأ في التحقق من الانضمام")
 
 @dp.callback_query(F.data == "verify_all_channels")
 async def verify_all_channels_handler(callback: CallbackQuery):
     """Handle verification of all channels"""
     user, _ = await get_or_create_user(str(callback.from_user.id))
+    user_id = user.id
     
-    db = get_db()
-    try:
-        channels = db.query(Channel).filter(Channel.active == True).all()
-        total_reward = 0
-        verified_channels = []
-        
-        for channel in channels:
-            # Check if user already received reward
-            reward_record = db.query(UserChannelReward).filter(
-                UserChannelReward.user_id == user.id,
-                UserChannelReward.channel_id == channel.id
-            ).first()
-            
-            if reward_record and reward_record.last_award_at:
-                continue
-            
-            # Check membership
-            try:
-                channel_username = channel.username_or_link
-                if channel_username.startswith('https://t.me/'):
-                    channel_username = '@' + channel_username.split('/')[-1]
-                elif not channel_username.startswith('@'):
-                    channel_username = '@' + channel_username
-                
-                member = await bot.get_chat_member(channel_username, callback.from_user.id)
-                if member.status in ['member', 'administrator', 'creator']:
-                    verified_channels.append(channel)
-                    total_reward += channel.reward_amount
-                    
-            except Exception as e:
-                logger.error(f"Error checking channel {channel.title}: {e}")
-                continue
-        
-        if total_reward > 0:
-            # Add balance
-            user_obj = db.query(User).filter(User.id == user.id).first()
-            user_obj.balance += total_reward
-            
-            # Create records and transactions
-            for channel in verified_channels:
-                reward_record = db.query(UserChannelReward).filter(
-                    UserChannelReward.user_id == user.id,
-                    UserChannelReward.channel_id == channel.id
-                ).first()
-                
-                if not reward_record:
-                    reward_record = UserChannelReward(
-                        user_id=user.id,
-                        channel_id=channel.id,
-                        times_awarded=1
-                    )
-                    db.add(reward_record)
-                else:
-                    reward_record.times_awarded += 1
-                
-                reward_record.last_award_at = datetime.now()
-                
-                transaction = Transaction(
-                    user_id=user.id,
-                    type=TransactionType.REWARD,
-                    amount=channel.reward_amount,
-                    reason=f"مكافأة الاشتراك في {channel.title}"
-                )
-                db.add(transaction)
-            
-            db.commit()
-            
-            await callback.answer(f"🎉 تم إضافة {total_reward} وحدة لرصيدك!")
-        else:
-            await callback.answer("❌ لم يتم العثور على اشتراكات جديدة")
+    pending_channels = await asyncio.to_thread(load_pending_channels_sync, user_id)
+    verified_channels = await check_memberships(pending_channels, callback.from_user.id, "channel")
+    total_reward = sum(item[2] for item in verified_channels)
     
-    finally:
-        db.close()
+    if total_reward > 0:
+        # Another click may have claimed some of these meanwhile; only report what this one credited
+        total_reward = await asyncio.to_thread(award_membership_rewards_sync, user_id, verified_channels, [])
+    
+    if total_reward > 0:
+        await callback.answer(f"🎉 تم إضافة {total_reward} وحدة لرصيدك!")
+    else:
+        await callback.answer("❌ لم يتم العثور على اشتراكات جديدة")
 
 @dp.callback_query(F.data == "verify_all_groups")
 async def verify_all_groups_handler(callback: CallbackQuery):
-    """Handle verification of all groups"""
-    user, _ = await get_or_create_user(str(callback.from_user.id))
-    
-    db = get_db()
-    try:
-        groups = db.query(Group).filter(Group.active == True).all()
-        total_reward = 0
-        verified_groups = []
-        
-        for group in groups:
-            # Check if user already received reward
-            reward_record = db.query(UserGroupReward).filter(
-                UserGroupReward.user_id == user.id,
-                UserGroupReward.group_id == group.id
-            ).first()
-            
-            if reward_record and reward_record.last_award_at:
-                continue
-            
-            # Check membership
-            try:
-                group_identifier = group.group_id if group.group_id else group.username_or_link
-                
-                if not group_identifier.startswith('@') and not group_identifier.startswith('-'):
-                    if group.username_or_link.startswith('https://t.me/'):
-                        group_identifier = '@' + group.username_or_link.split('/')[-1]
-                    elif not group.username_or_link.startswith('@'):
-                        group_identifier = '@' + group.username_or_link
-                
-                member = await bot.get_chat_member(group_identifier, callback.from_user.id)
-                if member.status in ['member', 'administrator', 'creator']:
-                    verified_groups.append(group)
-                    total_reward += group.reward_amount
-                    
-            except Exception as e:
-                logger.error(f"Error checking group {group.title}: {e}")
-                continue
-        
-        if total_reward > 0:
-            # Add balance
-            user_obj = db.query(User).filter(User.id == user.id).first()
-            user_obj.balance += total_reward
-            
-            # Create records and transactions
-            for group in verified_groups:
-                reward_record = db.query(UserGroupReward).filter(
-                    UserGroupReward.user_id == user.id,
-                    UserGroupReward.group_id == group.id
-                ).first()
-                
-                if not reward_record:
-                    reward_record = UserGroupReward(
-                        user_id=user.id,
-                        group_id=group.id,
-                        times_awarded=1
-                    )
-                    db.add(reward_record)
-                else:
-                    reward_record.times_awarded += 1
-                
-                reward_record.last_award_at = datetime.now()
-                
-                transaction = Transaction(
-                    user_id=user.id,
-                    type=TransactionType.REWARD,
-                    amount=group.reward_amount,
-                    reason=f"مكافأة الانضمام لجروب {group.title}"
-                )
-                db.add(transaction)
-            
-            db.commit()
-            
-            await callback.answer(f"🎉 تم إضافة {total_reward} وحدة لرصيدك!")
-        else:
-            await callback.answer("❌ لم يتم العثور على انضمام جديد للجروبات")
-    
-    finally:
-        db.close()
-
-@dp.callback_query(F.data == "verify_all")
-async def verify_all_handler(callback: CallbackQuery):
-    """Handle verification of all channels and groups"""
-    user, _ = await get_or_create_user(str(callback.from_user.id))
-    
-    db = get_db()
-    try:
-        total_reward = 0
-        verified_items = []
-        
-        # Check channels
-        channels = db.query(Channel).filter(Channel.active == True).all()
-        for channel in channels:
-            reward_record = db.query(UserChannelReward).filter(
-                UserChannelReward.user_id == user.id,
-                UserChannelReward.channel_id == channel.id
-            ).first()
-            
-            if reward_record and reward_record.last_award_at:
-                continue
-            
-            try:
-                channel_username = channel.username_or_link
-                if channel_username.startswith('https://t.me/'):
-                    channel_username = '@' + channel_username.split('/')[-1]
-                elif not channel_username.startswith('@'):
-                    channel_username = '@' + channel_username
-                
-                member = await bot.get_chat_member(channel_username, callback.from_user.id)
-                if member.status in ['member', 'administrator', 'creator']:
-                    verified_items.append(('channel', channel))
-                    total_reward += channel.reward_amount
-                    
-            except Exception as e:
-                logger.error(f"Error checking channel {channel.title}: {e}")
-                continue
-        
-        # Check groups
-        groups = db.query(Group).filter(Group.active == True).all()
-        for group in groups:
-            reward_record = db.query(UserGroupReward).filter(
-                UserGroupReward.user_id == user.id,
-                UserGroupReward.group_id == group.id
-            ).first()
-            
-            if reward_record and reward_record.last_award_at:
-                continue
-            
-            try:
-                group_identifier = group.group_id if group.group_id else group.username_or_link
-                
-                if not group_identifier.startswith('@') and not group_identifier.startswith('-'):
-                    if group.username_or_link.startswith('https://t.me/'):
-                        group_identifier = '@' + group.username_or_link.split('/')[-1]
-                    elif not group.username_or_link.startswith('@'):
-                        group_identifier = '@' + group.username_or_link
-                
-                member = await bot.get_chat_member(group_identifier, callback.from_user.id)
-                if member.status in ['member', 'administrator', 'creator']:
-                    verified_items.append(('group', group))
-                    total_reward += group.reward_amount
-                    
-            except Exception as e:
-                logger.error(f"Error checking group {group.title}: {e}")
-                continue
-        
-        if total_reward > 0:
-            # Add balance
-            user_obj = db.query(User).filter(User.id == user.id).first()
-            user_obj.balance += total_reward
-            
-            # Create records and transactions
-            for item_type, item in verified_items:
-                if item_type == 'channel':
-                    reward_record = db.query(UserChannelReward).filter(
-                        UserChannelReward.user_id == user.id,
-                        UserChannelReward.channel_id == item.id
-                    ).first()
-                    
-                    if not reward_record:
-                        reward_record = UserChannelReward(
-                            user_id=user.id,
-                            channel_id=item.id,
-                            times_awarded=1
-                        )
-                        db.add(reward_record)
-                    else:
-                        reward_record.times_awarded += 1
-                    
-                    reward_record.last_award_at = datetime.now()
-                    
-                    transaction = Transaction(
-                        user_id=user.id,
-                        type=TransactionType.REWARD,
-                        amount=item.reward_amount,
-                        reason=f"مكافأة الاشتراك في {item.title}"
-                    )
-                    db.add(transaction)
-                    
-                elif item_type == 'group':
-                    reward_record = db.query(UserGroupReward).filter(
-                        UserGroupReward.user_id == user.id,
-                        UserGroupReward.group_id == item.id
-                    ).first()
-                    
-                    if not reward_record:
-                        reward_record = UserGroupReward(
-                            user_id=user.id,
-                            group_id=item.id,
-                            times_awarded=1
-                        )
-                        db.add(reward_record)
-                    else:
-                        reward_record.times_awarded += 1
-                    
-                    reward_record.last_award_at = datetime.now()
-                    
-                    transaction = Transaction(
-                        user_id=user.id,
-                        type=TransactionType.REWARD,
-                        amount=item.reward_amount,
-                        reason=f"مكافأة الانضمام لجروب {item.title}"
-                    )
-                    db.add(transaction)
-            
-            db.commit()
-            
-            await callback.answer(f"🎉 تم إضافة {total_reward} وحدة لرصيدك!")
-        else:
-            await callback.answer("❌ لم يتم العثور على اشتراكات أو انضمام جديد")
+    """Handle verification of all groups"""
+    user, _ = await get_or_create_user(str(callback.from_user.id))
+    user_id = user.id
     
-    finally:
-        db.close()
+    pending_groups = await asyncio.to_thread(load_pending_groups_sync, user_id)
+    verified_groups = await check_memberships(pending_groups, callback.from_user.id, "group")
+    total_reward = sum(item[2] for item in verified_groups)
+    
+    if total_reward > 0:
+        # Another click may have claimed some of these meanwhile; only report what this one credited
+        total_reward = await asyncio.to_thread(award_membership_rewards_sync, user_id, [], verified_groups)
+    
+    if total_reward > 0:
+        await callback.answer(f"🎉 تم إضافة {total_reward} وحدة لرصيدك!")
+    else:
+        await callback.answer("❌ لم يتم العثور على انضمام جديد للجروبات")
+
+@dp.callback_query(F.data == "verify_all")
+async def verify_all_handler(callback: CallbackQuery):
+    """Handle verification of all channels and groups"""
+    user, _ = await get_or_create_user(str(callback.from_user.id))
+    user_id = user.id
+    
+    pending_channels, pending_groups = await asyncio.gather(
+        asyncio.to_thread(load_pending_channels_sync, user_id),
+        asyncio.to_thread(load_pending_groups_sync, user_id)
+    )
+    
+    verified_channels, verified_groups = await asyncio.gather(
+        check_memberships(pending_channels, callback.from_user.id, "channel"),
+        check_memberships(pending_groups, callback.from_user.id, "group")
+    )
+    total_reward = sum(item[2] for item in verified_channels) + sum(item[2] for item in verified_groups)
+    
+    if total_reward > 0:
+        # Another click may have claimed some of these meanwhile; only report what this one credited
+        total_reward = await asyncio.to_thread(award_membership_rewards_sync, user_id, verified_channels, verified_groups)
+    
+    if total_reward > 0:
+        await callback.answer(f"🎉 تم إضافة {total_reward} وحدة لرصيدك!")
+    else:
+        await callback.answer("❌ لم يتم العثور على اشتراكات أو انضمام جديد")
 
 @dp.callback_query(F.data == "help")
 async def help_handler(callback: CallbackQuery):
@@ -3112,10 +3818,9 @@ async def help_handler(callback: CallbackQuery):
     await callback.message.edit_text(help_text, reply_markup=keyboard.as_markup())
 
 @dp.callback_query(F.data == "settings")
-async def settings_handler(callback: CallbackQuery):
+async def settings_handler(callback: CallbackQuery, lang_code: str = 'ar'):
     """Handle settings menu for regular users"""
     user_id = str(callback.from_user.id)
-    lang_code = get_user_language(user_id)
     
     # Get user info
     db = get_db()
@@ -3153,41 +3858,26 @@ async def settings_handler(callback: CallbackQuery):
 @dp.callback_query(F.data == "choose_language")
 async def choose_language_handler(callback: CallbackQuery):
     """Handle language selection from settings"""
-    keyboard = InlineKeyboardBuilder()
-    
-    # Add language selection buttons (2 per row)
-    lang_items = list(SUPPORTED_LANGUAGES.items())
-    for i in range(0, len(lang_items), 2):
-        row = []
-        for j in range(2):
-            if i + j < len(lang_items):
-                code, name = lang_items[i + j]
-                row.append(InlineKeyboardButton(
-                    text=name,
-                    callback_data=f"set_lang_{code}"
-                ))
-        keyboard.row(*row)
-    
-    keyboard.row(InlineKeyboardButton(text="🔙 الإعدادات", callback_data="settings"))
-    
     await callback.message.edit_text(
         "🌐 اختر لغتك المفضلة:\nChoose your preferred language:",
-        reply_markup=keyboard.as_markup()
+        reply_markup=get_language_markup("🔙 الإعدادات", "settings")
     )
 
 @dp.callback_query(F.data == "show_history")
-async def show_history_handler(callback: CallbackQuery):
+async def show_history_handler(callback: CallbackQuery, lang_code: str = 'ar'):
     """Show user history from settings"""
     user_id = str(callback.from_user.id)
     
     db = get_db()
     try:
-        reservations = db.query(Reservation).filter(
+        reservations = db.query(Reservation).options(
+            joinedload(Reservation.service),
+            joinedload(Reservation.number)
+        ).filter(
             Reservation.user_id == user_id
         ).order_by(Reservation.created_at.desc()).limit(10).all()
         
         if not reservations:
-            lang_code = get_user_language(user_id)
             no_history_text = await translator.translate_text("📋 لا توجد طلبات سابقة", lang_code)
             await callback.message.edit_text(
                 no_history_text,
@@ -3197,37 +3887,34 @@ async def show_history_handler(callback: CallbackQuery):
             )
             return
         
-        history_text = "📋 آخر 10 طلبات:\n\n"
+        # Translate only the fixed header (cached); dates and numbers don't need translating
+        history_header = await translator.translate_text("📋 آخر 10 طلبات:", lang_code)
+        history_parts = [f"{history_header}\n\n"]
+        service_names = get_texts((res.service.name for res in reservations), lang_code)
         for res in reservations:
-            status_emoji = {
-                ReservationStatus.WAITING_CODE: "⏳",
-                ReservationStatus.COMPLETED: "✅", 
-                ReservationStatus.EXPIRED: "⏰",
-                ReservationStatus.CANCELED: "❌"
-            }.get(res.status, "❓")
+            status_emoji = RESERVATION_STATUS_EMOJI.get(res.status, "❓")
             
-            history_text += f"{status_emoji} {res.service.name} - {res.number}\n"
-            history_text += f"   📅 {res.created_at.strftime('%Y-%m-%d %H:%M')}\n\n"
+            service_name = service_names[res.service.name]
+            history_parts.append(f"{status_emoji} {service_name} - {res.number.phone_number}\n")
+            history_parts.append(f"   📅 {res.created_at.strftime('%Y-%m-%d %H:%M')}\n\n")
+        history_text = "".join(history_parts)
         
         keyboard = InlineKeyboardBuilder()
         keyboard.row(InlineKeyboardButton(text="🔙 الإعدادات", callback_data="settings"))
         
-        lang_code = get_user_language(user_id)
-        translated_text = await translator.translate_text(history_text, lang_code)
-        await callback.message.edit_text(translated_text, reply_markup=keyboard.as_markup())
+        await callback.message.edit_text(history_text, reply_markup=keyboard.as_markup())
         
     finally:
         db.close()
 
 # Admin handlers
 @dp.callback_query(F.data == "admin")
-async def admin_handler(callback: CallbackQuery, state: FSMContext):
+async def admin_handler(callback: CallbackQuery, state: FSMContext, lang_code: str = 'ar'):
     """Handle admin panel access"""
     user_id = callback.from_user.id
     
     if user_id != ADMIN_ID and not is_admin_session_valid(user_id):
         await state.set_state(AdminStates.waiting_for_password)
-        lang_code = get_user_language(str(callback.from_user.id)) 
         password_prompt = t('admin_password_prompt', lang_code)
         cancel_text = t('main_menu', lang_code)
         
@@ -3239,7 +3926,6 @@ async def admin_handler(callback: CallbackQuery, state: FSMContext):
         )
         return
     
-    lang_code = get_user_language(str(callback.from_user.id))
     admin_panel_text = t('admin_panel', lang_code)
     choose_section_text = t('choose_section', lang_code)
     
@@ -3249,12 +3935,11 @@ async def admin_handler(callback: CallbackQuery, state: FSMContext):
     )
 
 @dp.message(AdminStates.waiting_for_password)
-async def admin_password_handler(message: types.Message, state: FSMContext):
+async def admin_password_handler(message: types.Message, state: FSMContext, lang_code: str = 'ar'):
     """Handle admin password verification"""
     if message.text == ADMIN_PASSWORD:
-        admin_sessions[message.from_user.id] = datetime.now()
+        admin_sessions[message.from_user.id] = time.monotonic() + ADMIN_SESSION_TTL_SEC
         await state.clear()
-        lang_code = get_user_language(str(message.from_user.id))
         success_text = t('admin_login_success', lang_code)
         admin_panel_text = t('admin_panel', lang_code)
         
@@ -3263,7 +3948,6 @@ async def admin_password_handler(message: types.Message, state: FSMContext):
             reply_markup=create_admin_keyboard()
         )
     else:
-        lang_code = get_user_language(str(message.from_user.id))
         failed_text = t('admin_login_failed', lang_code)
         await message.reply(failed_text)
 
@@ -3275,20 +3959,21 @@ async def admin_services_handler(callback: CallbackQuery):
         return
     
     # Show loading indicator
-    await callback.answer("🔄 جاري تحميل الخدمات...")
+    acknowledge_callback(callback, "🔄 جاري تحميل الخدمات...")
     
     db = get_db()
     try:
         services = db.query(Service).all()
         
-        text = "🛠 إدارة الخدمات\n\n"
+        text_parts = ["🛠 إدارة الخدمات\n\n"]
         if services:
-            text += "الخدمات الحالية:\n"
+            text_parts.append("الخدمات الحالية:\n")
             for service in services:
                 status = "✅" if service.active else "❌"
-                text += f"{status} {service.emoji} {service.name} - {service.default_price} وحدة\n"
+                text_parts.append(f"{status} {service.emoji} {service.name} - {service.default_price} وحدة\n")
         else:
-            text += "لا توجد خدمات مضافة\n"
+            text_parts.append("لا توجد خدمات مضافة\n")
+        text = "".join(text_parts)
         
         keyboard = InlineKeyboardBuilder()
         keyboard.row(
@@ -3306,18 +3991,14 @@ async def admin_services_handler(callback: CallbackQuery):
     finally:
         db.close()
 
-@dp.callback_query(F.data == "admin_users")
-async def admin_users_handler(callback: CallbackQuery):
-    """Handle admin users management"""
-    if not is_admin_session_valid(callback.from_user.id):
-        await callback.answer("❌ انتهت صلاحية الجلسة")
-        return
-    
-    db = get_db()
-    try:
-        users_count = db.query(User).count()
-        active_users = db.query(User).filter(User.is_banned == False).count()
-        banned_users = db.query(User).filter(User.is_banned == True).count()
+def build_users_stats_text_sync() -> str:
+    """Build the admin users statistics text (blocking, run it off the event loop)"""
+    with db_session() as db:
+        # One grouped count instead of three; NULL is_banned counts toward the total only
+        banned_counts = dict(db.query(User.is_banned, func.count(User.id)).group_by(User.is_banned).all())
+        users_count = sum(banned_counts.values())
+        active_users = banned_counts.get(False, 0)
+        banned_users = banned_counts.get(True, 0)
         
         text = f"👥 إدارة المستخدمين\n\n"
         text += f"📊 الإحصائيات:\n"
@@ -3325,17 +4006,27 @@ async def admin_users_handler(callback: CallbackQuery):
         text += f"• المستخدمين النشطين: {active_users}\n"
         text += f"• المستخدمين المحظورين: {banned_users}\n"
         
-        keyboard = InlineKeyboardBuilder()
-        keyboard.row(
-            InlineKeyboardButton(text="👤 البحث عن مستخدم", callback_data="admin_search_user"),
-            InlineKeyboardButton(text="📋 قائمة المستخدمين", callback_data="admin_list_users")
-        )
-        keyboard.row(InlineKeyboardButton(text="🔙 لوحة الإدارة", callback_data="admin"))
-        
-        await callback.message.edit_text(text, reply_markup=keyboard.as_markup())
-        
-    finally:
-        db.close()
+        return text
+
+@dp.callback_query(F.data == "admin_users")
+async def admin_users_handler(callback: CallbackQuery):
+    """Handle admin users management"""
+    if not is_admin_session_valid(callback.from_user.id):
+        await callback.answer("❌ انتهت صلاحية الجلسة")
+        return
+    
+    acknowledge_callback(callback)
+    
+    text = await asyncio.to_thread(get_admin_stats_text, "users", build_users_stats_text_sync)
+    
+    keyboard = InlineKeyboardBuilder()
+    keyboard.row(
+        InlineKeyboardButton(text="👤 البحث عن مستخدم", callback_data="admin_search_user"),
+        InlineKeyboardButton(text="📋 قائمة المستخدمين", callback_data="admin_list_users")
+    )
+    keyboard.row(InlineKeyboardButton(text="🔙 لوحة الإدارة", callback_data="admin"))
+    
+    await callback.message.edit_text(text, reply_markup=keyboard.as_markup())
 
 @dp.callback_query(F.data == "admin_add_balance")
 async def admin_add_balance_handler(callback: CallbackQuery, state: FSMContext):
@@ -3497,40 +4188,54 @@ async def handle_balance_amount(message: types.Message, state: FSMContext):
     target_user_id = data.get("target_user_id")
     action_type = data.get("action_type", "add")
     
+    if action_type == "add":
+        signed_amount = amount
+        transaction_type = TransactionType.ADD
+        transaction_reason = f"شحن رصيد بواسطة الأدمن"
+        emoji = "💰"
+        action_text = "شحن"
+    else:
+        signed_amount = -amount
+        transaction_type = TransactionType.DEDUCT
+        transaction_reason = f"خصم رصيد بواسطة الأدمن"
+        emoji = "💳"
+        action_text = "خصم"
+    
     db = get_db()
     try:
-        target_user = db.query(User).filter(User.id == target_user_id).first()
-        if not target_user:
-            await message.reply("❌ حدث خطأ، لم يتم العثور على المستخدم")
-            await state.clear()
-            return
-        
-        old_balance = float(target_user.balance)
+        # Apply the change in SQL in one statement; a deduction only goes through if the balance covers it
+        conditions = [User.id == target_user_id]
+        if action_type != "add":
+            conditions.append(func.coalesce(User.balance, 0) >= amount)
+        target_user = db.execute(
+            update(User).where(*conditions).values(
+                balance=func.coalesce(User.balance, 0) + signed_amount
+            ).returning(User.balance, User.first_name, User.username, User.telegram_id),
+            execution_options={"synchronize_session": False}
+        ).first()
         
-        if action_type == "add":
-            target_user.balance = old_balance + amount
-            transaction_type = TransactionType.ADD
-            transaction_reason = f"شحن رصيد بواسطة الأدمن"
-            emoji = "💰"
-            action_text = "شحن"
-        else:
-            if old_balance < amount:
-                await message.reply(
-                    f"❌ رصيد المستخدم غير كافي للخصم\n"
-                    f"الرصيد الحالي: {old_balance} وحدة\n"
-                    f"المبلغ المطلوب خصمه: {amount} وحدة"
-                )
+        if target_user is None:
+            db.rollback()
+            # Tell a missing user apart from one whose balance (possibly NULL) doesn't cover the amount
+            existing_user = db.query(User.id, User.balance).filter(User.id == target_user_id).first()
+            if action_type == "add" or existing_user is None:
+                await message.reply("❌ حدث خطأ، لم يتم العثور على المستخدم")
+                await state.clear()
                 return
             
-            target_user.balance = old_balance - amount
-            transaction_type = TransactionType.DEDUCT
-            transaction_reason = f"خصم رصيد بواسطة الأدمن"
-            emoji = "💳"
-            action_text = "خصم"
+            await message.reply(
+                f"❌ رصيد المستخدم غير كافي للخصم\n"
+                f"الرصيد الحالي: {float(existing_user.balance or 0)} وحدة\n"
+                f"المبلغ المطلوب خصمه: {amount} وحدة"
+            )
+            return
         
-        # Create transaction record
+        new_balance = float(target_user.balance)
+        old_balance = new_balance - signed_amount
+        
+        # Create transaction record in the same transaction as the balance change
         transaction = Transaction(
-            user_id=target_user.id,
+            user_id=target_user_id,
             type=transaction_type,
             amount=amount,
             reason=transaction_reason
@@ -3539,8 +4244,6 @@ async def handle_balance_amount(message: types.Message, state: FSMContext):
         
         db.commit()
         
-        new_balance = float(target_user.balance)
-        
         # Send success message
         await message.reply(
             f"✅ تم {action_text} الرصيد بنجاح!\n\n"
@@ -3573,6 +4276,46 @@ async def handle_balance_amount(message: types.Message, state: FSMContext):
     finally:
         db.close()
 
+def count_numbers_by_status(db_session) -> Dict[NumberStatus, int]:
+    """Count numbers per status with a single GROUP BY"""
+    return dict(db_session.query(Number.status, func.count(Number.id)).group_by(Number.status).all())
+
+def build_inventory_text_sync() -> str:
+    """Build the admin inventory overview text (blocking, run it off the event loop)"""
+    with db_session() as db:
+        # Get inventory statistics
+        status_counts = count_numbers_by_status(db)
+        total_numbers = sum(status_counts.values())
+        available_numbers = status_counts.get(NumberStatus.AVAILABLE, 0)
+        reserved_numbers = status_counts.get(NumberStatus.RESERVED, 0)
+        used_numbers = status_counts.get(NumberStatus.USED, 0)
+        
+        # Get numbers by service, available and total per service in one grouped query
+        services = db.query(Service).filter(Service.active == True).all()
+        service_counts = {
+            service_id: (available_count, total_count)
+            for service_id, available_count, total_count in db.query(
+                Number.service_id,
+                func.count(Number.id).filter(Number.status == NumberStatus.AVAILABLE),
+                func.count(Number.id)
+            ).group_by(Number.service_id).all()
+        }
+        
+        text_parts = [
+            f"📦 إدارة المخزون\n\n",
+            f"📊 الإحصائيات العامة:\n",
+            f"• إجمالي الأرقام: {total_numbers}\n",
+            f"• ✅ متاحة: {available_numbers}\n",
+            f"• 🔒 محجوزة: {reserved_numbers}\n",
+            f"• ❌ مستخدمة: {used_numbers}\n\n",
+            f"📱 الأرقام حسب الخدمة:\n",
+        ]
+        for service in services:
+            service_available, service_total = service_counts.get(service.id, (0, 0))
+            text_parts.append(f"{service.emoji} {service.name}: {service_available}/{service_total}\n")
+        
+        return "".join(text_parts)
+
 @dp.callback_query(F.data == "admin_inventory")
 async def admin_inventory_handler(callback: CallbackQuery):
     """Handle admin inventory management"""
@@ -3580,94 +4323,103 @@ async def admin_inventory_handler(callback: CallbackQuery):
         await callback.answer("❌ انتهت صلاحية الجلسة")
         return
     
-    db = get_db()
-    try:
-        # Get inventory statistics
-        total_numbers = db.query(Number).count()
-        available_numbers = db.query(Number).filter(Number.status == NumberStatus.AVAILABLE).count()
-        reserved_numbers = db.query(Number).filter(Number.status == NumberStatus.RESERVED).count()
-        used_numbers = db.query(Number).filter(Number.status == NumberStatus.USED).count()
-        
-        # Get numbers by service
-        services = db.query(Service).filter(Service.active == True).all()
-        
-        text = f"📦 إدارة المخزون\n\n"
-        text += f"📊 الإحصائيات العامة:\n"
-        text += f"• إجمالي الأرقام: {total_numbers}\n"
-        text += f"• ✅ متاحة: {available_numbers}\n"
-        text += f"• 🔒 محجوزة: {reserved_numbers}\n"
-        text += f"• ❌ مستخدمة: {used_numbers}\n\n"
-        
-        text += f"📱 الأرقام حسب الخدمة:\n"
-        for service in services:
-            service_total = db.query(Number).filter(Number.service_id == service.id).count()
-            service_available = db.query(Number).filter(
-                Number.service_id == service.id,
-                Number.status == NumberStatus.AVAILABLE
-            ).count()
-            
-            text += f"{service.emoji} {service.name}: {service_available}/{service_total}\n"
-        
-        keyboard = InlineKeyboardBuilder()
-        keyboard.row(
-            InlineKeyboardButton(text="📊 تفاصيل الخدمات", callback_data="admin_inventory_services"),
-            InlineKeyboardButton(text="🌍 تفاصيل الدول", callback_data="admin_inventory_countries")
-        )
-        keyboard.row(
-            InlineKeyboardButton(text="➕ إضافة أرقام", callback_data="admin_add_numbers"),
-            InlineKeyboardButton(text="🗑 تنظيف الأرقام", callback_data="admin_cleanup_numbers")
-        )
-        keyboard.row(InlineKeyboardButton(text="🔙 لوحة الإدارة", callback_data="admin"))
-        
-        if callback.message:
-            await callback.message.edit_text(text, reply_markup=keyboard.as_markup())
-        
-    finally:
-        db.close()
+    acknowledge_callback(callback)
+    
+    text = await asyncio.to_thread(get_admin_stats_text, "inventory", build_inventory_text_sync)
+    
+    keyboard = InlineKeyboardBuilder()
+    keyboard.row(
+        InlineKeyboardButton(text="📊 تفاصيل الخدمات", callback_data="admin_inventory_services"),
+        InlineKeyboardButton(text="🌍 تفاصيل الدول", callback_data="admin_inventory_countries")
+    )
+    keyboard.row(
+        InlineKeyboardButton(text="➕ إضافة أرقام", callback_data="admin_add_numbers"),
+        InlineKeyboardButton(text="🗑 تنظيف الأرقام", callback_data="admin_cleanup_numbers")
+    )
+    keyboard.row(InlineKeyboardButton(text="🔙 لوحة الإدارة", callback_data="admin"))
+    
+    if callback.message:
+        await callback.message.edit_text(text, reply_markup=keyboard.as_markup())
 
-@dp.callback_query(F.data == "admin_inventory_services")
+def parse_inventory_page(callback_data: str) -> int:
+    """Read the page number from admin inventory callback data such as 'admin_inventory_countries:2'"""
+    _, _, page = callback_data.partition(":")
+    return int(page) if page.isdigit() else 0
+
+def inventory_pagination_row(callback_prefix: str, page: int, total_pages: int) -> List[InlineKeyboardButton]:
+    """Previous/next buttons for an admin inventory listing, skipping the ones past either edge"""
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(text="⏮️ السابق", callback_data=f"{callback_prefix}:{page - 1}"))
+    if total_pages > 1:
+        buttons.append(InlineKeyboardButton(text=f"📄 {page + 1}/{total_pages}", callback_data="no_action"))
+    if page + 1 < total_pages:
+        buttons.append(InlineKeyboardButton(text="⏭️ التالي", callback_data=f"{callback_prefix}:{page + 1}"))
+    return buttons
+
+@dp.callback_query(F.data.startswith("admin_inventory_services"))
 async def admin_inventory_services_handler(callback: CallbackQuery):
-    """Handle admin inventory by services"""
+    """Handle admin inventory by services, one page of services at a time"""
     if not is_admin_session_valid(callback.from_user.id):
         await callback.answer("❌ انتهت صلاحية الجلسة")
         return
     
+    acknowledge_callback(callback)
+    
     db = get_db()
     try:
-        services = db.query(Service).filter(Service.active == True).all()
+        services_count = db.query(func.count(Service.id)).filter(Service.active == True).scalar()
+        total_pages = max((services_count + INVENTORY_SERVICES_PAGE_SIZE - 1) // INVENTORY_SERVICES_PAGE_SIZE, 1)
+        page = min(parse_inventory_page(callback.data), total_pages - 1)
+        
+        shown_services = db.query(Service).filter(
+            Service.active == True
+        ).order_by(Service.id).offset(page * INVENTORY_SERVICES_PAGE_SIZE).limit(INVENTORY_SERVICES_PAGE_SIZE).all()
+        shown_service_ids = [service.id for service in shown_services]
         
-        text = f"📊 تفاصيل المخزون حسب الخدمات\n\n"
+        # Countries of the shown services in one query, grouped per service
+        countries_by_service = {}
+        for country in db.query(ServiceCountry).filter(
+            ServiceCountry.service_id.in_(shown_service_ids),
+            ServiceCountry.active == True
+        ).order_by(ServiceCountry.id).all():
+            countries_by_service.setdefault(country.service_id, []).append(country)
+        
+        # Available and total numbers per (service, country) in one grouped query
+        number_counts = {
+            (service_id, country_code): (available_count, total_count)
+            for service_id, country_code, available_count, total_count in db.query(
+                Number.service_id,
+                Number.country_code,
+                func.count(Number.id).filter(Number.status == NumberStatus.AVAILABLE),
+                func.count(Number.id)
+            ).filter(
+                Number.service_id.in_(shown_service_ids)
+            ).group_by(Number.service_id, Number.country_code).all()
+        }
         
-        for service in services[:5]:  # Limit to first 5 services for better performance
-            text += f"{service.emoji} {service.name}:\n"
-            
-            # Get countries for this service with limit
-            countries = db.query(ServiceCountry).filter(
-                ServiceCountry.service_id == service.id,
-                ServiceCountry.active == True
-            ).limit(5).all()  # Limit countries per service
+        text_parts = [f"📊 تفاصيل المخزون حسب الخدمات\n\n"]
+        
+        for service in shown_services:
+            text_parts.append(f"{service.emoji} {service.name}:\n")
             
-            for country in countries:
-                available_count = db.query(Number).filter(
-                    Number.service_id == service.id,
-                    Number.country_code == country.country_code,
-                    Number.status == NumberStatus.AVAILABLE
-                ).count()
-                
-                total_count = db.query(Number).filter(
-                    Number.service_id == service.id,
-                    Number.country_code == country.country_code
-                ).count()
+            service_countries = countries_by_service.get(service.id, [])
+            for country in service_countries[:5]:  # Limit countries per service; the countries view lists them all
+                available_count, total_count = number_counts.get((service.id, country.country_code), (0, 0))
                 
                 status = "✅" if available_count > 0 else "❌"
-                text += f"  {country.flag} {country.country_name}: {status} {available_count}/{total_count}\n"
+                text_parts.append(f"  {country.flag} {country.country_name}: {status} {available_count}/{total_count}\n")
             
-            text += "\n"
-        
-        if len(services) > 5:
-            text += f"... وعرض {len(services) - 5} خدمة أخرى (للأداء الأفضل)\n\n"
+            if len(service_countries) > 5:
+                text_parts.append(f"  ... و {len(service_countries) - 5} دولة أخرى\n")
+            
+            text_parts.append("\n")
+        text = "".join(text_parts)
         
         keyboard = InlineKeyboardBuilder()
+        nav_buttons = inventory_pagination_row("admin_inventory_services", page, total_pages)
+        if nav_buttons:
+            keyboard.row(*nav_buttons)
         keyboard.row(InlineKeyboardButton(text="🔙 المخزون", callback_data="admin_inventory"))
         
         if callback.message:
@@ -3676,31 +4428,53 @@ async def admin_inventory_services_handler(callback: CallbackQuery):
     finally:
         db.close()
 
-@dp.callback_query(F.data == "admin_inventory_countries")
+@dp.callback_query(F.data.startswith("admin_inventory_countries"))
 async def admin_inventory_countries_handler(callback: CallbackQuery):
-    """Handle admin inventory by countries"""
+    """Handle admin inventory by countries, one page of countries at a time"""
     if not is_admin_session_valid(callback.from_user.id):
         await callback.answer("❌ انتهت صلاحية الجلسة")
         return
     
+    acknowledge_callback(callback)
+    
     db = get_db()
     try:
-        # Get all countries with their total numbers
-        countries_data = db.query(ServiceCountry.country_name, ServiceCountry.country_code, ServiceCountry.flag).distinct().all()
+        countries_query = db.query(
+            ServiceCountry.country_name, ServiceCountry.country_code, ServiceCountry.flag
+        ).distinct()
+        total_pages = max((countries_query.count() + PAGE_SIZE - 1) // PAGE_SIZE, 1)
+        page = min(parse_inventory_page(callback.data), total_pages - 1)
+        
+        # Only the countries on this page, in a stable order
+        countries_data = countries_query.order_by(
+            ServiceCountry.country_name, ServiceCountry.country_code, ServiceCountry.flag
+        ).offset(page * PAGE_SIZE).limit(PAGE_SIZE).all()
+        
+        # Available and total numbers for this page's countries in one grouped query
+        number_counts = {
+            country_code: (available_count, total_count)
+            for country_code, available_count, total_count in db.query(
+                Number.country_code,
+                func.count(Number.id).filter(Number.status == NumberStatus.AVAILABLE),
+                func.count(Number.id)
+            ).filter(
+                Number.country_code.in_({country_code for _, country_code, _ in countries_data})
+            ).group_by(Number.country_code).all()
+        }
         
-        text = f"🌍 تفاصيل المخزون حسب الدول\n\n"
+        text_parts = [f"🌍 تفاصيل المخزون حسب الدول\n\n"]
         
         for country_name, country_code, flag in countries_data:
-            total_numbers = db.query(Number).filter(Number.country_code == country_code).count()
-            available_numbers = db.query(Number).filter(
-                Number.country_code == country_code,
-                Number.status == NumberStatus.AVAILABLE
-            ).count()
+            available_numbers, total_numbers = number_counts.get(country_code, (0, 0))
             
             status = "✅" if available_numbers > 0 else "❌"
-            text += f"{flag} {country_name} ({country_code}): {status} {available_numbers}/{total_numbers}\n"
+            text_parts.append(f"{flag} {country_name} ({country_code}): {status} {available_numbers}/{total_numbers}\n")
+        text = "".join(text_parts)
         
         keyboard = InlineKeyboardBuilder()
+        nav_buttons = inventory_pagination_row("admin_inventory_countries", page, total_pages)
+        if nav_buttons:
+            keyboard.row(*nav_buttons)
         keyboard.row(InlineKeyboardButton(text="🔙 المخزون", callback_data="admin_inventory"))
         
         if callback.message:
@@ -3709,23 +4483,15 @@ async def admin_inventory_countries_handler(callback: CallbackQuery):
     finally:
         db.close()
 
-@dp.callback_query(F.data == "admin_numbers")
-async def admin_numbers_handler(callback: CallbackQuery):
-    """Handle admin numbers management"""
-    if not is_admin_session_valid(callback.from_user.id):
-        await callback.answer("❌ انتهت صلاحية الجلسة")
-        return
-    
-    # Show loading indicator
-    await callback.answer("🔄 جاري تحميل إحصائيات الأرقام...")
-    
-    db = get_db()
-    try:
+def build_numbers_stats_text_sync() -> str:
+    """Build the admin numbers statistics text (blocking, run it off the event loop)"""
+    with db_session() as db:
         # Get number statistics
-        total_numbers = db.query(Number).count()
-        available_numbers = db.query(Number).filter(Number.status == NumberStatus.AVAILABLE).count()
-        reserved_numbers = db.query(Number).filter(Number.status == NumberStatus.RESERVED).count()
-        used_numbers = db.query(Number).filter(Number.status == NumberStatus.USED).count()
+        status_counts = count_numbers_by_status(db)
+        total_numbers = sum(status_counts.values())
+        available_numbers = status_counts.get(NumberStatus.AVAILABLE, 0)
+        reserved_numbers = status_counts.get(NumberStatus.RESERVED, 0)
+        used_numbers = status_counts.get(NumberStatus.USED, 0)
         
         text = f"📱 إدارة الأرقام\n\n"
         text += f"📊 الإحصائيات:\n"
@@ -3734,21 +4500,32 @@ async def admin_numbers_handler(callback: CallbackQuery):
         text += f"• محجوزة: {reserved_numbers}\n"
         text += f"• مستخدمة: {used_numbers}\n"
         
-        keyboard = InlineKeyboardBuilder()
-        keyboard.row(
-            InlineKeyboardButton(text="➕ إضافة أرقام", callback_data="admin_add_numbers"),
-            InlineKeyboardButton(text="📋 عرض الأرقام", callback_data="admin_list_numbers")
-        )
-        keyboard.row(
-            InlineKeyboardButton(text="🗑 تنظيف الأرقام", callback_data="admin_cleanup_menu"),
-            InlineKeyboardButton(text="📊 إحصائيات تفصيلية", callback_data="admin_inventory")
-        )
-        keyboard.row(InlineKeyboardButton(text="🔙 لوحة الإدارة", callback_data="admin"))
-        
-        await callback.message.edit_text(text, reply_markup=keyboard.as_markup())
-        
-    finally:
-        db.close()
+        return text
+
+@dp.callback_query(F.data == "admin_numbers")
+async def admin_numbers_handler(callback: CallbackQuery):
+    """Handle admin numbers management"""
+    if not is_admin_session_valid(callback.from_user.id):
+        await callback.answer("❌ انتهت صلاحية الجلسة")
+        return
+    
+    # Show loading indicator
+    acknowledge_callback(callback, "🔄 جاري تحميل إحصائيات الأرقام...")
+    
+    text = await asyncio.to_thread(get_admin_stats_text, "numbers", build_numbers_stats_text_sync)
+    
+    keyboard = InlineKeyboardBuilder()
+    keyboard.row(
+        InlineKeyboardButton(text="➕ إضافة أرقام", callback_data="admin_add_numbers"),
+        InlineKeyboardButton(text="📋 عرض الأرقام", callback_data="admin_list_numbers")
+    )
+    keyboard.row(
+        InlineKeyboardButton(text="🗑 تنظيف الأرقام", callback_data="admin_cleanup_menu"),
+        InlineKeyboardButton(text="📊 إحصائيات تفصيلية", callback_data="admin_inventory")
+    )
+    keyboard.row(InlineKeyboardButton(text="🔙 لوحة الإدارة", callback_data="admin"))
+    
+    await callback.message.edit_text(text, reply_markup=keyboard.as_markup())
 
 @dp.callback_query(F.data == "admin_channels")
 async def admin_channels_handler(callback: CallbackQuery):
@@ -3757,19 +4534,22 @@ async def admin_channels_handler(callback: CallbackQuery):
         await callback.answer("❌ انتهت صلاحية الجلسة")
         return
     
+    acknowledge_callback(callback)
+    
     db = get_db()
     try:
         channels = db.query(Channel).all()
         
-        text = "📢 إدارة القنوات\n\n"
+        text_parts = ["📢 إدارة القنوات\n\n"]
         if channels:
-            text += "القنوات الحالية:\n"
+            text_parts.append("القنوات الحالية:\n")
             for channel in channels:
                 status = "✅" if channel.active else "❌"
-                text += f"{status} {channel.title} - {channel.reward_amount} وحدة\n"
-                text += f"   🔗 {channel.username_or_link}\n\n"
+                text_parts.append(f"{status} {channel.title} - {channel.reward_amount} وحدة\n")
+                text_parts.append(f"   🔗 {channel.username_or_link}\n\n")
         else:
-            text += "لا توجد قنوات مضافة\n"
+            text_parts.append("لا توجد قنوات مضافة\n")
+        text = "".join(text_parts)
         
         keyboard = InlineKeyboardBuilder()
         keyboard.row(
@@ -3790,6 +4570,36 @@ async def admin_channels_handler(callback: CallbackQuery):
     finally:
         db.close()
 
+def reset_expired_reservations(db_session, service_id: Optional[int] = None, country_code: Optional[str] = None) -> int:
+    """Expire overdue reservations and release their numbers in two bulk UPDATEs; returns the numbers released"""
+    conditions = [
+        Reservation.status == ReservationStatus.WAITING_CODE,
+        Reservation.expired_at < datetime.now()
+    ]
+    if service_id is not None:
+        conditions.append(Reservation.number_id.in_(
+            select(Number.id).where(Number.service_id == service_id, Number.country_code == country_code)
+        ))
+    
+    number_ids = db_session.execute(
+        update(Reservation).where(*conditions).values(
+            status=ReservationStatus.EXPIRED
+        ).returning(Reservation.number_id),
+        execution_options={"synchronize_session": False}
+    ).scalars().all()
+    if not number_ids:
+        return 0
+    
+    return db_session.execute(
+        update(Number).where(Number.id.in_(number_ids)).values(
+            status=NumberStatus.AVAILABLE,
+            reserved_by_user_id=None,
+            reserved_at=None,
+            expires_at=None
+        ),
+        execution_options={"synchronize_session": False}
+    ).rowcount
+
 @dp.callback_query(F.data == "admin_cleanup_numbers")
 async def admin_cleanup_numbers_handler(callback: CallbackQuery):
     """Cleanup old used numbers"""
@@ -3805,29 +4615,13 @@ async def admin_cleanup_numbers_handler(callback: CallbackQuery):
         deleted_count = db.query(Number).filter(
             Number.status == NumberStatus.USED,
             Number.code_received_at < cutoff_date
-        ).delete()
+        ).delete(synchronize_session=False)
         
         # Reset expired reservations
-        expired_reservations = db.query(Reservation).filter(
-            Reservation.status == ReservationStatus.WAITING_CODE,
-            Reservation.expired_at < datetime.now()
-        ).all()
-        
-        reset_count = 0
-        for reservation in expired_reservations:
-            # Reset number status
-            number = db.query(Number).filter(Number.id == reservation.number_id).first()
-            if number:
-                number.status = NumberStatus.AVAILABLE
-                number.reserved_by_user_id = None
-                number.reserved_at = None
-                number.expires_at = None
-                reset_count += 1
-            
-            # Update reservation status
-            reservation.status = ReservationStatus.EXPIRED
+        reset_count = reset_expired_reservations(db)
         
         db.commit()
+        admin_stats_cache.clear()
         
         await callback.answer(
             f"✅ تم حذف {deleted_count} رقم قديم وإعادة تعيين {reset_count} حجز منتهي الصلاحية",
@@ -3845,14 +4639,12 @@ async def admin_cleanup_numbers_handler(callback: CallbackQuery):
         db.close()
 
 @dp.callback_query(F.data == "admin_cleanup_menu")
-async def admin_cleanup_menu_handler(callback: CallbackQuery):
+async def admin_cleanup_menu_handler(callback: CallbackQuery, lang_code: str = 'ar'):
     """Show cleanup options menu"""
     if not is_admin_session_valid(callback.from_user.id):
         await callback.answer("❌ انتهت صلاحية الجلسة")
         return
     
-    lang_code = get_user_language(str(callback.from_user.id))
-    
     db = get_db()
     try:
         # Get unique service-country combinations with number counts
@@ -3881,6 +4673,7 @@ async def admin_cleanup_menu_handler(callback: CallbackQuery):
         keyboard = InlineKeyboardBuilder()
         
         # Add service-country combinations
+        service_names = get_texts((combination[1] for combination in combinations[:20]), lang_code)
         for service_id, service_name, emoji, country_name, country_code, flag in combinations[:20]:  # Limit to 20 for performance
             # Count numbers for this combination
             used_count = db.query(Number).filter(
@@ -3890,9 +4683,9 @@ async def admin_cleanup_menu_handler(callback: CallbackQuery):
             ).count()
             
             if used_count > 0:
-                text += f"{emoji} {flag} {await get_text(service_name, lang_code)} - {country_name}: {used_count} رقم مستخدم\n"
+                text += f"{emoji} {flag} {service_names[service_name]} - {country_name}: {used_count} رقم مستخدم\n"
                 
-                button_text = f"{emoji} {flag} {await get_text(service_name, lang_code)[:10]}"
+                button_text = f"{emoji} {flag} {service_names[service_name][:10]}"
                 callback_data = f"cleanup_{service_id}_{country_code}"
                 keyboard.row(InlineKeyboardButton(text=button_text, callback_data=callback_data))
         
@@ -3909,7 +4702,7 @@ async def admin_cleanup_menu_handler(callback: CallbackQuery):
         db.close()
 
 @dp.callback_query(F.data.startswith("cleanup_"))
-async def admin_cleanup_specific_handler(callback: CallbackQuery):
+async def admin_cleanup_specific_handler(callback: CallbackQuery, lang_code: str = 'ar'):
     """Handle specific service-country cleanup"""
     if not is_admin_session_valid(callback.from_user.id):
         await callback.answer("❌ انتهت صلاحية الجلسة")
@@ -3924,8 +4717,6 @@ async def admin_cleanup_specific_handler(callback: CallbackQuery):
     service_id = int(parts[1])
     country_code = parts[2]
     
-    lang_code = get_user_language(str(callback.from_user.id))
-    
     db = get_db()
     try:
         # Get service and country info
@@ -3947,30 +4738,15 @@ async def admin_cleanup_specific_handler(callback: CallbackQuery):
             Number.country_code == country_code,
             Number.status == NumberStatus.USED,
             Number.code_received_at < cutoff_date
-        ).delete()
+        ).delete(synchronize_session=False)
         
         # Reset expired reservations for this combination
-        expired_reservations = db.query(Reservation).join(Number).filter(
-            Number.service_id == service_id,
-            Number.country_code == country_code,
-            Reservation.status == ReservationStatus.WAITING_CODE,
-            Reservation.expired_at < datetime.now()
-        ).all()
-        
-        reset_count = 0
-        for reservation in expired_reservations:
-            number = db.query(Number).filter(Number.id == reservation.number_id).first()
-            if number:
-                number.status = NumberStatus.AVAILABLE
-                number.reserved_by_user_id = None
-                number.reserved_at = None
-                number.expires_at = None
-                reset_count += 1
-            reservation.status = ReservationStatus.EXPIRED
+        reset_count = reset_expired_reservations(db, service_id, country_code)
         
         db.commit()
+        admin_stats_cache.clear()
         
-        service_name = await get_text(service.name, lang_code)
+        service_name = get_text(service.name, lang_code)
         success_msg = await translator.translate_text(
             f"✅ تم تنظيف {service_name} - {country.country_name}\n"
             f"🗑 حذف: {deleted_count} رقم قديم\n"
@@ -3981,7 +4757,7 @@ async def admin_cleanup_specific_handler(callback: CallbackQuery):
         await callback.answer(success_msg, show_alert=True)
         
         # Return to cleanup menu
-        await admin_cleanup_menu_handler(callback)
+        await admin_cleanup_menu_handler(callback, lang_code)
         
     except Exception as e:
         logger.error(f"Error in specific cleanup: {e}")
@@ -4001,34 +4777,19 @@ async def admin_cleanup_all_handler(callback: CallbackQuery):
     await admin_cleanup_numbers_handler(callback)
 
 @dp.callback_query(F.data == "admin_cleanup_expired")
-async def admin_cleanup_expired_handler(callback: CallbackQuery):
+async def admin_cleanup_expired_handler(callback: CallbackQuery, lang_code: str = 'ar'):
     """Handle cleanup of only expired reservations"""
     if not is_admin_session_valid(callback.from_user.id):
         await callback.answer("❌ انتهت صلاحية الجلسة")
         return
     
-    lang_code = get_user_language(str(callback.from_user.id))
-    
     db = get_db()
     try:
         # Reset expired reservations only
-        expired_reservations = db.query(Reservation).filter(
-            Reservation.status == ReservationStatus.WAITING_CODE,
-            Reservation.expired_at < datetime.now()
-        ).all()
-        
-        reset_count = 0
-        for reservation in expired_reservations:
-            number = db.query(Number).filter(Number.id == reservation.number_id).first()
-            if number:
-                number.status = NumberStatus.AVAILABLE
-                number.reserved_by_user_id = None
-                number.reserved_at = None
-                number.expires_at = None
-                reset_count += 1
-            reservation.status = ReservationStatus.EXPIRED
+        reset_count = reset_expired_reservations(db)
         
         db.commit()
+        admin_stats_cache.clear()
         
         success_msg = await translator.translate_text(
             f"✅ تم إعادة تعيين {reset_count} حجز منتهي الصلاحية فقط",
@@ -4038,7 +4799,7 @@ async def admin_cleanup_expired_handler(callback: CallbackQuery):
         await callback.answer(success_msg, show_alert=True)
         
         # Return to cleanup menu
-        await admin_cleanup_menu_handler(callback)
+        await admin_cleanup_menu_handler(callback, lang_code)
         
     except Exception as e:
         logger.error(f"Error cleaning expired reservations: {e}")
@@ -4047,6 +4808,25 @@ async def admin_cleanup_expired_handler(callback: CallbackQuery):
     finally:
         db.close()
 
+def count_scalar(model, *conditions):
+    """Scalar subquery counting rows of a model, optionally filtered"""
+    return select(func.count(model.id)).where(*conditions).scalar_subquery()
+
+# Built once so every stats refresh reuses the same statement and its compiled SQL, in one round trip
+ADMIN_GENERAL_STATS_QUERY = select(
+    count_scalar(User).label("total_users"),
+    count_scalar(User, User.is_banned == False).label("active_users"),
+    count_scalar(Service).label("total_services"),
+    count_scalar(Service, Service.active == True).label("active_services"),
+    count_scalar(Number).label("total_numbers"),
+    count_scalar(Number, Number.status == NumberStatus.AVAILABLE).label("available_numbers"),
+    count_scalar(Reservation).label("total_reservations"),
+    count_scalar(Reservation, Reservation.status == ReservationStatus.COMPLETED).label("completed_reservations"),
+    count_scalar(Channel).label("total_channels"),
+    count_scalar(Transaction).label("total_transactions"),
+    count_scalar(Transaction, Transaction.type == TransactionType.PURCHASE).label("total_revenue"),
+)
+
 @dp.callback_query(F.data == "admin_stats")
 async def admin_stats_handler(callback: CallbackQuery):
     """Handle admin statistics"""
@@ -4054,22 +4834,14 @@ async def admin_stats_handler(callback: CallbackQuery):
         await callback.answer("❌ انتهت صلاحية الجلسة")
         return
     
+    acknowledge_callback(callback)
+    
     db = get_db()
     try:
-        # Get general statistics
-        total_users = db.query(User).count()
-        active_users = db.query(User).filter(User.is_banned == False).count()
-        total_services = db.query(Service).count()
-        active_services = db.query(Service).filter(Service.active == True).count()
-        total_numbers = db.query(Number).count()
-        available_numbers = db.query(Number).filter(Number.status == NumberStatus.AVAILABLE).count()
-        total_reservations = db.query(Reservation).count()
-        completed_reservations = db.query(Reservation).filter(Reservation.status == ReservationStatus.COMPLETED).count()
-        total_channels = db.query(Channel).count()
-        
-        # Get transaction statistics
-        total_transactions = db.query(Transaction).count()
-        total_revenue = db.query(Transaction).filter(Transaction.type == TransactionType.PURCHASE).count()
+        # Get general and transaction statistics in one statement
+        (total_users, active_users, total_services, active_services, total_numbers, available_numbers,
+         total_reservations, completed_reservations, total_channels, total_transactions,
+         total_revenue) = db.execute(ADMIN_GENERAL_STATS_QUERY).one()
         
         text = f"📊 الإحصائيات العامة\n\n"
         text += f"👥 المستخدمين:\n"
@@ -4113,7 +4885,7 @@ async def admin_stats_refresh_handler(callback: CallbackQuery):
         return
     
     # Show loading
-    await callback.answer("🔄 جاري تحديث الإحصائيات...")
+    acknowledge_callback(callback, "🔄 جاري تحديث الإحصائيات...")
     
     # Call the main stats handler
     await admin_stats_handler(callback)
@@ -4143,6 +4915,8 @@ async def admin_list_users_handler(callback: CallbackQuery):
         await callback.answer("❌ انتهت صلاحية الجلسة")
         return
     
+    acknowledge_callback(callback)
+    
     db = get_db()
     try:
         # Optimize user list query with pagination
@@ -4224,20 +4998,24 @@ async def handle_broadcast_message(message: types.Message, state: FSMContext):
                 await message.reply("❌ فشل في إرسال الرسالة")
         else:
             # Send broadcast message
-            users = db.query(User).filter(User.is_banned == False).all()
+            telegram_ids = [
+                int(telegram_id) for (telegram_id,) in
+                db.query(User.telegram_id).filter(User.is_banned == False).all()
+            ]
             
-            sent_count = 0
-            failed_count = 0
+            await message.reply(f"⏳ بدء إرسال الرسالة إلى {len(telegram_ids)} مستخدم...")
             
-            await message.reply(f"⏳ بدء إرسال الرسالة إلى {len(users)} مستخدم...")
+            results = await asyncio.gather(
+                *[send_message_limited(telegram_id, broadcast_text) for telegram_id in telegram_ids],
+                return_exceptions=True
+            )
             
-            for user in users:
-                try:
-                    await bot.send_message(int(user.telegram_id), broadcast_text)
-                    sent_count += 1
-                except Exception as e:
-                    logger.error(f"Failed to send broadcast to {user.telegram_id}: {e}")
+            failed_count = 0
+            for telegram_id, result in zip(telegram_ids, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Failed to send broadcast to {telegram_id}: {result}")
                     failed_count += 1
+            sent_count = len(telegram_ids) - failed_count
             
             await message.reply(
                 f"✅ تم إرسال الرسالة الجماعية!\n\n"
@@ -4394,6 +5172,7 @@ async def delete_channel_confirm_handler(callback: CallbackQuery):
         channel_title = channel.title
         db.delete(channel)
         db.commit()
+        invalidate_rewards_cache()
         
         await callback.answer(
             f"✅ تم حذف قناة {channel_title}\n"
@@ -4418,6 +5197,8 @@ async def admin_groups_handler(callback: CallbackQuery):
         await callback.answer("❌ انتهت صلاحية الجلسة")
         return
     
+    acknowledge_callback(callback)
+    
     db = get_db()
     try:
         groups = db.query(Group).all()
@@ -4506,6 +5287,7 @@ async def delete_group_confirm_handler(callback: CallbackQuery):
         group_title = group.title
         db.delete(group)
         db.commit()
+        invalidate_rewards_cache()
         
         await callback.answer(
             f"✅ تم حذف جروب {group_title}\n"
@@ -4530,6 +5312,8 @@ async def admin_list_channels_handler(callback: CallbackQuery):
         await callback.answer("❌ انتهت صلاحية الجلسة")
         return
     
+    acknowledge_callback(callback)
+    
     db = get_db()
     try:
         channels = db.query(Channel).all()
@@ -4579,7 +5363,7 @@ async def admin_list_services_handler(callback: CallbackQuery):
         return
     
     # Show loading indicator
-    await callback.answer("🔄 جاري تحميل قائمة الخدمات...")
+    acknowledge_callback(callback, "🔄 جاري تحميل قائمة الخدمات...")
     
     db = get_db()
     try:
@@ -4630,6 +5414,7 @@ async def toggle_service_handler(callback: CallbackQuery):
         
         service.active = not service.active
         db.commit()
+        invalidate_catalog_cache()
         
         status_text = "تفعيل" if service.active else "إيقاف"
         await callback.answer(f"✅ تم {status_text} خدمة {service.name}")
@@ -4726,6 +5511,8 @@ async def confirm_delete_service_handler(callback: CallbackQuery):
         # Delete the service
         db.delete(service)
         db.commit()
+        invalidate_service_cache(service_id)
+        invalidate_catalog_cache()
         
         await callback.answer(f"✅ تم حذف خدمة {service_name}", show_alert=True)
         
@@ -4775,6 +5562,8 @@ async def force_delete_service_handler(callback: CallbackQuery):
         # Delete the service
         db.delete(service)
         db.commit()
+        invalidate_service_cache(service_id)
+        invalidate_catalog_cache()
         
         await callback.answer(
             f"✅ تم حذف خدمة {service_name}\n"
@@ -4942,6 +5731,7 @@ async def process_edit_service_name(message: types.Message, state: FSMContext):
         old_name = service.name
         service.name = new_name
         db.commit()
+        invalidate_catalog_cache()
         
         await state.clear()
         await message.reply(
@@ -4980,6 +5770,7 @@ async def process_edit_service_emoji(message: types.Message, state: FSMContext):
         old_emoji = service.emoji
         service.emoji = new_emoji
         db.commit()
+        invalidate_catalog_cache()
         
         await state.clear()
         await message.reply(
@@ -5023,6 +5814,7 @@ async def process_edit_service_price(message: types.Message, state: FSMContext):
         old_price = service.default_price
         service.default_price = new_price
         db.commit()
+        invalidate_catalog_cache()
         
         await state.clear()
         await message.reply(
@@ -5062,6 +5854,7 @@ async def process_edit_service_description(message: types.Message, state: FSMCon
         old_description = service.description or "غير محدد"
         service.description = new_description
         db.commit()
+        invalidate_catalog_cache()
         
         await state.clear()
         
@@ -5097,6 +5890,7 @@ async def ban_user_handler(callback: CallbackQuery):
         
         user.is_banned = True
         db.commit()
+        admin_stats_cache.pop("users", None)
         
         await callback.answer(f"✅ تم حظر المستخدم {user.first_name or user.username}")
         
@@ -5127,6 +5921,7 @@ async def unban_user_handler(callback: CallbackQuery):
         
         user.is_banned = False
         db.commit()
+        admin_stats_cache.pop("users", None)
         
         await callback.answer(f"✅ تم إلغاء حظر المستخدم {user.first_name or user.username}")
         
@@ -5180,16 +5975,35 @@ async def quick_deduct_balance_handler(callback: CallbackQuery, state: FSMContex
     )
 
 # Improved group verification for service groups
+def cache_bot_group_status(group_chat_id: str, status: str) -> bool:
+    """Remember whether a member status makes the bot admin in a group"""
+    is_admin = status in ['administrator', 'creator']
+    bot_group_status_cache[str(group_chat_id)] = (time.monotonic() + BOT_GROUP_STATUS_TTL_SEC, is_admin)
+    return is_admin
+
+def invalidate_bot_group_status(group_chat_id: str):
+    """Drop the cached bot admin status of a group"""
+    bot_group_status_cache.pop(str(group_chat_id), None)
+
 async def verify_bot_in_group(group_chat_id: str) -> bool:
     """Verify if bot is admin in the group"""
+    cached = bot_group_status_cache.get(str(group_chat_id))
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    
     try:
         # Check if bot is admin in the group
         bot_member = await bot.get_chat_member(str(group_chat_id), bot.id)
-        return bot_member.status in ['administrator', 'creator']
+        return cache_bot_group_status(group_chat_id, bot_member.status)
     except Exception as e:
         logger.error(f"Error checking bot admin status in group {group_chat_id}: {e}")
         return False
 
+@dp.my_chat_member()
+async def bot_member_updated_handler(event: types.ChatMemberUpdated):
+    """Keep the bot group status cache in sync when the bot is promoted or removed"""
+    cache_bot_group_status(str(event.chat.id), event.new_chat_member.status)
+
 @dp.callback_query(F.data == "admin_countries")
 async def admin_countries_handler(callback: CallbackQuery):
     """Handle admin countries management"""
@@ -5197,6 +6011,8 @@ async def admin_countries_handler(callback: CallbackQuery):
         await callback.answer("❌ انتهت صلاحية الجلسة")
         return
     
+    acknowledge_callback(callback)
+    
     db = get_db()
     try:
         countries = db.query(Country).all()
@@ -5245,6 +6061,8 @@ async def admin_list_countries_handler(callback: CallbackQuery):
         await callback.answer("❌ انتهت صلاحية الجلسة")
         return
     
+    acknowledge_callback(callback)
+    
     db = get_db()
     try:
         countries = db.query(Country).all()
@@ -5301,6 +6119,8 @@ async def admin_messages_stats_handler(callback: CallbackQuery):
         await callback.answer("❌ انتهت صلاحية الجلسة")
         return
     
+    acknowledge_callback(callback)
+    
     db = get_db()
     try:
         # Get message statistics from service groups
@@ -5445,6 +6265,7 @@ async def handle_channel_reward(message: types.Message, state: FSMContext):
             )
             db.add(new_channel)
             db.commit()
+            invalidate_rewards_cache()
             
             await message.reply(
                 f"✅ تم إضافة القناة بنجاح!\n\n"
@@ -5520,6 +6341,7 @@ async def handle_country_code(message: types.Message, state: FSMContext):
         )
         db.add(new_country)
         db.commit()
+        invalidate_catalog_cache()
         
         await message.reply(
             f"✅ تم إضافة الدولة بنجاح!\n\n"
@@ -5560,6 +6382,8 @@ async def admin_export_data_handler(callback: CallbackQuery):
         await callback.answer("❌ انتهت صلاحية الجلسة")
         return
     
+    acknowledge_callback(callback)
+    
     db = get_db()
     try:
         # Get basic statistics for export summary
@@ -5688,6 +6512,7 @@ async def handle_numbers_input(message: types.Message, state: FSMContext):
             added_count += 1
         
         db.commit()
+        invalidate_catalog_cache()
         
         result_text = f"✅ تم إضافة الأرقام!\n\n"
         result_text += f"📱 تم إضافة: {added_count} رقم\n"
@@ -5737,6 +6562,7 @@ async def delete_country_handler(callback: CallbackQuery):
         country_name = country.name
         db.delete(country)
         db.commit()
+        invalidate_catalog_cache()
         
         await callback.answer(f"✅ تم حذف دولة {country_name}")
         
@@ -5747,12 +6573,49 @@ async def delete_country_handler(callback: CallbackQuery):
         db.close()
 
 # Initialize database
+# Columns added to tables after they were first created; create_all never alters existing tables
+SCHEMA_UPGRADES = (
+    "ALTER TABLE provider_messages "
+    "ADD COLUMN IF NOT EXISTS target_phone VARCHAR, "
+    "ADD COLUMN IF NOT EXISTS code_value VARCHAR",
+    "ALTER TABLE provider_messages "
+    "ADD COLUMN IF NOT EXISTS provider_id INTEGER REFERENCES providers(id), "
+    "ALTER COLUMN group_chat_id DROP NOT NULL",
+)
+
+# Merge duplicate reward rows into the oldest one, so the unique (user, channel/group) indexes can be built
+REWARD_DEDUPLICATION = tuple(
+    statement.format(table=table, fk=fk)
+    for table, fk in (("user_channel_rewards", "channel_id"), ("user_group_rewards", "group_id"))
+    for statement in (
+        "UPDATE {table} AS keep SET times_awarded = dup.times_awarded, last_award_at = dup.last_award_at "
+        "FROM (SELECT min(id) AS id, sum(coalesce(times_awarded, 0)) AS times_awarded, "
+        "max(last_award_at) AS last_award_at FROM {table} "
+        "GROUP BY user_id, {fk} HAVING count(*) > 1) AS dup WHERE keep.id = dup.id",
+        "DELETE FROM {table} AS extra USING {table} AS keep "
+        "WHERE extra.user_id = keep.user_id AND extra.{fk} = keep.{fk} AND extra.id > keep.id",
+    )
+)
+
 def init_db():
     """Initialize database tables"""
     try:
         Base.metadata.create_all(bind=engine)
         logger.info("Database tables created successfully")
         
+        # Bring tables created by older versions up to date before indexing the new columns
+        with engine.begin() as conn:
+            for statement in SCHEMA_UPGRADES + REWARD_DEDUPLICATION:
+                conn.execute(sql_text(statement))
+        
+        # create_all skips existing tables, so add indexes declared on them since
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                try:
+                    index.create(bind=engine, checkfirst=True)
+                except SQLAlchemyError as e:
+                    logger.warning(f"Could not create index {index.name}: {e}")
+        
         # Add default data
         db = get_db()
         try:
@@ -5815,21 +6678,41 @@ def init_db():
     except Exception as e:
         logger.error(f"Error initializing database: {e}")
 
+def warm_db_pool():
+    """Open the pooled connections up front so the first callbacks don't pay the connect cost"""
+    connections = []
+    try:
+        for _ in range(DB_POOL_SIZE):
+            connections.append(engine.connect())
+    except SQLAlchemyError as e:
+        logger.warning(f"Could not pre-warm database pool: {e}")
+    finally:
+        # Closing returns each connection to the pool, which keeps it open
+        for connection in connections:
+            connection.close()
+
 async def main():
     """Main function"""
     # Initialize database
     init_db()
+    warm_db_pool()
     
     # Set bot commands menu
     await set_bot_commands(bot)
     
+    # Close shared HTTP session on shutdown
+    dp.shutdown.register(close_http_session)
+    
     # Start background tasks
     asyncio.create_task(poll_provider_messages())
     asyncio.create_task(check_expired_reservations())
+    asyncio.create_task(provider_message_consumer())
+    asyncio.create_task(provider_message_writer())
     
     # Start bot
     logger.info("Starting bot...")
-    await dp.start_polling(bot)
+    # Request chat_member updates too, so admin status changes reach the cache
+    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, Enum, Index
 from sqlalchemy.types import DECIMAL
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
@@ -89,6 +89,11 @@ class Number(Base):
     code_received_at = Column(DateTime)
     price_override = Column(DECIMAL(12, 2))
     
+    __table_args__ = (
+        Index('ix_numbers_service_country_status', 'service_id', 'country_code', 'status'),
+        Index('ix_numbers_phone_service', 'phone_number', 'service_id'),
+    )
+    
     # Relationships
     service = relationship("Service", back_populates="numbers")
     reserved_by = relationship("User")
@@ -130,6 +135,11 @@ class Reservation(Base):
     expired_at = Column(DateTime)
     code_value = Column(String)
     
+    __table_args__ = (
+        Index('ix_reservations_status_expired_at', 'status', 'expired_at'),
+        Index('ix_reservations_number_status', 'number_id', 'status'),
+    )
+    
     # Relationships
     user = relationship("User", back_populates="reservations")
     service = relationship("Service", back_populates="reservations")
@@ -147,6 +157,11 @@ class Transaction(Base):
     
     # Relationships
     user = relationship("User", back_populates="transactions")
+    
+    __table_args__ = (
+        # my_balance lists a user's latest transactions with ORDER BY created_at DESC LIMIT 5
+        Index('ix_transactions_user_created_at', 'user_id', 'created_at'),
+    )
 
 class Channel(Base):
     __tablename__ = 'channels'
@@ -181,6 +196,11 @@ class UserChannelReward(Base):
     # Relationships
     user = relationship("User")
     channel = relationship("Channel")
+    
+    __table_args__ = (
+        # One reward row per user and channel, lets awards upsert with ON CONFLICT
+        Index('ix_user_channel_rewards_user_channel', 'user_id', 'channel_id', unique=True),
+    )
 
 class UserGroupReward(Base):
     __tablename__ = 'user_group_rewards'
@@ -194,6 +214,11 @@ class UserGroupReward(Base):
     # Relationships
     user = relationship("User")
     group = relationship("Group")
+    
+    __table_args__ = (
+        # One reward row per user and group, lets awards upsert with ON CONFLICT
+        Index('ix_user_group_rewards_user_group', 'user_id', 'group_id', unique=True),
+    )
 
 class SecurityMode(enum.Enum):
     TOKEN_ONLY = "token_only"
@@ -220,6 +245,10 @@ class ServiceGroup(Base):
     active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=func.now())
     
+    __table_args__ = (
+        Index('ix_service_groups_chat_active', 'group_chat_id', 'active'),
+    )
+    
     # Relationships
     service = relationship("Service")
 
@@ -228,14 +257,22 @@ class ProviderMessage(Base):
     
     id = Column(Integer, primary_key=True)
     service_id = Column(Integer, ForeignKey('services.id'))
-    group_chat_id = Column(String, nullable=False)
+    group_chat_id = Column(String)  # Set for messages read from a service group
+    provider_id = Column(Integer, ForeignKey('providers.id'))  # Set for messages fetched from a provider API
     sender_id = Column(String, nullable=False)
     message_text = Column(Text)
+    target_phone = Column(String)  # Phone number extracted at ingest time
+    code_value = Column(String)  # Code extracted at ingest time
     raw_payload = Column(Text)  # JSON payload
     received_at = Column(DateTime, default=func.now())
     status = Column(Enum(MessageStatus), default=MessageStatus.PENDING)
     processed_at = Column(DateTime)
     
+    __table_args__ = (
+        Index('ix_provider_messages_service_phone_received', 'service_id', 'target_phone', 'received_at'),
+        Index('ix_provider_messages_received_at', 'received_at'),
+    )
+    
     # Relationships
     service = relationship("Service")
 
@@ -250,6 +287,10 @@ class BlockedMessage(Base):
     reason = Column(String, nullable=False)
     created_at = Column(DateTime, default=func.now())
     
+    __table_args__ = (
+        Index('ix_blocked_messages_created_at', 'created_at'),
+    )
+    
     # Relationships
     service = relationship("Service")
 
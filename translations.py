@@ -464,6 +464,9 @@ STATIC_TRANSLATIONS = {
     }
 }
 
+# Maximum number of dynamic translations kept in memory
+TRANSLATION_CACHE_SIZE = 4096
+
 class TranslationManager:
     def __init__(self):
         try:
@@ -471,6 +474,7 @@ class TranslationManager:
         except Exception as e:
             print(f"Failed to initialize Google Translator: {e}")
             self.translator = None
+        self.translation_cache = {}  # {(text, target_lang, source_lang): translated_text}
         
     @lru_cache(maxsize=1000)
     def get_static_text(self, key: str, lang_code: str = 'ar') -> str:
@@ -494,6 +498,12 @@ class TranslationManager:
             if target_lang == source_lang:
                 return text
             
+            # Most calls translate the same fixed bot phrases, reuse earlier results
+            cache_key = (text, target_lang, source_lang)
+            cached = self.translation_cache.get(cache_key)
+            if cached is not None:
+                return cached
+            
             # Don't auto-skip Arabic translation - let Google Translate handle it
             # This ensures proper translation even when target is Arabic
                 
@@ -509,6 +519,10 @@ class TranslationManager:
             )
             
             if result and hasattr(result, 'text') and result.text:
+                if len(self.translation_cache) >= TRANSLATION_CACHE_SIZE:
+                    # Evict the oldest entry
+                    self.translation_cache.pop(next(iter(self.translation_cache)))
+                self.translation_cache[cache_key] = result.text
                 return result.text
             else:
                 print("Translation result is empty or invalid")